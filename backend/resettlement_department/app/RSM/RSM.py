@@ -10,38 +10,34 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from core.config import settings, RSM
+import asyncio
 import time
 import uuid
 import random
 import string
 from datetime import datetime, timedelta
-import multiprocessing
 from urllib.parse import urlencode, urljoin
-from concurrent.futures import ProcessPoolExecutor, as_completed
-import warnings
-import re
-import io
 from bs4 import BeautifulSoup
-import hashlib
-import itertools
 from fastapi import HTTPException
+from contextlib import contextmanager
+from pathlib import Path
+from RSM.async_client import AsyncRsmClient, RsmUnauthorized, fetch_intervals, split_dates, split_ids
+from RSM.async_client import split_interval as split_interval_tree
+from RSM.pow_solver import ALPHABET, solve_pow
+from RSM.token_manager import RsmTokenManager, Token
+from RSM.chunked_export import RsmExportClient, chunked_export, date_windows, window_name
 class RsmLogin:
 
     #алфавит из pOfw.js aaseta 
-    ALPHABET = "0123456789/+abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    ALPHABET = ALPHABET.decode("ascii")
 
     def find_suffix_pow(self, base: str, max_len=4, required_leading_zero_bytes=2):
         """
         Подбирает суффикс, такой что sha1(base + ':' + suffix) начинается с required_leading_zero_bytes нулей
         """
-        for length in range(1, max_len + 1):
-            for combo in itertools.product(self.ALPHABET, repeat=length):
-                suffix = ''.join(combo)
-                candidate = f"{base}:{suffix}"
-                digest = hashlib.sha1(candidate.encode("utf-8")).digest()
-                if digest.startswith(b'\x00' * required_leading_zero_bytes):
-                    return candidate
-        raise RuntimeError("Не найден рабочий proofOfWork")
+        return solve_pow(
+            base, required_leading_zero_bytes, max_len, workers=RSM.POW_WORKERS
+        )
 
 
     def get_pow(self, login, password):
@@ -260,13 +256,8 @@ def get_cookie():
     return cookie
 
 
-def check_token():
-    """
-    checks is the token from DB allowed now
-    if not - generates a new one
-    :return:
-    """
-    conn_params = {
+def _conn_params():
+    return {
         "dbname": settings.project_management_setting.DB_NAME,
         "user": settings.project_management_setting.DB_USER,
         "password": settings.project_management_setting.DB_PASSWORD,
@@ -274,52 +265,97 @@ def check_token():
         "port": settings.project_management_setting.DB_PORT,
     }
 
-    query = "SELECT value FROM env.env WHERE name = 'rsm_token' LIMIT 1;"
 
-    try:
-        with psycopg2.connect(**conn_params) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(query)
-                result = cursor.fetchone()
+class EnvTokenStore:
+    """
+    Токен РСМ в env.env (строка rsm_token): value - токен, updated_at - время получения,
+    NULL - токен отвергнут РСМ.
+    Блокировка между воркерами - advisory lock Postgres на время входа.
+    """
 
-                if result:
-                    value = result[0]
-                    print(f"Value: {value}")
+    LOCK_KEY = "rsm_token"
 
-                else:
-                    print("No value found.")
+    def load(self):
+        try:
+            with psycopg2.connect(**_conn_params()) as conn:
+                with conn.cursor() as cursor:
+                    # Возраст считает сама база, чтобы не зависеть от часовых поясов
+                    cursor.execute(
+                        "SELECT value, EXTRACT(EPOCH FROM NOW() - updated_at) FROM env.env WHERE name = 'rsm_token' LIMIT 1;"
+                    )
+                    result = cursor.fetchone()
+        except psycopg2.Error as e:
+            print(f"Database error: {e}")
+            return None
+        if not result or not result[0]:
+            print("No value found.")
+            return None
+        value, age = result
+        if age is None:
+            return Token(value, time.time(), stale=True)
+        return Token(value, time.time() - float(age))
+
+    def save(self, token):
+        try:
+            with psycopg2.connect(**_conn_params()) as conn:
+                with conn.cursor() as cursor:
+                    if token.stale:
+                        cursor.execute(
+                            "UPDATE env.env SET updated_at = NULL WHERE name = 'rsm_token' AND value = %s;",
+                            (token.value,),
+                        )
+                        return
+                    cursor.execute(
+                        "UPDATE env.env SET value = %s, updated_at = NOW() WHERE name = 'rsm_token';",
+                        (token.value,),
+                    )
+        except psycopg2.Error as e:
+            print(f"Database error: {e}")
+
+    @contextmanager
+    def lock(self):
+        conn = psycopg2.connect(**_conn_params())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_lock(hashtext(%s));", (self.LOCK_KEY,))
+            try:
+                yield
+            finally:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(hashtext(%s));", (self.LOCK_KEY,))
+        finally:
+            conn.close()
 
-    except psycopg2.Error as e:
-        print(f"Database error: {e}")
 
+def ping_token(value):
     response = requests.get(
-        RSM.PING_LINK, cookies={"Rsm.Cookie": value}, allow_redirects=False
+        RSM.PING_LINK, cookies={"Rsm.Cookie": value}, allow_redirects=False, timeout=60
     )
-    if response.status_code == 200:
-        return value
-    elif response.status_code == 302:
-        rsm_login = RsmLogin()
-        token = rsm_login.get_pow(RSM.LOGIN, RSM.PASS)
-        print(token)
-
-        query = f"""UPDATE env.env
-                SET value = '{token}',
-                    updated_at = NOW()
-                WHERE name = 'rsm_token';
-                """
+    # 302 - редирект на вход в СУДИР, токен истек
+    return response.status_code == 200
 
-        try:
-            with psycopg2.connect(**conn_params) as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute(query)
-                    conn.commit()
 
-        except psycopg2.Error as e:
-            print(f"Database error: {e}")
+def login_token():
+    return RsmLogin().get_pow(RSM.LOGIN, RSM.PASS)
 
-        return token
-    else:
-        return None
+
+token_manager = RsmTokenManager(
+    EnvTokenStore(),
+    ping_token,
+    login_token,
+    ttl=RSM.TOKEN_TTL,
+    refresh_margin=RSM.TOKEN_REFRESH_MARGIN,
+)
+
+
+def check_token():
+    """
+    actual RSM token: cached while it is expected to be alive,
+    refreshed in the background before expiry, login only once for all workers
+    :return:
+    """
+    return token_manager.get()
 
 
 def send_request(url, cookie):
@@ -331,25 +367,19 @@ def send_request(url, cookie):
         # pass
 
 
-def get_row_count(
-    dates, dates_type, category, session_key, layout_id, cookie, registered=None
-):
+def search_links(dates, dates_type, category, session_key, layout_id, registered=None):
     """
-    search a row count in requested data
+    ссылки поиска и количества строк для типа интервала
     :param dates:
-    :param dates_type:
+    :param dates_type: 1-3 - даты КПУ, 4 - APART_ID ресурса, 5 - даты выписок
     :param category:
     :param session_key:
     :param layout_id:
-    :param cookie:
     :param registered:
-    :return:
+    :return: (search_link, count_link)
     """
-
-    dates[0], dates[1] = dates
-
     if dates_type == 1:
-        search_link, count_link = search_kpu(
+        return search_kpu(
             session_key,
             layout_id,
             kpu_direction=category,
@@ -357,7 +387,7 @@ def get_row_count(
             registered=registered,
         )
     elif dates_type == 2:
-        search_link, count_link = search_kpu(
+        return search_kpu(
             session_key,
             layout_id,
             kpu_direction=category,
@@ -365,7 +395,7 @@ def get_row_count(
             registered=registered,
         )
     elif dates_type == 3:
-        search_link, count_link = search_kpu(
+        return search_kpu(
             session_key,
             layout_id,
             kpu_direction=category,
@@ -373,36 +403,54 @@ def get_row_count(
             registered=registered,
         )
     elif dates_type == 4:
-        search_link, count_link = search_kurs_living_space(
-            dates, layout_id, session_key
-        )
+        return search_kurs_living_space(dates, layout_id, session_key)
     elif dates_type == 5:
-        date_start, date_end = process_date_range(dates)
-        search_link, count_link = search_vypiski(dates, layout_id, session_key)
+        return search_vypiski(dates, layout_id, session_key)
+    raise ValueError(f"Неизвестный тип интервала: {dates_type}")
 
-    # a = requests.get(search_link,
-    #                  cookies={'Rsm.Cookie': cookie})
 
-    p = multiprocessing.Process(
-        target=send_request,
-        args=(
-            search_link,
-            cookie,
+def _run_rsm(cookie, run):
+    """Запускает корутину run(client); если РСМ отверг токен, менеджер токена узнает об этом."""
+    async def main():
+        async with AsyncRsmClient(cookie, concurrency=RSM.FETCH_CONCURRENCY) as client:
+            return await run(client)
+
+    try:
+        return asyncio.run(main())
+    except RsmUnauthorized:
+        token_manager.expire(cookie)
+        raise
+
+
+async def get_row_count(
+    client, dates, dates_type, category, layout_id, registered=None
+):
+    """
+    search a row count in requested data
+    :param client: AsyncRsmClient
+    :param dates:
+    :param dates_type:
+    :param category:
+    :param layout_id:
+    :param registered:
+    :return:
+    """
+    search_link, count_link = search_links(
+        list(dates), dates_type, category, generate_key(), layout_id, registered
+    )
+    return await client.row_count(search_link, count_link)
+
+
+def _split(interval, split, dates_type, category, cookie, layout_id, max_rows, registered):
+    return _run_rsm(
+        cookie,
+        lambda client: split_interval_tree(
+            interval,
+            lambda part: get_row_count(client, part, dates_type, category, layout_id, registered),
+            split,
+            max_rows,
         ),
     )
-    p.daemon = True  # Позволяет процессу завершаться вместе с родителем
-    p.start()
-    time.sleep(3)
-    # print("____40__")
-    c = requests.get(count_link, cookies={"Rsm.Cookie": cookie})
-    # print(c.text)
-    try:
-        count = int(c.text)
-    except ValueError as e:
-        print(c.text)
-        return 0
-    # print(c.text)
-    return count
 
 
 def split_interval(dates, dates_type, category, cookie, max_rows=1000, registered=None):
@@ -416,56 +464,10 @@ def split_interval(dates, dates_type, category, cookie, max_rows=1000, registere
     :param registered:
     :return:
     """
-    result_intervals = []
-
-    # Получаем session_key для текущего процесса
-    session_key = generate_key()
-
-    # Получаем количество строк для данного интервала
-
-    row_count = get_row_count(
-        dates, dates_type, category, session_key, RSM.COUNTER_LAYOUT, cookie, registered
+    return _split(
+        dates, split_dates, dates_type, category, cookie, RSM.COUNTER_LAYOUT, max_rows, registered
     )
 
-    # Если количество строк меньше max_rows, добавляем интервал в результат
-    if row_count <= max_rows:
-        result_intervals.append((dates[0], dates[1], row_count))
-    else:
-        # Определяем количество частей, на которые нужно разделить интервал
-        num_parts = (row_count // max_rows) + 1
-        interval_duration = (dates[1] - dates[0]) / num_parts
-
-        # Используем ProcessPoolExecutor для многопроцессорности
-        with ProcessPoolExecutor(max_workers=10) as executor:
-            future_intervals = []
-
-            # Делим интервал на `num_parts` частей и отправляем каждую часть в параллельный процесс
-            for ii in range(num_parts):
-                part_start = dates[0] + ii * interval_duration
-                part_end = dates[0] + (ii + 1) * interval_duration
-
-                # Округляем границы подинтервала до секунд
-                part_start = part_start.replace(microsecond=0) - timedelta(seconds=1)
-                part_end = part_end.replace(microsecond=0)
-
-                # Запускаем split_interval в отдельном процессе, передавая новый session_key
-                future = executor.submit(
-                    split_interval,
-                    [part_start, part_end],
-                    dates_type,
-                    category,
-                    cookie,
-                    max_rows,
-                    registered,
-                )
-                future_intervals.append(future)
-
-            # Собираем результаты из всех завершённых задач
-            for future in as_completed(future_intervals):
-                result_intervals.extend(future.result())
-
-    return result_intervals
-
 
 def split_interval_vypiski(
     dates, dates_type, category, cookie, max_rows=1000, registered=None
@@ -480,55 +482,7 @@ def split_interval_vypiski(
     :param registered:
     :return:
     """
-    result_intervals = []
-
-    # Получаем session_key для текущего процесса
-    session_key = generate_key()
-
-    # Получаем количество строк для данного интервала
-
-    row_count = get_row_count(
-        dates, dates_type, category, session_key, 22262, cookie, registered
-    )
-
-    # Если количество строк меньше max_rows, добавляем интервал в результат
-    if row_count <= max_rows:
-        result_intervals.append((dates[0], dates[1], row_count))
-    else:
-        # Определяем количество частей, на которые нужно разделить интервал
-        num_parts = (row_count // max_rows) + 1
-        interval_duration = (dates[1] - dates[0]) / num_parts
-
-        # Используем ProcessPoolExecutor для многопроцессорности
-        with ProcessPoolExecutor(max_workers=10) as executor:
-            future_intervals = []
-
-            # Делим интервал на `num_parts` частей и отправляем каждую часть в параллельный процесс
-            for ii in range(num_parts):
-                part_start = dates[0] + ii * interval_duration
-                part_end = dates[0] + (ii + 1) * interval_duration
-
-                # Округляем границы подинтервала до секунд
-                part_start = part_start.replace(microsecond=0) - timedelta(seconds=1)
-                part_end = part_end.replace(microsecond=0)
-
-                # Запускаем split_interval в отдельном процессе, передавая новый session_key
-                future = executor.submit(
-                    split_interval_vypiski,
-                    [part_start, part_end],
-                    dates_type,
-                    category,
-                    cookie,
-                    max_rows,
-                    registered,
-                )
-                future_intervals.append(future)
-
-            # Собираем результаты из всех завершённых задач
-            for future in as_completed(future_intervals):
-                result_intervals.extend(future.result())
-
-    return result_intervals
+    return _split(dates, split_dates, dates_type, category, cookie, 22262, max_rows, registered)
 
 
 def split_interval_ids(
@@ -544,51 +498,7 @@ def split_interval_ids(
     :param registered: Дополнительный параметр.
     :return: Список кортежей (start, end, row_count).
     """
-    result_intervals = []
-
-    # Получаем session_key для текущего процесса
-    session_key = generate_key()
-
-    # Определяем количество строк для данного интервала
-    row_count = get_row_count(
-        interval, interval_type, category, session_key, 21744, cookie, registered
-    )
-    print(row_count)
-
-    if row_count <= max_rows:
-        result_intervals.append((interval[0], interval[1], row_count))
-    else:
-        # Определяем количество частей, на которые нужно разделить интервал
-        num_parts = (row_count // max_rows) + 1
-        interval_size = (interval[1] - interval[0] + 1) // num_parts
-
-        with ProcessPoolExecutor(max_workers=10) as executor:
-            future_intervals = []
-
-            for i in range(num_parts):
-                part_start = interval[0] + i * interval_size
-                part_end = interval[0] + (i + 1) * interval_size - 1
-
-                # Убедимся, что последний интервал заканчивается ровно на границе
-                if i == num_parts - 1 or part_end >= interval[1]:
-                    part_end = interval[1]
-                print(f"интервал {part_start} - {part_end}")
-
-                future = executor.submit(
-                    split_interval_ids,
-                    [part_start, part_end],
-                    interval_type,
-                    cookie,
-                    max_rows,
-                    registered,
-                    category,
-                )
-                future_intervals.append(future)
-
-            for future in as_completed(future_intervals):
-                result_intervals.extend(future.result())
-
-    return result_intervals
+    return _split(interval, split_ids, interval_type, category, cookie, 21744, max_rows, registered)
 
 
 def merge_intervals(
@@ -703,141 +613,22 @@ def merge_intervals_ids(
     return merged_intervals
 
 
-def get_rsm(
-    date_start,
-    date_end,
-    dates_type,
-    category,
-    session_key,
-    cookie,
-    layout_id,
-    registered,
-):
+def new_kpu(intervals):
     """
-    takes an info from RSM
-    :param date_start:
-    :param date_end:
-    :param dates_type:
-    :param category:
-    :param session_key:
-    :param cookie:
-    :param layout_id:
-    :param registered:
+    loads all intervals through one RSM session, at most RSM.FETCH_CONCURRENCY requests at once
+    :param intervals: tuples from merge_intervals / merge_intervals_ids
     :return:
     """
-    df = pd.DataFrame
-    dates = [date_start, date_end]
-    if dates_type == 1:
-        search_link, count_link = search_kpu(
-            session_key,
-            layout_id,
-            kpu_direction=category,
-            decl_date=dates,
-            registered=registered,
-        )
-    elif dates_type == 2:
-        search_link, count_link = search_kpu(
-            session_key,
-            layout_id,
-            kpu_direction=category,
-            reason2_calc=dates,
-            registered=registered,
+    if not intervals:
+        return pd.DataFrame()
+    searches = []
+    for start, end, dates_type, _, category, session_key, _, layout_id, registered in intervals:
+        search_link, _ = search_links(
+            [start, end], dates_type, category, session_key, layout_id, registered
         )
-    elif dates_type == 3:
-        search_link, count_link = search_kpu(
-            session_key,
-            layout_id,
-            kpu_direction=category,
-            reason2_date_resolution=dates,
-            registered=registered,
-        )
-    elif dates_type == 4:
-        search_link, count_link = search_kurs_living_space(
-            dates, layout_id, session_key
-        )
-    elif dates_type == 5:
-        search_link, count_link = search_vypiski(dates, layout_id, session_key)
-
-    a = requests.get(search_link, cookies={"Rsm.Cookie": cookie})
-    if a.status_code != 503:
-        jsonn = json.loads(a.text)
-        if jsonn["Data"] != "The service is unavailable.":
-            df = pd.DataFrame(jsonn["Data"])
-            i = 0
-            while i <= 50:
-                b = requests.get(
-                    f"http://webrsm.mlc.gov:5222/Registers/GetAddData?registerId=KursKpu&uniqueSessionKey={session_key}",
-                    cookies={"Rsm.Cookie": cookie},
-                )
-                jsonn = json.loads(b.text)
-                df1 = pd.DataFrame(jsonn["Data"])
-                # if not df1.empty:
-                # print(f'{date_start} - {date_end} has NaN on i = {i}')
-
-                with warnings.catch_warnings(record=True) as w_list:
-                    # Установим фильтр, чтобы всегда «ловить» все предупреждения,
-                    # а не только первый раз.
-                    warnings.simplefilter("always", category=FutureWarning)
-
-                    # Здесь идёт ваша операция, которая может сгенерировать FutureWarning.
-                    df = pd.concat([df, df1], axis=0)
-
-                    # Теперь перебираем все предупреждения, которые произошли в блоке.
-                    for warning_item in w_list:
-                        # Если предупреждение — это именно FutureWarning
-                        if issubclass(warning_item.category, FutureWarning):
-                            # Выводим желаемые переменные или любую отладочную инфу
-                            print("Поймали FutureWarning при конкатенации:")
-                            print("Детали о предупреждении:", warning_item.message)
-                            print("Текущая форма df:", df.shape)
-                            print("Текущая форма df1:", df1.shape)
-                            print(f"{date_start} - {date_end}, i = {i}")
-                            # Можно делать дополнительную логику, логирование и т.п.
-                # df = pd.concat([df, df1], axis=0)
-                # print(b.text)
-                if len(df) > 1500:
-                    print(
-                        "warning! not all kpus are downloadet at ",
-                        date_start,
-                        "-",
-                        date_end,
-                    )
-                if df1.empty:
-                    i = 50
-                i = i + 1
-    print(len(df))
-    return df
+        searches.append((search_link, session_key))
 
-
-def new_kpu(intervals):
-    """
-    starts a multiprocessing with get_rsm func
-    :param intervals:
-    :return:
-    """
-    pool_size = min(10, len(intervals))
-    with multiprocessing.Pool(processes=pool_size) as pool:
-        args = [
-            (
-                interval[0],
-                interval[1],
-                interval[2],
-                interval[4],
-                interval[5],
-                interval[6],
-                interval[7],
-                interval[8],
-            )
-            for interval in intervals
-        ]
-        results = pool.starmap(get_rsm, args)
-    # Объединение всех датафреймов в один
-    # print(f'len results = {len(results)}')
-    combined_df = pd.concat(results, ignore_index=True)
-    combined_df.drop(columns="Selected", inplace=True)
-    combined_df.drop_duplicates(inplace=True)
-
-    return combined_df
+    return _run_rsm(intervals[0][6], lambda client: fetch_intervals(client, searches))
 
 
 def search_kpu(
@@ -1767,221 +1558,75 @@ def get_vypiski(dates, layout_id):
     return df
 
 
-def get_kpu_xlsx_df(start_date, end_date, category, layout_id):
-    start = datetime.now()
+def _checkpoint_dir(kind, start_date, end_date):
+    # Каталог окон привязан к периоду: повторный запуск за тот же период докачивает только недостающие окна
+    return Path(RSM.EXPORT_CHECKPOINT_DIR) / f"{kind}_{window_name((start_date, end_date))}"
 
-    key = generate_key()
-    token = check_token()
-    url1, url2 = start_kpu_xlsx(
-        key, layout_id, None, category, decl_date=[start_date, end_date]
-    )
 
-    print(url2)
+def get_kpu_xlsx_df(start_date, end_date, category, layout_id):
+    token = check_token()
+    client = RsmExportClient(token)
 
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = url2
-    cookie = {"Rsm.Cookie": token}
-    url_xlsx_start = "http://webrsm.mlc.gov:5222/Registers/ExportBackground"
+    def plan():
+        # Окна подбираются по числу строк, как в split_interval для постраничного поиска
+        intervals = split_interval(
+            [start_date, end_date], 1, category, token, max_rows=RSM.EXPORT_WINDOW_ROWS
+        )
+        return [(interval_start, interval_end) for interval_start, interval_end, _ in intervals]
 
-    print(
-        requests.post(
-            url_xlsx_start, data=data, headers=headers, cookies=cookie, stream=True
+    def export_window(window_start, window_end, path):
+        key = generate_key()
+        status_url, post_data = start_kpu_xlsx(
+            key, layout_id, None, category, decl_date=[window_start, window_end]
         )
+        return client.export_df(status_url, post_data, key, path)
+
+    df = chunked_export(
+        _checkpoint_dir("kpu", start_date, end_date),
+        plan,
+        export_window,
+        "Идентификатор дела",
+        max_workers=RSM.EXPORT_WORKERS,
     )
-
-    status_value = ""
-
-    while status_value != "Завершена":
-        respose = requests.get(url1, cookies=cookie)
-
-        try:
-            print(respose.status_code)
-        except Exception as e:
-            print(e)
-
-        try:
-            # print(respose.text)
-            data = json.loads(respose.text)
-            # Получаем первую запись
-            first_record = data["Data"][0]
-
-            # Извлекаем ID и значение поля "1000881"
-            record_id = first_record["ID"]
-            print(record_id)
-            status_value = first_record["1000881"]
-
-            print("-------------------")
-        except Exception as e:
-            print(e)
-
-        time.sleep(10)
-
-    url = f"http://webrsm.mlc.gov:5222/CoreRegisterLayout/ExportDownload?exportId={record_id}&UniqueSessionKey={key}"
-    response = send_request(url, cookie=token)
-
-    # Проверяем успех
-    if response.status_code == 200:
-        # Получаем имя файла (опционально)
-        content_disposition = response.headers.get("content-disposition", "")
-        match = re.search(r"filename=([^;]+)", content_disposition)
-        filename = match.group(1).strip('"') if match else "download.xlsx"
-
-        # Читаем в память, без записи на диск
-        file_bytes = io.BytesIO(response.content)
-
-        # Загружаем в DataFrame
-        df = pd.read_excel(file_bytes)
-
-        print(f"✅ Загружен файл: {filename}")
-        print(df.head())  # показываем первые строки
-        # df.to_excel('kpu.xlsx')
-    else:
-        print(f"❌ Ошибка запроса: {response.status_code}")
-
+    print(f"✅ Загружено строк КПУ: {len(df)}")
     return df
 
 
 def get_resurs_xlsx_df(layout_id):
-    start = datetime.now()
-
-    key = generate_key()
+    # Ресурс выгружается без фильтра по датам, поэтому одним окном
     token = check_token()
-    url1, url2 = start_resurs_xlsx(key, layout_id)
-
-    print(url2)
-
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = url2
-    cookie = {"Rsm.Cookie": token}
-    url_xlsx_start = "http://webrsm.mlc.gov:5222/Registers/ExportBackground"
+    client = RsmExportClient(token)
+    key = generate_key()
+    status_url, post_data = start_resurs_xlsx(key, layout_id)
 
-    print(
-        requests.post(
-            url_xlsx_start, data=data, headers=headers, cookies=cookie, stream=True
-        ).text
+    Path(RSM.EXPORT_CHECKPOINT_DIR).mkdir(parents=True, exist_ok=True)
+    df = client.export_df(
+        status_url, post_data, key, Path(RSM.EXPORT_CHECKPOINT_DIR) / f"resurs_{key}.xlsx"
     )
-
-    status_value = ""
-
-    while status_value != "Завершена":
-        respose = requests.get(url1, cookies=cookie)
-
-        try:
-            print(respose.status_code)
-        except Exception as e:
-            print(e)
-
-        try:
-            # print(respose.text)
-            data = json.loads(respose.text)
-            # Получаем первую запись
-            first_record = data["Data"][0]
-
-            # Извлекаем ID и значение поля "1000881"
-            record_id = first_record["ID"]
-            print(record_id)
-            status_value = first_record["1000881"]
-
-            print("-------------------")
-        except Exception as e:
-            print(e)
-
-        time.sleep(10)
-
-    url = f"http://webrsm.mlc.gov:5222/CoreRegisterLayout/ExportDownload?exportId={record_id}&UniqueSessionKey={key}"
-    response = send_request(url, cookie=token)
-
-    # Проверяем успех
-    if response.status_code == 200:
-        # Получаем имя файла (опционально)
-        content_disposition = response.headers.get("content-disposition", "")
-        match = re.search(r"filename=([^;]+)", content_disposition)
-        filename = match.group(1).strip('"') if match else "download.xlsx"
-
-        # Читаем в память, без записи на диск
-        file_bytes = io.BytesIO(response.content)
-
-        # Загружаем в DataFrame
-        df = pd.read_excel(file_bytes)
-
-        print(f"✅ Загружен файл: {filename}")
-        print(df.head())  # показываем первые строки
-        # df.to_excel('kpu.xlsx')
-    else:
-        print(f"❌ Ошибка запроса: {response.status_code}")
-
+    print(f"✅ Загружено строк ресурса: {len(df)}")
     return df
 
 
 def get_orders_xlsx_df(start_date, end_date, layout_id):
-    start = datetime.now()
-
-    key = generate_key()
     token = check_token()
-    url1, url2 = start_orders_xlsx(key, layout_id, decl_date=[start_date, end_date])
+    client = RsmExportClient(token)
 
-    print(url2)
-
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = url2
-    cookie = {"Rsm.Cookie": token}
-    url_xlsx_start = "http://webrsm.mlc.gov:5222/Registers/ExportBackground"
-
-    print(
-        requests.post(
-            url_xlsx_start, data=data, headers=headers, cookies=cookie, stream=True
+    def export_window(window_start, window_end, path):
+        key = generate_key()
+        status_url, post_data = start_orders_xlsx(
+            key, layout_id, decl_date=[window_start, window_end]
         )
+        return client.export_df(status_url, post_data, key, path)
+
+    # Для выписок нет счетчика строк, окна по году
+    df = chunked_export(
+        _checkpoint_dir("orders", start_date, end_date),
+        lambda: date_windows(start_date, end_date),
+        export_window,
+        "Идентификатор выписки",
+        max_workers=RSM.EXPORT_WORKERS,
     )
-
-    status_value = ""
-
-    while status_value != "Завершена":
-        respose = requests.get(url1, cookies=cookie)
-
-        try:
-            print(respose.status_code)
-        except Exception as e:
-            print(e)
-
-        try:
-            # print(respose.text)
-            data = json.loads(respose.text)
-            # Получаем первую запись
-            first_record = data["Data"][0]
-
-            # Извлекаем ID и значение поля "1000881"
-            record_id = first_record["ID"]
-            print(record_id)
-            status_value = first_record["1000881"]
-
-            print("-------------------")
-        except Exception as e:
-            print(e)
-
-        time.sleep(10)
-
-    url = f"http://webrsm.mlc.gov:5222/CoreRegisterLayout/ExportDownload?exportId={record_id}&UniqueSessionKey={key}"
-    response = send_request(url, cookie=token)
-
-    # Проверяем успех
-    if response.status_code == 200:
-        # Получаем имя файла (опционально)
-        content_disposition = response.headers.get("content-disposition", "")
-        match = re.search(r"filename=([^;]+)", content_disposition)
-        filename = match.group(1).strip('"') if match else "download.xlsx"
-
-        # Читаем в память, без записи на диск
-        file_bytes = io.BytesIO(response.content)
-
-        # Загружаем в DataFrame
-        df = pd.read_excel(file_bytes)
-
-        print(f"✅ Загружен файл: {filename}")
-        print(df.head())  # показываем первые строки
-        # df.to_excel('kpu.xlsx')
-    else:
-        print(f"❌ Ошибка запроса: {response.status_code}")
-
+    print(f"✅ Загружено строк выписок: {len(df)}")
     return df
 
 
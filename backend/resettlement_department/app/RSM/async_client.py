@@ -0,0 +1,197 @@
+"""
+Поиск по реестрам РСМ через одну асинхронную HTTP-сессию.
+
+Вместо процесса на каждый запрос и пулов процессов на каждом уровне разбиения
+все запросы идут через один пул соединений aiohttp, одновременно не больше
+concurrency. На 503 запрос повторяется с нарастающей паузой. Количество строк
+запрашивается, как только РСМ готов его отдать, а не через фиксированные 3 секунды.
+Разбиение интервала - дерево задач asyncio: дочерние интервалы считаются параллельно.
+"""
+import asyncio
+import json
+from datetime import timedelta
+from urllib.parse import urljoin, urlsplit
+
+import aiohttp
+import pandas as pd
+
+RSM_URL = "http://webrsm.mlc.gov:5222"
+ADD_DATA_PATH = "/Registers/GetAddData"
+MAX_ADD_DATA_PAGES = 51
+CONCURRENCY = 10
+RETRIES = 5
+
+
+class RsmUnavailable(Exception):
+    """РСМ отвечает 503 дольше, чем позволяют повторы."""
+
+
+class RsmUnauthorized(Exception):
+    """РСМ перенаправляет на вход в СУДИР: токен истек."""
+
+
+class AsyncRsmClient:
+    """
+    Клиент поиска РСМ. Используется как асинхронный контекстный менеджер:
+
+        async with AsyncRsmClient(cookie) as client:
+            count = await client.row_count(search_link, count_link)
+    """
+
+    def __init__(
+        self,
+        cookie,
+        base_url=RSM_URL,
+        concurrency=CONCURRENCY,
+        retries=RETRIES,
+        backoff=1.0,
+        poll_interval=0.5,
+        ready_timeout=60,
+        request_timeout=600,
+    ):
+        self.cookies = {"Rsm.Cookie": cookie}
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.ready_timeout = ready_timeout
+        self.request_timeout = request_timeout
+        self.session = None
+        self._semaphore = None
+        self._searches = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        # Фоновый поиск держит соединение, пока считается количество: таких не больше половины,
+        # чтобы запросам GetCount всегда оставались свободные соединения
+        self._searches = asyncio.Semaphore(max(1, self.concurrency // 2))
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            cookies=self.cookies,
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def _url(self, url):
+        # Ссылки строятся в RSM.py с адресом РСМ; base_url позволяет подменить сервер
+        parts = urlsplit(url)
+        return urljoin(self.base_url, f"{parts.path}?{parts.query}" if parts.query else parts.path)
+
+    async def get_text(self, url, params=None):
+        """GET с повтором на 503 и сетевых ошибках: пауза backoff, 2*backoff, 4*backoff..."""
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    async with self.session.get(self._url(url), params=params, allow_redirects=False) as response:
+                        if response.status in (301, 302, 303):
+                            raise RsmUnauthorized(f"РСМ отверг токен: {urlsplit(url).path}")
+                        if response.status != 503:
+                            response.raise_for_status()
+                            return await response.text()
+                error = RsmUnavailable(f"РСМ недоступен (503): {urlsplit(url).path}")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    async def row_count(self, search_link, count_link):
+        """
+        Количество строк поиска. Поиск (GetData) запускается в фоне, GetCount опрашивается
+        каждые poll_interval, пока не вернет число. Если поиск завершился, а числа так и нет,
+        возвращается 0, как раньше при нечисловом ответе.
+        """
+        async with self._searches:
+            search = asyncio.create_task(self.get_text(search_link))
+            try:
+                deadline = asyncio.get_running_loop().time() + self.ready_timeout
+                while True:
+                    search_done = search.done()
+                    text = await self.get_text(count_link)
+                    try:
+                        return int(text)
+                    except ValueError:
+                        if search_done or asyncio.get_running_loop().time() >= deadline:
+                            print("RSM COUNT NOT READY", text[:200])
+                            return 0
+                    await asyncio.wait({search}, timeout=self.poll_interval)
+            finally:
+                # Данные поиска не нужны, только регистрация поиска в сессии РСМ
+                search.cancel()
+                await asyncio.gather(search, return_exceptions=True)
+
+    async def fetch_rows(self, search_link, session_key, register_id="KursKpu"):
+        """Все строки поиска: первая страница из GetData, дальше GetAddData до пустого ответа."""
+        try:
+            data = json.loads(await self.get_text(search_link))["Data"]
+        except RsmUnavailable as e:
+            print(e)
+            return pd.DataFrame()
+        if data == "The service is unavailable.":
+            return pd.DataFrame()
+        frames = [pd.DataFrame(data)]
+        params = {"registerId": register_id, "uniqueSessionKey": session_key}
+        for _ in range(MAX_ADD_DATA_PAGES):
+            page = pd.DataFrame(json.loads(await self.get_text(ADD_DATA_PATH, params))["Data"])
+            if page.empty:
+                break
+            frames.append(page)
+        frames = [frame for frame in frames if not frame.empty]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def split_dates(dates, num_parts):
+    """Делит интервал дат на num_parts частей с границами, округленными до секунд."""
+    duration = (dates[1] - dates[0]) / num_parts
+    parts = []
+    for ii in range(num_parts):
+        part_start = (dates[0] + ii * duration).replace(microsecond=0) - timedelta(seconds=1)
+        part_end = (dates[0] + (ii + 1) * duration).replace(microsecond=0)
+        parts.append([part_start, part_end])
+    return parts
+
+
+def split_ids(interval, num_parts):
+    """Делит числовой интервал на num_parts частей, последняя заканчивается ровно на границе."""
+    size = (interval[1] - interval[0] + 1) // num_parts
+    parts = []
+    for i in range(num_parts):
+        part_start = interval[0] + i * size
+        part_end = interval[0] + (i + 1) * size - 1
+        if i == num_parts - 1 or part_end >= interval[1]:
+            part_end = interval[1]
+        parts.append([part_start, part_end])
+    return parts
+
+
+async def split_interval(interval, count_rows, split, max_rows):
+    """
+    Дерево разбиения: интервал с числом строк больше max_rows делится на
+    (count // max_rows) + 1 частей, части считаются параллельно и делятся дальше.
+
+    count_rows(interval) - корутина с числом строк; split(interval, num_parts) - части.
+    :return: список (начало, конец, число строк), отсортированный по началу.
+    """
+    row_count = await count_rows(interval)
+    if row_count <= max_rows:
+        return [(interval[0], interval[1], row_count)]
+    parts = split(interval, row_count // max_rows + 1)
+    results = await asyncio.gather(*(split_interval(part, count_rows, split, max_rows) for part in parts))
+    return sorted((item for result in results for item in result), key=lambda item: item[0])
+
+
+async def fetch_intervals(client, searches):
+    """
+    Загружает интервалы параллельно (не больше concurrency запросов клиента).
+    searches - пары (ссылка поиска, ключ сессии); результат без колонки Selected и дублей.
+    """
+    frames = await asyncio.gather(*(client.fetch_rows(link, session_key) for link, session_key in searches))
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    return df.drop(columns="Selected", errors="ignore").drop_duplicates()
@@ -0,0 +1,209 @@
+"""
+Выгрузка больших реестров РСМ в XLSX по окнам дат.
+
+Вместо одной выгрузки за 2017 -> сегодня запускается несколько выгрузок поменьше,
+не больше max_workers одновременно. Каждое готовое окно сохраняется на диск,
+поэтому при повторном запуске после ошибки скачиваются только недостающие окна.
+Окна могут пересекаться по границам: при склейке строки одного ключа берутся из одного окна.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+import pandas as pd
+import requests
+
+from utils.xlsx_reader import read_sheet
+
+RSM_URL = "http://webrsm.mlc.gov:5222"
+EXPORT_DONE = "Завершена"
+STATUS_FIELD = "1000881"
+MAX_WORKERS = 4
+RETRIES = 3
+
+
+class RsmExportClient:
+    """
+    Фоновая выгрузка реестра РСМ: запуск, ожидание готовности и скачивание файла.
+
+    Статус выгрузки ищется по ID в списке своих выгрузок (GetData с IsMine),
+    поэтому одновременно может идти несколько выгрузок.
+    """
+
+    def __init__(self, cookie, base_url=RSM_URL, poll_interval=10, timeout=4 * 3600, request_timeout=300):
+        self.cookies = {"Rsm.Cookie": cookie}
+        self.base_url = base_url
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        # Запуск выгрузки и поиск ее ID идут по одной, иначе две новые выгрузки не различить
+        self._start_lock = threading.Lock()
+        self._claimed = set()
+
+    def _url(self, url):
+        # Ссылки строятся в RSM.py с адресом РСМ; base_url позволяет подменить сервер
+        parts = urlsplit(url)
+        return urljoin(self.base_url, f"{parts.path}?{parts.query}" if parts.query else parts.path)
+
+    def _exports(self, status_url):
+        response = requests.get(self._url(status_url), cookies=self.cookies, timeout=self.request_timeout)
+        response.raise_for_status()
+        return {record["ID"]: record.get(STATUS_FIELD) for record in response.json()["Data"]}
+
+    def start(self, status_url, post_data):
+        """Запускает выгрузку и возвращает ее ID."""
+        with self._start_lock:
+            known = set(self._exports(status_url)) | self._claimed
+            response = requests.post(
+                urljoin(self.base_url, "/Registers/ExportBackground"),
+                data=post_data,
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                cookies=self.cookies,
+                timeout=self.request_timeout,
+            )
+            response.raise_for_status()
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                new_ids = [export_id for export_id in self._exports(status_url) if export_id not in known]
+                if new_ids:
+                    self._claimed.add(new_ids[0])
+                    return new_ids[0]
+                time.sleep(self.poll_interval)
+        raise TimeoutError("Выгрузка РСМ не появилась в списке выгрузок")
+
+    def wait(self, status_url, export_id):
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            status = self._exports(status_url).get(export_id)
+            print("RSM EXPORT", export_id, status)
+            if status == EXPORT_DONE:
+                return
+            time.sleep(self.poll_interval)
+        raise TimeoutError(f"Выгрузка РСМ {export_id} не завершилась")
+
+    def download(self, export_id, session_key, path):
+        """Скачивает файл выгрузки на диск частями, не держа его целиком в памяти."""
+        url = urljoin(self.base_url, "/CoreRegisterLayout/ExportDownload")
+        params = {"exportId": export_id, "UniqueSessionKey": session_key}
+        tmp_path = Path(f"{path}.part")
+        with requests.get(url, params=params, cookies=self.cookies, stream=True, timeout=self.request_timeout) as response:
+            response.raise_for_status()
+            with open(tmp_path, "wb") as file:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    file.write(chunk)
+        os.replace(tmp_path, path)
+        return path
+
+    def export_df(self, status_url, post_data, session_key, path):
+        """Полный цикл выгрузки одного окна: запуск, ожидание, скачивание в path и чтение."""
+        export_id = self.start(status_url, post_data)
+        self.wait(status_url, export_id)
+        self.download(export_id, session_key, path)
+        try:
+            return read_sheet(path)
+        finally:
+            Path(path).unlink(missing_ok=True)
+
+
+def date_windows(start_date, end_date, days=365):
+    """Окна по days дней без пропусков: конец окна на секунду раньше начала следующего."""
+    windows = []
+    window_start = start_date
+    while window_start <= end_date:
+        window_end = min(window_start + timedelta(days=days) - timedelta(seconds=1), end_date)
+        windows.append((window_start, window_end))
+        window_start = window_end + timedelta(seconds=1)
+    return windows
+
+
+def window_name(window):
+    start, end = window
+    return f"{start:%Y%m%d%H%M%S}_{end:%Y%m%d%H%M%S}"
+
+
+def load_windows(checkpoint_dir, plan):
+    """
+    Окна выгрузки: из manifest.json прошлого запуска или из plan() с сохранением.
+
+    План сохраняется, чтобы повторный запуск не пересчитывал окна по-другому
+    и использовал уже скачанные.
+    """
+    manifest = Path(checkpoint_dir) / "manifest.json"
+    if manifest.exists():
+        with open(manifest, encoding="utf-8") as file:
+            return [tuple(datetime.fromisoformat(value) for value in window) for window in json.load(file)["windows"]]
+    windows = sorted((start, end) for start, end in plan())
+    Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+    with open(manifest, "w", encoding="utf-8") as file:
+        json.dump({"windows": [[start.isoformat(), end.isoformat()] for start, end in windows]}, file)
+    return windows
+
+
+def merge_chunks(frames, key):
+    """
+    Склеивает окна. Если ключ встречается в нескольких окнах (пересечение границ),
+    остаются строки только из последнего из них; несколько строк ключа внутри
+    одного окна (например, площади одной выписки) сохраняются.
+    """
+    frames = [frame.assign(_window=index) for index, frame in enumerate(frames) if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    merged = pd.concat(frames, ignore_index=True)
+    last_window = merged.groupby(key, dropna=False)["_window"].transform("max")
+    return merged[merged["_window"] == last_window].drop(columns="_window").reset_index(drop=True)
+
+
+def _export_window(window, export_window, checkpoint_dir, retries):
+    path = Path(checkpoint_dir) / f"{window_name(window)}.pkl"
+    if path.exists():
+        return pd.read_pickle(path)
+    for attempt in range(1, retries + 1):
+        try:
+            df = export_window(*window, Path(checkpoint_dir) / f"{window_name(window)}.xlsx")
+            break
+        except Exception as e:
+            print("RSM EXPORT WINDOW FAILED", window_name(window), attempt, e)
+            if attempt == retries:
+                raise
+    tmp_path = Path(f"{path}.part")
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+    return df
+
+
+def chunked_export(checkpoint_dir, plan, export_window, key, max_workers=MAX_WORKERS, retries=RETRIES, keep=False):
+    """
+    Выгружает все окна плана и склеивает их без повторов по key.
+
+    plan() возвращает пары (начало, конец); export_window(start, end, path) выгружает
+    одно окно (path - куда скачать файл) и возвращает DataFrame. Если окно не удалось
+    выгрузить, остальные окна все равно докачиваются и сохраняются, затем ошибка
+    пробрасывается. После успешной склейки каталог очищается, если не задано keep.
+    """
+    checkpoint_dir = Path(checkpoint_dir)
+    windows = load_windows(checkpoint_dir, plan)
+    frames = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_export_window, window, export_window, checkpoint_dir, retries): window for window in windows
+        }
+        for future in as_completed(futures):
+            try:
+                frames[futures[future]] = future.result()
+            except Exception as e:
+                errors.append(e)
+    if errors:
+        raise errors[0]
+
+    df = merge_chunks([frames[window] for window in windows], key)
+    if not keep:
+        for path in checkpoint_dir.iterdir():
+            path.unlink()
+        checkpoint_dir.rmdir()
+    return df
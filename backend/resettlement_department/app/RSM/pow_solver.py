@@ -0,0 +1,144 @@
+"""
+Proof-of-work для входа в СУДИР: суффикс, при котором sha1(base + ':' + suffix)
+начинается с zero_bytes нулевых байт.
+
+Состояние sha1 для общего префикса считается один раз и копируется (hashlib copy()),
+поэтому на каждого кандидата дохешируется только его последний символ. Кандидаты
+перебираются байтами, без f-строк и encode. Длинные суффиксы делятся по первому символу
+между процессами; как только один нашел ответ, остальные останавливаются.
+
+Запуск модуля печатает замер: python -m RSM.pow_solver
+"""
+import hashlib
+import itertools
+import multiprocessing
+import os
+import secrets
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# алфавит из pOfw.js
+ALPHABET = b"0123456789/+abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+SYMBOLS = [bytes([symbol]) for symbol in ALPHABET]
+ZERO_BYTES = 2
+MAX_LEN = 4
+# Суффиксы не длиннее этого перебираются в текущем процессе: их мало, пул дороже
+SERIAL_LEN = 2
+
+_stop = None
+
+
+def _init_worker(stop):
+    global _stop
+    _stop = stop
+
+
+def _search_tail(state, depth, zeros, zero_bytes):
+    """Перебирает depth последних символов после state; возвращает байты хвоста или None."""
+    if depth == 1:
+        copy = state.copy
+        for symbol in SYMBOLS:
+            digest = copy()
+            digest.update(symbol)
+            if digest.digest()[:zero_bytes] == zeros:
+                return symbol
+        return None
+    for symbol in SYMBOLS:
+        if depth == 3 and _stop is not None and _stop.is_set():
+            return None
+        next_state = state.copy()
+        next_state.update(symbol)
+        tail = _search_tail(next_state, depth - 1, zeros, zero_bytes)
+        if tail is not None:
+            return symbol + tail
+    return None
+
+
+def _search(prefix, first, length, zero_bytes):
+    """Суффиксы длины length, начинающиеся с first."""
+    state = hashlib.sha1(prefix)
+    state.update(first)
+    if length == 1:
+        return first if state.digest()[:zero_bytes] == b"\0" * zero_bytes else None
+    tail = _search_tail(state, length - 1, b"\0" * zero_bytes, zero_bytes)
+    return None if tail is None else first + tail
+
+
+def _search_serial(prefix, lengths, zero_bytes):
+    for length in lengths:
+        for first in SYMBOLS:
+            suffix = _search(prefix, first, length, zero_bytes)
+            if suffix is not None:
+                return suffix
+    return None
+
+
+def _search_parallel(prefix, lengths, zero_bytes, workers):
+    # spawn, как в job_runner и matching_engine: fork из многопоточного процесса uvicorn небезопасен.
+    # Событие передается воркерам при создании процессов (initargs)
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(stop,)) as executor:
+        # Длины по порядку: более длинные суффиксы начинаем, только если короче не нашлось
+        for length in lengths:
+            pending = {executor.submit(_search, prefix, first, length, zero_bytes) for first in SYMBOLS}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    suffix = future.result()
+                    if suffix is not None:
+                        stop.set()
+                        for other in pending:
+                            other.cancel()
+                        return suffix
+    return None
+
+
+def solve_pow(base, zero_bytes=ZERO_BYTES, max_len=MAX_LEN, workers=None):
+    """
+    Строка base:suffix с sha1, начинающимся с zero_bytes нулевых байт.
+    workers - процессов для суффиксов длиннее SERIAL_LEN (по умолчанию по числу ядер, 1 - без пула).
+    """
+    prefix = f"{base}:".encode("utf-8")
+    workers = workers or os.cpu_count() or 1
+    lengths = range(1, max_len + 1)
+    suffix = _search_serial(prefix, [length for length in lengths if length <= SERIAL_LEN or workers == 1], zero_bytes)
+    if suffix is None and workers > 1:
+        suffix = _search_parallel(prefix, [length for length in lengths if length > SERIAL_LEN], zero_bytes, workers)
+    if suffix is None:
+        raise RuntimeError("Не найден рабочий proofOfWork")
+    return f"{base}:{suffix.decode('ascii')}"
+
+
+def find_suffix_pow_naive(base, max_len=MAX_LEN, required_leading_zero_bytes=ZERO_BYTES):
+    """Прежний перебор (строки, sha1 с нуля на каждого кандидата) - для замера."""
+    alphabet = ALPHABET.decode("ascii")
+    for length in range(1, max_len + 1):
+        for combo in itertools.product(alphabet, repeat=length):
+            candidate = f"{base}:{''.join(combo)}"
+            if hashlib.sha1(candidate.encode("utf-8")).digest().startswith(b"\x00" * required_leading_zero_bytes):
+                return candidate
+    raise RuntimeError("Не найден рабочий proofOfWork")
+
+
+def benchmark(rounds=10, zero_bytes=ZERO_BYTES, workers=None):
+    """Среднее и максимальное время решения на случайных base: прежний перебор и solve_pow."""
+    bases = [secrets.token_hex(16) for _ in range(rounds)]
+    results = {}
+    for name, solve in (
+        ("naive", lambda base: find_suffix_pow_naive(base, required_leading_zero_bytes=zero_bytes)),
+        ("serial", lambda base: solve_pow(base, zero_bytes, workers=1)),
+        ("parallel", lambda base: solve_pow(base, zero_bytes, workers=workers)),
+    ):
+        times = []
+        for base in bases:
+            start = time.perf_counter()
+            solve(base)
+            times.append(time.perf_counter() - start)
+        results[name] = (sum(times) / len(times), max(times))
+        print(f"{name:>8}: среднее {results[name][0] * 1000:.1f} мс, максимум {results[name][1] * 1000:.1f} мс")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,132 @@
+"""
+Токен РСМ (Rsm.Cookie), общий для всех воркеров.
+
+Вход через СУДИР долгий (proof-of-work, несколько запросов), поэтому токен хранится
+в общем хранилище вместе со временем получения и до истечения срока жизни отдается
+без единого запроса. Незадолго до истечения новый токен получается в фоне, пока
+вызывающие продолжают работать со старым. Вход выполняется один раз: внутри процесса
+под блокировкой, между воркерами - под блокировкой хранилища; кто ждал блокировку,
+берет токен, полученный другим.
+
+Срок жизни уточняется по наблюдениям: если токен отвергнут в возрасте age, срок
+считается не больше age; если принят после ожидаемого срока - не меньше. Отвергнутый
+токен убирается из памяти и помечается в хранилище устаревшим, чтобы ни этот, ни другие
+воркеры больше его не отдавали.
+"""
+import threading
+import time
+from dataclasses import dataclass
+
+TOKEN_TTL = 4 * 3600
+REFRESH_MARGIN = 15 * 60
+
+
+@dataclass
+class Token:
+    value: str
+    obtained_at: float
+    stale: bool = False
+
+
+class RsmTokenManager:
+    """
+    store - общее хранилище: load() -> Token или None, save(Token), lock() - контекстный
+    менеджер блокировки между воркерами. save(Token(stale=True)) помечает устаревшим
+    только хранимый токен с тем же value: новый токен другого воркера не затирается. validate(value) - принимает ли РСМ токен,
+    login() - новый токен.
+    """
+
+    def __init__(self, store, validate, login, ttl=TOKEN_TTL, refresh_margin=REFRESH_MARGIN, clock=time.time):
+        self.store = store
+        self.validate = validate
+        self.login = login
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self._token = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _age(self, token):
+        return self.clock() - token.obtained_at
+
+    @staticmethod
+    def _is_new(token, stale):
+        # Время получения из хранилища пересчитывается при каждом чтении, сравниваем сам токен
+        return token is not None and not token.stale and (stale is None or token.value != stale.value)
+
+    def get(self):
+        """Действующий токен: из памяти или хранилища без запросов, пока не подходит срок."""
+        token = self._token or self.store.load()
+        self._token = token
+        if token is not None and not token.stale:
+            age = self._age(token)
+            if age < self.ttl - self.refresh_margin:
+                return token.value
+            if age < self.ttl:
+                self.refresh_in_background()
+                return token.value
+            if self.validate(token.value):
+                # Токен живет дольше, чем ожидалось
+                self.ttl = max(self.ttl, age + self.refresh_margin)
+                print("RSM TOKEN TTL", self.ttl)
+                return token.value
+            self._observe_expired(age)
+        return self.refresh(token).value
+
+    def expire(self, value):
+        """РСМ отверг токен value: срок жизни уточняется, следующий get() получит новый токен."""
+        with self._lock:
+            token = self._token
+            if token is None or token.value != value:
+                return
+            self._observe_expired(self._age(token))
+            self._token = None
+            self.store.save(Token(value, token.obtained_at, stale=True))
+
+    def _observe_expired(self, age):
+        # Отвергнутый токен прожил не больше age; слишком короткий срок не берем,
+        # чтобы отзыв токена не превратил каждый вызов во вход
+        self.ttl = max(min(self.ttl, age), 2 * self.refresh_margin)
+        print("RSM TOKEN TTL", self.ttl)
+
+    def refresh(self, stale=None):
+        """
+        Новый токен вместо stale. Если пока ждали блокировку, токен уже обновил этот
+        или другой воркер, возвращается он без входа.
+        """
+        with self._lock:
+            if self._is_new(self._token, stale) and self._age(self._token) < self.ttl:
+                return self._token
+            with self.store.lock():
+                stored = self.store.load()
+                if (
+                    self._is_new(stored, stale)
+                    and self._age(stored) < self.ttl - self.refresh_margin
+                    and self.validate(stored.value)
+                ):
+                    self._token = stored
+                    return stored
+                print("RSM LOGIN")
+                token = Token(self.login(), self.clock())
+                self.store.save(token)
+                self._token = token
+                return token
+
+    def refresh_in_background(self):
+        """Запускает обновление в фоне, если оно еще не идет в этом процессе."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        stale = self._token
+
+        def run():
+            try:
+                self.refresh(stale)
+            except Exception as e:
+                print("RSM TOKEN REFRESH FAILED", e)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
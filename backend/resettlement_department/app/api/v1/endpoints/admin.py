@@ -1,6 +1,8 @@
 from depends import offer_service
 from fastapi import APIRouter, Depends
+from fastapi.concurrency import run_in_threadpool
 from service.auth import User, mp_boss_required
+from service.offer_projection import rebuild_offer_projection
 
 router = APIRouter(prefix="/admin", tags=["Admin action"])
 
@@ -8,3 +10,8 @@ router = APIRouter(prefix="/admin", tags=["Admin action"])
 @router.patch("/use_sync_offer_status_strict")
 async def user_sync_offer_status_strict(user : User = Depends(mp_boss_required)):
     return await offer_service.use_strict_update_offer_status()
+
+
+@router.post("/rebuild_offer_projection")
+async def rebuild_offer_projection_endpoint(user : User = Depends(mp_boss_required)):
+    return await run_in_threadpool(rebuild_offer_projection)
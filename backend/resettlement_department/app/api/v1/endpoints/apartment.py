@@ -1,5 +1,6 @@
 from depends import apartment_service
 from fastapi import APIRouter, Body, HTTPException, Query, Depends
+from fastapi.concurrency import run_in_threadpool
 from schema.apartment import (
     ApartType,
     DeclineReason,
@@ -10,7 +11,7 @@ from schema.apartment import (
     SetSpecialNeeds,
 )
 from schema.status import StatusUpdate
-from service.rematch_service import rematch
+from service.rematch_service import rematch, rematch_batch
 from service.container_service import (
     generate_excel_from_two_dataframes,
     upload_container,
@@ -60,8 +61,15 @@ async def cancell_matching_for_apart(apart_id: int, apart_type: ApartType = Quer
 
 
 @router.post("/rematch")
-async def rematch_for_family(rematch_list: Rematch, user : User = Depends(mp_employee_required)):
-    res = await rematch(rematch_list.apartment_ids)
+async def rematch_for_family(
+    rematch_list: Rematch,
+    batch: bool = Query(True, description="Пакетный переподбор (False - по одной семье, как раньше)"),
+    user : User = Depends(mp_employee_required),
+):
+    if batch:
+        res = await run_in_threadpool(rematch_batch, rematch_list.apartment_ids)
+    else:
+        res = await rematch(rematch_list.apartment_ids)
     return {"res": res}
 
 
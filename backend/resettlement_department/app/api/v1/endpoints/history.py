@@ -10,6 +10,9 @@ from service.auth import mp_employee_required, mp_boss_required
 from depends import history_service
 
 from service.balance_alghorithm import save_views_to_excel
+from service.report_cache import get_report, report_stamp
+from repository.database import db_connection
+from fastapi.concurrency import run_in_threadpool
 
 from service.container_service import (
     generate_excel_from_two_dataframes,
@@ -30,6 +33,18 @@ async def get_manual_history():
     return await history_service.get_manual_load_history()
 
 
+def balance_report(history_id):
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            stamp = report_stamp(cursor, history_id)
+    return get_report(
+        history_id,
+        "balance",
+        stamp,
+        lambda path: save_views_to_excel(output_path=path, history_id=history_id),
+    )
+
+
 @router.post("/balance")
 async def balance(requirements: Balance = Body(...)):
     try:
@@ -48,15 +63,13 @@ async def balance(requirements: Balance = Body(...)):
         print(os.listdir(uploads_folder))
         print("ТО ЧТО ВЫШЕ ЭТО ПАРАМЕТР")
         if not (requirements.is_wave or requirements.is_shadow):
-            save_views_to_excel(
-                output_path=output_path,
-                history_id=requirements.history_id,
-            )
+            # Отчет берется из кэша, пока данные истории не менялись; иначе пересобирается вне event loop
+            output_path = await run_in_threadpool(balance_report, requirements.history_id)
 
         return FileResponse(
             path=output_path,
             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            filename=output_path,
+            filename=file_name,
         )
     except Exception as e:
         return {"error": str(e)}
@@ -0,0 +1,38 @@
+import os
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+
+from depends import job_runner
+from service.auth import mp_employee_required
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"], dependencies=[Depends(mp_employee_required)])
+
+
+@router.get("/{job_id}")
+async def get_job_status(job_id: str):
+    job_status = job_runner.status(job_id)
+    if job_status is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job_status
+
+
+@router.get("/{job_id}/file")
+async def get_job_file(job_id: str):
+    job_status = job_runner.status(job_id)
+    if job_status is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    if job_status["state"] != "done":
+        raise HTTPException(status_code=409, detail=f"Задача еще не завершена: {job_status['state']}")
+    result = job_status["result"]
+    if not isinstance(result, dict):
+        # Задача завершилась без файла, например "No old apartments found."
+        raise HTTPException(status_code=409, detail=f"У задачи нет файла результата: {result}")
+    file_path = result.get("file")
+    if not file_path or not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Файл результата не найден")
+    return FileResponse(
+        path=file_path,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        filename=os.path.basename(file_path),
+    )
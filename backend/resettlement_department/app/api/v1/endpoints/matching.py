@@ -1,13 +1,17 @@
-from fastapi import APIRouter, Depends
-from depends import apartment_service
+from fastapi import APIRouter, Depends, Query
+from depends import apartment_service, job_runner
+from fastapi.concurrency import run_in_threadpool
 from service.auth import mp_employee_required
 from schema.apartment import ApartType, Matching
-from service.alghorithm import match_new_apart_to_family_batch
+from service.alghorithm import match_new_apart_to_family_batch, simulate_matching
 from fastapi import File, HTTPException, UploadFile
-from io import BytesIO
-import pandas as pd
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+import os
+import shutil
 from service.apartment_insert import insert_to_db
 from pathlib import Path
+from utils.xlsx_reader import iter_sheet, open_workbook
 
 
 router = APIRouter(
@@ -31,9 +35,8 @@ async def get_new_apartment_house_addresses():
     )
 
 
-@router.post("/matching")
-async def start_matching(requirements: Matching):
-    matching_result = match_new_apart_to_family_batch(
+def matching_params(requirements: Matching):
+    return dict(
         new_selected_districts=requirements.new_apartment_district,
         old_selected_districts=requirements.old_apartment_district,
         new_selected_areas=requirements.new_apartment_municipal_district,
@@ -44,9 +47,42 @@ async def start_matching(requirements: Matching):
         is_shadow=requirements.is_shadow,
     )
 
+
+@router.post("/matching")
+async def start_matching(requirements: Matching):
+    # Синхронный подбор уводим из event loop, чтобы не блокировать остальные запросы
+    matching_result = await run_in_threadpool(
+        match_new_apart_to_family_batch, **matching_params(requirements)
+    )
+
     return matching_result
 
 
+@router.post("/matching/jobs")
+async def submit_matching(requirements: Matching):
+    job_id = job_runner.submit(
+        "matching", match_new_apart_to_family_batch, **matching_params(requirements)
+    )
+    return {"job_id": job_id}
+
+
+@router.post("/matching/dry_run")
+async def dry_run_matching(requirements: Matching, workbook: bool = Query(False)):
+    # Пробный подбор ничего не пишет в базу, поэтому варианты адресов можно прогонять параллельно
+    params = matching_params(requirements)
+    params.pop("is_shadow")
+    result = await run_in_threadpool(simulate_matching, workbook=workbook, **params)
+    if workbook and isinstance(result, dict):
+        # Книга пробного подбора временная: удаляется после отправки
+        return FileResponse(
+            path=result["file"],
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            filename="dry_run.xlsx",
+            background=BackgroundTask(os.remove, result["file"]),
+        )
+    return result
+
+
 @router.post("/upload-file/")
 async def upload_file(file: UploadFile = File(...)):
     try:
@@ -55,23 +91,20 @@ async def upload_file(file: UploadFile = File(...)):
         for folder in folders:
             folder.mkdir(parents=True, exist_ok=True)
 
-        content = await file.read()
-
+        # Файл пишется на диск частями и читается оттуда один раз, листы - пачками строк
         manual_path = Path("manual_download") / file.filename
         with open(manual_path, "wb") as f:
-            f.write(content)
-
-        new_apart = pd.read_excel(BytesIO(content), sheet_name="new_apart")
-        old_apart = pd.read_excel(BytesIO(content), sheet_name="old_apart")
-        cin = pd.read_excel(BytesIO(content), sheet_name="cin")
-
-        insert_to_db(
-            new_apart_df=new_apart,
-            old_apart_df=old_apart,
-            cin_df=cin,
-            file_name=file.filename,
-            file_path=str(manual_path),
-        )
+            shutil.copyfileobj(file.file, f)
+
+        with open_workbook(manual_path) as workbook:
+            await run_in_threadpool(
+                insert_to_db,
+                new_apart_df=iter_sheet(workbook, "new_apart"),
+                old_apart_df=iter_sheet(workbook, "old_apart"),
+                cin_df=iter_sheet(workbook, "cin"),
+                file_name=file.filename,
+                file_path=str(manual_path),
+            )
         return {"message": "Файл успешно загружен и обработан"}
 
     except Exception as e:
@@ -12,6 +12,8 @@ from service.apartment_insert import insert_data_to_new_apart, insert_data_to_ol
 from service.order_insert import insert_data_to_order_decisions
 from service.cin_insert import insert_cin
 from service.auth import mp_employee_required
+from service.rank_refresh import refresh_ranks
+from repository.database import db_connection
 from datetime import timedelta
 
 router = APIRouter(
@@ -20,6 +22,19 @@ router = APIRouter(
 )
 
 
+def refresh_ranks_after_load():
+    # Ранги пересчитываем только в затронутых выгрузкой группах. Выгрузка к этому моменту
+    # сохранена, но об ошибке пересчета вызывающий должен узнать
+    try:
+        with db_connection() as conn:
+            return refresh_ranks(conn)
+    except Exception as e:
+        print("RANK REFRESH FAILED", e)
+        raise HTTPException(
+            status_code=500, detail=f"Данные загружены, но ранги не пересчитаны: {str(e)}"
+        )
+
+
 @router.get("/update_info_stat", response_model=List[EnvStatResponse])
 async def get_update_info():
     result = await env_service.get_env_history()
@@ -32,7 +47,7 @@ async def get_update_info():
 
 
 @router.patch("/get_old_apart", description="Для обновления старых квартир с РСМ")
-def from_rsm_get_old_apart() -> None:
+def from_rsm_get_old_apart():
     category = [70, 97]
     layout_id = 22223
     start_date = datetime(2017, 1, 1, 0, 0, 0)
@@ -47,7 +62,8 @@ def from_rsm_get_old_apart() -> None:
 
     if isinstance(result, Exception):
         raise result
-    return {result}
+    refresh_ranks_after_load()
+    return result
 
 
 @router.patch("/get_new_apart", description="Для обновления ресурса с РСМ")
@@ -61,7 +77,11 @@ def from_rsm_get_new_apart():
         output = BytesIO()
         output.seek(0)
         result = insert_data_to_new_apart(df)
+        if not isinstance(result, Exception):
+            refresh_ranks_after_load()
         return {"status": "success", "inserted": result}
+    except HTTPException:
+        raise
     except Exception as e:
         return e
 
@@ -8,6 +8,7 @@ from models.xlsx import CurrentTableRequest
 from schema.apartment import ApartType
 from schema.user import User
 from service.auth import get_user
+from utils.pagination import MAX_PAGE_SIZE
 
 router = APIRouter(prefix="/tables", tags=["Table and Tree"])
 
@@ -80,6 +81,15 @@ async def get_apartments(
     fio: str = Query(None, example="Иванов"),
     stage: Optional[List[str]] = Query(None, example=["Не начато"]),
     otsel_type: Optional[List[str]] = Query(None, example=["Полное переселение"]),
+    sort_by: Optional[str] = Query(None, description="Колонка серверной сортировки"),
+    sort_order: Literal["asc", "desc"] = Query("asc", description="Направление сортировки"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы из next_cursor"),
+    page_size: Optional[int] = Query(
+        None,
+        ge=1,
+        description=f"Размер страницы (не больше {MAX_PAGE_SIZE}). Без него возвращается весь список",
+    ),
+    with_total: bool = Query(False, description="Добавить оценку общего числа строк"),
 ):
     try:
         return await apartment_service.get_apartments(
@@ -98,6 +108,11 @@ async def get_apartments(
             fio=fio,
             stage=stage,
             otsel_type=otsel_type,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            cursor=cursor,
+            page_size=page_size,
+            with_total=with_total,
         )
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
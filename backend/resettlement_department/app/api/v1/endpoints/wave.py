@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, status
 from typing import Dict, Any
-from repository.database import get_db_connection
-from service.wave import waves
+from fastapi.concurrency import run_in_threadpool
+from depends import job_runner
+from service.wave import run_waves
 from service.auth import mp_employee_required, Depends
 
 router = APIRouter(prefix="/wave", tags=["wave"], 
@@ -16,16 +17,19 @@ async def process_waves(data: Dict[str, Any]):
             detail="Request body cannot be empty",
         )
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        result = waves(data, cursor, conn)
-
-        conn.commit()
-        cursor.close()
-        conn.close()
+        result = await run_in_threadpool(run_waves, data)
 
         return {"status": "success", "result": result}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/process_waves/jobs")
+async def submit_waves(data: Dict[str, Any]):
+    if not data:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Request body cannot be empty",
+        )
+    return {"job_id": job_runner.submit("waves", run_waves, data=data)}
@@ -13,6 +13,12 @@ class ProjectManagementSettings:
     DB_PASSWORD: str = os.environ.get("DB_PASS")
     DB_NAME: str = os.environ.get("DB_NAME")
     DB_SCHEMA: str = os.environ.get("DB_SCHEMA")
+    # Размеры пулов соединений: async-движок на процесс и psycopg2 для синхронной работы в потоках
+    DB_POOL_SIZE: int = int(os.environ.get("DB_POOL_SIZE", 10))
+    DB_POOL_OVERFLOW: int = int(os.environ.get("DB_POOL_OVERFLOW", 5))
+    DB_SYNC_POOL_SIZE: int = int(os.environ.get("DB_SYNC_POOL_SIZE", 8))
+    # Сколько секунд ждать свободное соединение синхронного пула, потом ошибка
+    DB_SYNC_POOL_TIMEOUT: float = float(os.environ.get("DB_SYNC_POOL_TIMEOUT", 60))
 
     @property
     def DATABASE_URL(self) -> str:
@@ -54,6 +60,17 @@ class RSM:
     PASS = os.environ["RSM_PASS"]
     PING_LINK = os.environ["RSM_PING_LINK"]
     COUNTER_LAYOUT = 21703
+    # Выгрузки XLSX: параллельные окна по датам и каталог с уже скачанными окнами
+    EXPORT_WORKERS = int(os.environ.get("RSM_EXPORT_WORKERS", 4))
+    EXPORT_WINDOW_ROWS = int(os.environ.get("RSM_EXPORT_WINDOW_ROWS", 20000))
+    EXPORT_CHECKPOINT_DIR = os.environ.get("RSM_EXPORT_CHECKPOINT_DIR", "rsm_export")
+    # Поиск по реестрам: одновременных запросов к РСМ в одной сессии
+    FETCH_CONCURRENCY = int(os.environ.get("RSM_FETCH_CONCURRENCY", 10))
+    # Токен РСМ: ожидаемый срок жизни и за сколько до его конца обновлять в фоне, секунды
+    TOKEN_TTL = int(os.environ.get("RSM_TOKEN_TTL", 4 * 3600))
+    TOKEN_REFRESH_MARGIN = int(os.environ.get("RSM_TOKEN_REFRESH_MARGIN", 15 * 60))
+    # Процессов для proof-of-work при входе (0 - по числу ядер)
+    POW_WORKERS = int(os.environ.get("RSM_POW_WORKERS", 0))
 
     # Группы льгот
     AFFAIR_GRLGOT_DICT = {
@@ -107,6 +124,12 @@ class RSM:
     unchanged_params_count = {}
 
 
+class MatchingSetting:
+    # Процессов для подбора по комнатностям: 1 - последовательно. При большем числе
+    # очередники (ochered) подбираются до разбиения по комнатностям
+    WORKERS = int(os.environ.get("MATCHING_WORKERS", 1))
+
+
 @dataclass
 class Settings:
     project_management_setting: ProjectManagementSettings = field(
@@ -17,6 +17,7 @@ from service.history_service import HistoryService
 from service.offer_service import OfferService
 from service.order_service import OrderService
 from service.mail_index import MailIndexService
+from service.job_runner import JobRunner
 
 old_apartment_repository = OldApartRepository(project_managment_session)
 new_apartment_repository = NewApartRepository(project_managment_session)
@@ -41,4 +42,6 @@ cin_repository = CinRepository(project_managment_session)
 cin_service = CinService(cin_repository)
 
 mail_index_repository = MailIndexRepositroy(project_managment_session)
-mail_index_service = MailIndexService(mail_index_repository)
\ No newline at end of file
+mail_index_service = MailIndexService(mail_index_repository)
+
+job_runner = JobRunner()
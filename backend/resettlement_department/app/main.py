@@ -1,8 +1,12 @@
 import time
 
 from api.v1.router import router
+from depends import job_runner
+from repository.database import close_pools, dispose_engines
 from core.logger import logger
 from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from service.migrations import run_migrations
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI()
@@ -37,4 +41,13 @@ app.include_router(router)
 
 @app.on_event("startup")
 async def startup_event():
-    logger.info("🚀 Application started")
\ No newline at end of file
+    # Проекции и служебные таблицы должны существовать до первого запроса
+    await run_in_threadpool(run_migrations)
+    logger.info("🚀 Application started")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    job_runner.shutdown()
+    close_pools()
+    await dispose_engines()
@@ -36,3 +36,4 @@ class OrderDecisions(Base):
     unom = Column(Integer)
     un_kv = Column(Integer)
     cad_num = Column(String)
+    row_hash = Column(BigInteger)
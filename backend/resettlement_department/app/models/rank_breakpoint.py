@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, DateTime, BigInteger, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from models.base import Base
+
+
+class RankBreakpoint(Base):
+    __tablename__ = "rank_breakpoint"
+
+    history_id = Column(Integer, primary_key=True)
+    room_count = Column(Integer, primary_key=True)
+    # Отсортированные уникальные living_area + full_living_area семей, в сотых кв.м
+    breakpoints = Column(ARRAY(BigInteger), nullable=False)
+    fingerprint = Column(String(40), nullable=False)
+    # Квартиры, ранги которых выставил подбор: при пересчете переносятся на новые границы
+    pinned = Column(ARRAY(BigInteger), nullable=False, server_default=text("'{}'"))
+    # Сумма журнала data_change истории на момент последнего пересчета
+    history_version = Column(BigInteger)
+    updated_at = Column(DateTime(timezone=True), server_default=text("now()"))
@@ -1,4 +1,4 @@
-from repository.database import get_db_connection_dashboard
+from repository.database import db_connection
 from utils.sql_reader import read_sql_query, async_read_sql_query
 from core.config import RENOVATION_FILE_PATH, RECOMMENDATION_DASHBOARD_FILE_PATH
 from core.logger import logger
@@ -11,35 +11,34 @@ class DashboardRepository:
         self.db = db
 
     def get_tables_data(self) -> list[tuple]:
-        conn = get_db_connection_dashboard()
-        cursor = conn.cursor()
         query = read_sql_query(f"{RENOVATION_FILE_PATH}/DashboardTables.sql")
         logger.query(query)
-        cursor.execute(query)
+        with db_connection("dashboard") as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                _building_info = cursor.fetchall()
 
-        _building_info = cursor.fetchall()
         print(_building_info)
         return _building_info
 
     def get_dashboard_details(self):
-        conn = get_db_connection_dashboard()
-        cursor = conn.cursor()
         query = read_sql_query(f"{RENOVATION_FILE_PATH}/Dashboard.sql")
         logger.query(query)
-        cursor.execute(query)
-
-        _dashboard_data = cursor.fetchall()
+        with db_connection("dashboard") as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                _dashboard_data = cursor.fetchall()
 
         return _dashboard_data
 
     def get_building_details(self, building_id: int):
-        conn = get_db_connection_dashboard()
-        cursor = conn.cursor()
         query = read_sql_query(f"{RENOVATION_FILE_PATH}/BuildingDetails.sql")
         params = (building_id,)
         logger.query(query, params)
-        cursor.execute(query, params)
-        _building_data = cursor.fetchall()
+        with db_connection("dashboard") as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                _building_data = cursor.fetchall()
 
         return _building_data
 
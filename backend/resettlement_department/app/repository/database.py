@@ -1,23 +1,45 @@
+import threading
+from contextlib import contextmanager
+
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
 from core.config import settings
 
 import psycopg2
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
 schema = settings.project_management_setting.DB_SCHEMA
 
+# Пул asyncpg внутри движка: соединения переиспользуются между запросами, число ограничено
+ENGINE_POOL_OPTIONS = {
+    "pool_size": settings.project_management_setting.DB_POOL_SIZE,
+    "max_overflow": settings.project_management_setting.DB_POOL_OVERFLOW,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+
 project_managment_engine = create_async_engine(
-    settings.project_management_setting.DATABASE_URL
+    settings.project_management_setting.DATABASE_URL, **ENGINE_POOL_OPTIONS
 )
 project_managment_session = sessionmaker(project_managment_engine, class_=AsyncSession)
 
-dashboard_engine = create_async_engine(settings.dashboard_setting.DATABASE_URL)
+dashboard_engine = create_async_engine(settings.dashboard_setting.DATABASE_URL, **ENGINE_POOL_OPTIONS)
 dashboard_session = sessionmaker(project_managment_engine, class_=AsyncSession)
 
 
-def get_db_connection_dashboard():
-    return psycopg2.connect(
+def _project_management_params():
+    return dict(
+        host=settings.project_management_setting.DB_HOST,
+        user=settings.project_management_setting.DB_USER,
+        password=settings.project_management_setting.DB_PASSWORD,
+        port=settings.project_management_setting.DB_PORT,
+        database=settings.project_management_setting.DB_NAME,
+    )
+
+
+def _dashboard_params():
+    return dict(
         host=settings.dashboard_setting.DB_DASHBORD_HOST,
         user=settings.dashboard_setting.DB_DASHBORD_USER,
         password=settings.dashboard_setting.DB_DASHBORD_PASSWORD,
@@ -26,11 +48,112 @@ def get_db_connection_dashboard():
     )
 
 
+POOL_PARAMS = {
+    "project_management": _project_management_params,
+    "dashboard": _dashboard_params,
+}
+
+
+def _is_alive(conn):
+    # Проверка при выдаче из пула: соединение могло оборваться (рестарт базы, таймаут на сервере)
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+class BlockingConnectionPool(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool, который при исчерпании ждет свободное соединение не дольше timeout
+    секунд, затем бросает PoolError. Битые соединения при выдаче заменяются новыми.
+    """
+
+    def __init__(self, minconn, maxconn, *args, timeout=None, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PoolError(f"Нет свободного соединения с базой за {self._timeout} с")
+        try:
+            conn = super().getconn(key)
+            if not _is_alive(conn):
+                super().putconn(conn, key, close=True)
+                conn = super().getconn(key)
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name="project_management"):
+    # Пул создается при первом обращении в каждом процессе (в том числе в исполнителях задач)
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None or pool.closed:
+            pool = BlockingConnectionPool(
+                1,
+                settings.project_management_setting.DB_SYNC_POOL_SIZE,
+                timeout=settings.project_management_setting.DB_SYNC_POOL_TIMEOUT,
+                **POOL_PARAMS[name](),
+            )
+            _pools[name] = pool
+        return pool
+
+
+@contextmanager
+def db_connection(name="project_management"):
+    """
+    Соединение psycopg2 из пула на время блока.
+
+    Как и with psycopg2.connect(): при успехе транзакция фиксируется, при ошибке
+    откатывается. После блока соединение возвращается в пул (битое - закрывается).
+    """
+    pool = get_pool(name)
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            if not pool.closed:
+                pool.closeall()
+        _pools.clear()
+
+
+async def dispose_engines():
+    await project_managment_engine.dispose()
+    await dashboard_engine.dispose()
+
+
+def get_db_connection_dashboard():
+    return psycopg2.connect(**_dashboard_params())
+
+
 def get_db_connection():
-    return psycopg2.connect(
-        host=settings.project_management_setting.DB_HOST,
-        user=settings.project_management_setting.DB_USER,
-        password=settings.project_management_setting.DB_PASSWORD,
-        port=settings.project_management_setting.DB_PORT,
-        database=settings.project_management_setting.DB_NAME,
-    )
+    return psycopg2.connect(**_project_management_params())
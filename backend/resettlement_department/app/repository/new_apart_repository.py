@@ -2,8 +2,16 @@ from core.config import RECOMMENDATION_FILE_PATH
 from schema.apartment import ApartType
 from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
+from utils.pagination import fetch_page
 from utils.sql_reader import async_read_sql_query
 
+# Колонки NewApartTable.sql, по которым разрешена серверная сортировка
+NEW_APART_SORT_COLUMNS = {
+    "new_apart_id", "house_address", "apart_number", "district", "municipal_district", "floor",
+    "full_living_area", "total_living_area", "living_area", "room_count", "status", "selection_count",
+    "rank", "created_at", "entrance_number",
+}
+
 
 
 class NewApartRepository:
@@ -130,6 +138,11 @@ class NewApartRepository:
         is_queue: bool = None,
         is_private: bool = None,
         statuses: list[str] = None,
+        sort_by: str = None,
+        sort_order: str = "asc",
+        cursor: str = None,
+        page_size: int = None,
+        with_total: bool = False,
     ) -> list[dict]:
         if area_type not in ["full_living_area", "total_living_area", "living_area"]:
             raise ValueError(f"Invalid area type: {area_type}")
@@ -205,6 +218,16 @@ class NewApartRepository:
             f"{RECOMMENDATION_FILE_PATH}/NewApartTable.sql"
         )
 
+        if sort_by is not None and sort_by not in NEW_APART_SORT_COLUMNS:
+            raise ValueError(f"Invalid sort column: {sort_by}")
+        if page_size is not None or sort_by is not None or cursor is not None:
+            async with self.db() as session:
+                return await fetch_page(
+                    session, query, where_clause, params, "new_apart_id",
+                    sort_by=sort_by, sort_order=sort_order, cursor=cursor,
+                    page_size=page_size, with_total=with_total,
+                )
+
         query = f"{query} WHERE {where_clause}"
         async with self.db() as session:
             result = await session.execute(text(query), params)
@@ -5,8 +5,16 @@ from core.config import RECOMMENDATION_FILE_PATH
 from schema.apartment import ApartType
 from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
+from utils.pagination import fetch_page
 from utils.sql_reader import async_read_sql_query
 
+# Колонки OldApartTable.sql, по которым разрешена серверная сортировка
+OLD_APART_SORT_COLUMNS = {
+    "affair_id", "house_address", "apart_number", "district", "municipal_district", "floor", "fio",
+    "full_living_area", "total_living_area", "living_area", "room_count", "status", "selection_count",
+    "rank", "created_at", "people_v_dele",
+}
+
 
 class OldApartRepository:
     def __init__(self, session_maker: sessionmaker):
@@ -140,7 +148,12 @@ class OldApartRepository:
         statuses: List[str] = None,
         fio : str = None,
         stage: List[str] = None,
-        otsel_type: List[str] = None
+        otsel_type: List[str] = None,
+        sort_by: str = None,
+        sort_order: str = "asc",
+        cursor: str = None,
+        page_size: int = None,
+        with_total: bool = False,
     ) -> list[dict]:
         if area_type not in ["full_living_area", "total_living_area", "living_area"]:
             raise ValueError(f"Invalid area type: {area_type}")
@@ -229,6 +242,16 @@ class OldApartRepository:
             f"{RECOMMENDATION_FILE_PATH}/OldApartTable.sql"
         )
 
+        if sort_by is not None and sort_by not in OLD_APART_SORT_COLUMNS:
+            raise ValueError(f"Invalid sort column: {sort_by}")
+        if page_size is not None or sort_by is not None or cursor is not None:
+            async with self.db() as session:
+                return await fetch_page(
+                    session, query, where_clause, params, "affair_id",
+                    sort_by=sort_by, sort_order=sort_order, cursor=cursor,
+                    page_size=page_size, with_total=with_total,
+                )
+
         query = f"{query} WHERE {where_clause}"
         print(query)
         async with self.db() as session:
@@ -307,13 +330,11 @@ class OldApartRepository:
 
                 if check_exist.fetchone() is not None:
                     check_approved_query = text("""
-                        SELECT jsonb_object_agg(key::text, value) 
-                        FROM (
-                            SELECT key, value 
-                            FROM offer, jsonb_each(new_aparts)
-                            WHERE affair_id = :apart_id
-                            AND (value->>'status_id')::int = 1 and offer_id = (select max(offer_id) from offer where affair_id = :apart_id)
-                        ) approved_aparts;
+                        SELECT jsonb_object_agg(oi.new_apart_id::text, o.new_aparts->(oi.new_apart_id::text)) 
+                        FROM offer_item oi
+                        JOIN offer o USING (offer_id)
+                        WHERE oi.offer_id = (select max_offer_id from offer_last where affair_id = :apart_id)
+                        AND oi.status_id = 1;
                     """)
 
                     result = await session.execute(
@@ -381,10 +402,10 @@ class OldApartRepository:
     async def validate_apart_status(self, apart_id : int, new_apart_id : int):
         async with self.db() as session:
                 query = text('''
-                    select affair_id, new_apart.status_id as status_id FROM offer, jsonb_each(new_aparts)
-                    join new_apart ON KEY::bigint = new_apart_id
-                    WHERE KEY::bigint = :new_apart_id
-                    ORDER BY offer_id DESC
+                    select offer_item.affair_id, new_apart.status_id as status_id FROM offer_item
+                    join new_apart USING (new_apart_id)
+                    WHERE offer_item.new_apart_id = :new_apart_id
+                    ORDER BY offer_item.offer_id DESC
                     limit 1
                 ''')
                 
@@ -455,39 +476,24 @@ class OldApartRepository:
                 decline_reason_id = result.scalar()
 
                 update_query = text("""
-                    WITH updated_data AS (
-                        SELECT
-                            offer_id,
-                            new_apart_id,
-                            jsonb_set(
-                                new_aparts->(new_apart_id::text),
-                                '{decline_reason_id}',
-                                to_jsonb((:declined_reason_id)::int)
-                            ) AS updated_value
-                        FROM
-                            offer,
-                            jsonb_each(new_aparts) AS each(new_apart_id, value)
-                        WHERE
-                            offer_id = (SELECT MAX(offer_id) FROM offer where affair_id = :apart_id) 
-                            AND new_apart_id::text = (:new_apart_id)::text 
-                            AND affair_id = :apart_id
-                    )
                     UPDATE offer
                     SET 
                         new_aparts = jsonb_set(
                             new_aparts,
-                            ARRAY[updated_data.new_apart_id::text],
-                            updated_data.updated_value
+                            ARRAY[oi.new_apart_id::text, 'decline_reason_id'],
+                            to_jsonb((:declined_reason_id)::int)
                         )
-                    FROM updated_data
-                    WHERE offer.offer_id = updated_data.offer_id;
+                    FROM offer_item oi
+                    WHERE oi.offer_id = offer.offer_id
+                        AND oi.offer_id = (SELECT max_offer_id FROM offer_last where affair_id = :apart_id) 
+                        AND oi.new_apart_id = :new_apart_id;
                 """)
                 await session.execute(
                     update_query,
                     {
                         "apart_id": apart_id,
                         "declined_reason_id": decline_reason_id,
-                        "new_apart_id": str(new_apart_id),
+                        "new_apart_id": int(new_apart_id),
                     },
                 )
 
@@ -590,16 +596,16 @@ class OldApartRepository:
                             SELECT unnest(ARRAY[{affair_ids}])::int AS affair_id
                         ),
                         with_offers AS (
-                            SELECT DISTINCT o.affair_id
-                            FROM offer o
-                            WHERE o.affair_id IN (SELECT affair_id FROM all_affairs) and ((select status_id from get_status_id) not in (14))
+                            SELECT ol.affair_id
+                            FROM offer_last ol
+                            WHERE ol.affair_id IN (SELECT affair_id FROM all_affairs) and ((select status_id from get_status_id) not in (14))
                         ),
                         without_offers AS (
                             SELECT a.affair_id
                             FROM all_affairs a
                             WHERE NOT EXISTS (
-                                SELECT 1 FROM offer o 
-                                WHERE o.affair_id = a.affair_id
+                                SELECT 1 FROM offer_last ol 
+                                WHERE ol.affair_id = a.affair_id
                             )
                             AND EXISTS (
                                 SELECT 1 FROM old_apart oa 
@@ -607,10 +613,9 @@ class OldApartRepository:
                             )
                         ),
                         latest_offers AS (
-                            SELECT MAX(offer_id) as offer_id, affair_id
-                            FROM offer
+                            SELECT max_offer_id as offer_id, affair_id
+                            FROM offer_last
                             WHERE affair_id IN (SELECT affair_id FROM with_offers)
-                            GROUP BY affair_id
                         ),
                         update_offers AS (
                             UPDATE offer
@@ -734,9 +739,8 @@ class OldApartRepository:
             result = await session.execute(text(
                 f'''
                 with last_offer AS (
-                    SELECT affair_id, KEY::bigint as new_apart_id FROM offer, jsonb_each(new_aparts)
+                    SELECT affair_id, new_apart_id FROM offer_last_apart
                     where affair_id in ({apart_ids}) 
-                    and offer_id in (select max(offer_id) from offer group by affair_id)
                 )
                 select 
                     old_apart.affair_id as "ID дела", 
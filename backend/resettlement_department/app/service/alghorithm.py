@@ -1,20 +1,32 @@
-import psycopg2
 import pandas as pd
-from core.config import settings
-from datetime import datetime
-import json
+from core.config import MatchingSetting
+from repository.database import db_connection
 from service.balance_alghorithm import save_views_to_excel
+from service.dry_run import summarize, write_summary
+from service.job_runner import report_progress
+from service.matching_engine import match_families
+from service.offer_writer import merge_offers, update_ranks
+from service.rank_index import rank_new_aparts
+from service.rank_refresh import pin_matched_ranks, save_rank_baseline
+from service.snapshot import normalize_new_addresses, snapshot_cache
 import os 
+import tempfile
+
+
+def rank_frames(df_old_apart, df_new_apart):
+    """Ранги семей и ресурса по комнатностям (столбцы combined_area и rank)."""
+    # Создаем комбинированный столбец для старых и новых квартир
+    df_old_apart["combined_area"] = (df_old_apart["living_area"] + df_old_apart["full_living_area"])
+    df_new_apart["combined_area"] = (df_new_apart["living_area"] + df_new_apart["full_living_area"])
+
+    # Присваиваем ранги старым квартирам
+    df_old_apart["rank"] = df_old_apart.groupby("room_count")["combined_area"].rank(method="dense").astype(int)
+
+    # Присваиваем ранги новым квартирам на основе рангов старых:
+    # максимальный ранг старой квартиры, которую новая покрывает по всем площадям
+    df_new_apart["rank"] = rank_new_aparts(df_old_apart, df_new_apart)
+    return df_old_apart, df_new_apart
 
-def get_db_connection():
-    return psycopg2.connect(
-        host=settings.project_management_setting.DB_HOST,
-        user=settings.project_management_setting.DB_USER,
-        password=settings.project_management_setting.DB_PASSWORD,
-        port=settings.project_management_setting.DB_PORT,
-        database=settings.project_management_setting.DB_NAME
-       
-    )
 
 def match_new_apart_to_family_batch(
     start_date=None,
@@ -33,274 +45,23 @@ def match_new_apart_to_family_batch(
         print('POPALSA SUKA')
         return None
     try:
-        with get_db_connection() as conn:
+        with db_connection() as conn:
             with conn.cursor() as cursor:
-                family_query = """
-                        SELECT 
-                        o.affair_id, 
-                        o.kpu_number,
-                        o.district, 
-                        o.municipal_district, 
-                        o.room_count, 
-                        o.full_living_area, 
-                        o.total_living_area, 
-                        o.living_area, 
-                        o.is_special_needs_marker, 
-                        o.min_floor, 
-                        o.max_floor, 
-                        o.buying_date,
-                        ARRAY_AGG(EXTRACT(YEAR FROM AGE(fm.date_of_birth))) AS ages,
-                        count(o.affair_id) AS members_amount,
-                        MAX(EXTRACT(YEAR FROM AGE(fm.date_of_birth::timestamp with time zone))) AS oldest,
-                        o.is_queue,
-                        o.queue_square
-                    FROM 
-						old_apart o 
-                    LEFT JOIN 
-                        family_member fm ON o.kpu_number = fm.kpu_number 
-                    WHERE (o.rsm_status <> 'снято' or rsm_status is NULL) 
-		    	AND o.affair_id NOT IN (
-                            SELECT affair_id
-                            FROM  offer
-                            where status_id not in (2, 14)
-                        )
-			AND o.affair_id NOT IN (
-                            SELECT affair_id
-                            FROM  old_apart
-                            where status_id = 14
-                        ) 
-                """
-                
-                old_apart_query_params = []
-
-                # Дополнительные фильтры
-                if old_selected_addresses:
-                    family_query += " AND o.house_address IN %s"
-                    old_apart_query_params.append(tuple(old_selected_addresses))
-
-                if old_selected_districts:
-                    family_query += " AND o.district IN %s"
-                    old_apart_query_params.append(tuple(old_selected_districts))
-
-                if old_selected_areas:
-                    family_query += " AND o.municipal_district IN %s"
-                    old_apart_query_params.append(tuple(old_selected_areas))
-
-                if date:
-                    family_query += " AND o.updated_at = (SELECT MAX(updated_at) FROM public.old_apart)"
-                
-                # Добавляем секцию GROUP BY
-                family_query += """
-						GROUP BY 
-                        o.affair_id, 
-                        o.kpu_number, 
-                        o.district, 
-                        o.municipal_district, 
-                        o.room_count, 
-                        o.full_living_area, 
-                        o.total_living_area, 
-                        o.living_area, 
-                        o.is_special_needs_marker, 
-                        o.min_floor, 
-                        o.max_floor, 
-                        o.buying_date, 
-                        o.is_queue, 
-                        o.queue_square
-                    ORDER BY 
-                        o.room_count ASC, 
-                        (o.full_living_area + o.living_area + (COUNT(fm.family_member_id) / 3.9)) ASC, 
-                        MAX(EXTRACT(YEAR FROM AGE(fm.date_of_birth::timestamp with time zone))) DESC,
-                       	o.living_area ASC,  
-                        o.full_living_area ASC, 
-                        o.total_living_area ASC;
-                """
-
-                # Выполнение запроса
-                cursor.execute(family_query, old_apart_query_params)
-                old_aparts = cursor.fetchall()
-                print('FAMILY QUERY', len(old_aparts), family_query, old_apart_query_params)
-                if not old_aparts:
+                # Семьи и ресурс - срезы снимка, тяжелые выборки не повторяются, пока данные не менялись
+                snapshot = snapshot_cache.get(cursor)
+                df_old_apart = snapshot.families(old_selected_addresses, old_selected_districts, old_selected_areas, date)
+                print('FAMILY QUERY', len(df_old_apart), old_selected_addresses, old_selected_districts, old_selected_areas)
+                if df_old_apart.empty:
                     return ("No old apartments found.")
-                # Запрос для новых квартир с учетом диапазонов
-                new_apart_query = """
-                    SELECT
-                        na.new_apart_id,
-                        na.district,
-                        na.municipal_district,
-                        na.house_address,
-                        na.apart_number,
-                        na.floor,
-                        na.room_count,
-                        na.full_living_area,
-                        na.total_living_area,
-                        na.living_area,
-                        na.for_special_needs_marker
-                        FROM
-                        public.new_apart na
-                    WHERE
-                        NOT EXISTS (
-                            SELECT 1
-                            FROM public.offer o,
-                                jsonb_each(o.new_aparts::jsonb) AS j(key, value)
-                            WHERE
-                            j.key = na.new_apart_id::text
-                            AND (value->>'status_id')::int != 2
-                        )
-                        AND (na.status_id NOT IN (12, 13, 15) OR na.status_id IS NULL)
-                """
-
-                new_apart_query_params = []
                 print('NEW_ADDRESSES --------------------------------------------------', new_selected_addresses)
+                new_selected_addresses = normalize_new_addresses(new_selected_addresses)
+                df_new_apart = snapshot.new_aparts(new_selected_addresses, new_selected_districts, new_selected_areas, date)
 
-                # Обрабатываем адреса с диапазонами квартир
-                if new_selected_addresses and len(new_selected_addresses) > 0:
-                    print(new_selected_addresses)
-                    # Извлекаем данные из вложенного списка
-                    if isinstance(new_selected_addresses, list) and len(new_selected_addresses) > 0 and isinstance(new_selected_addresses[0], list):
-                        new_selected_addresses = new_selected_addresses[0]
-                    
-                    address_conditions = []
-                    
-                    for address_data in new_selected_addresses:
-                        # Проверяем, является ли address_data словарем
-                        if not isinstance(address_data, dict):
-                            continue
-                            
-                        address = address_data.get('address')
-                        sections = address_data.get('sections', [])
-                        
-                        # Если нет секций, добавляем просто условие по адресу
-                        if not sections:
-                            address_conditions.append("(na.house_address = %s)")
-                            new_apart_query_params.append(address)
-                            continue
-                            
-                        # Для каждого адреса создаем условия по секциям и диапазонам
-                        section_conditions = []
-                        
-                        for section_data in sections:
-                            if not isinstance(section_data, dict):
-                                continue
-                                
-                            section = section_data.get('section')
-                            range_data = section_data.get('range', {})
-                            
-                            # Обрабатываем разные форматы range (как объект или массив)
-                            if isinstance(range_data, dict):
-                                try:
-                                    min_apart = int(range_data.get('from', 0))
-                                    max_apart = int(range_data.get('to', 0))
-                                except (ValueError, TypeError):
-                                    continue  # Пропускаем некорректные данные
-                            elif isinstance(range_data, list) and len(range_data) >= 2:
-                                try:
-                                    min_apart = int(range_data[0])
-                                    max_apart = int(range_data[1])
-                                except (ValueError, TypeError):
-                                    continue  # Пропускаем некорректные данные
-                            else:
-                                continue  # Пропускаем некорректные данные
-                            
-                            # Добавляем условие для номера квартиры в диапазоне
-                            section_conditions.append(
-                                "(na.house_address = %s AND na.apart_number BETWEEN %s AND %s)"
-                            )
-                            new_apart_query_params.extend([address, min_apart, max_apart])
-                        
-                        # Объединяем условия для секций через OR
-                        if section_conditions:
-                            address_conditions.append(f"({' OR '.join(section_conditions)})")
-                        else:
-                            # Если были секции, но все оказались некорректными, все равно добавляем адрес
-                            address_conditions.append("(na.house_address = %s)")
-                            new_apart_query_params.append(address)
-
-                    # Объединяем условия для адресов через OR
-                    if address_conditions:
-                        new_apart_query += " AND (" + " OR ".join(address_conditions) + ")"
-
-                # Остальные условия (районы, муниципальные округа, дата)
-                if new_selected_districts:
-                    new_apart_query += " AND district IN %s"
-                    new_apart_query_params.append(tuple(new_selected_districts))
-
-                if new_selected_areas:
-                    new_apart_query += " AND municipal_district IN %s"
-                    new_apart_query_params.append(tuple(new_selected_areas))
-
-                if date:
-                    new_apart_query += " AND updated_at = (SELECT MAX(updated_at) FROM public.new_apart)"
-
-                # Сортировка
-                new_apart_query += " ORDER BY room_count ASC, (full_living_area + living_area), floor, living_area ASC, full_living_area ASC, total_living_area ASC"
-
-                print("Final query:", new_apart_query)
-                print("New Apart Query params:", new_apart_query_params)
-
-                cursor.execute(new_apart_query, new_apart_query_params)
-                new_aparts = cursor.fetchall()
-                #print(new_aparts)
-                #print('FAMILY QUERY', len(new_aparts), new_apart_query, new_apart_query_params)
-                #print(new_apart_query, new_apart_query_params)
-
-                if not new_aparts:
+                if df_new_apart.empty:
                     return("No new apartments found.")
-                
-                # --- Создание DataFrame и расчет рангов ---
-                df_old_apart = pd.DataFrame(old_aparts,columns=[
-                        "affair_id", "kpu_number", "district", "municipal_district", "room_count", "full_living_area",
-                        "total_living_area", "living_area", "is_special_needs_marker", "min_floor", "max_floor", "buying_date", 
-                        "ages", "members_amount", "oldest", "is_queue", "queue_square",
-                    ],
-                )
-
-                df_new_apart = pd.DataFrame(new_aparts, columns=[
-                        "new_apart_id", "district", "municipal_district", "house_address", "apart_number", "floor",
-                        "room_count", "full_living_area", "total_living_area", "living_area", "for_special_needs_marker",
-                    ],
-                )
-                df_new_apart_rev = pd.DataFrame(new_aparts, columns=[
-                        "new_apart_id", "district", "municipal_district", "house_address", "apart_number", "floor",
-                        "room_count", "full_living_area", "total_living_area", "living_area", "for_special_needs_marker",
-                    ],
-                )
-                # Создаем комбинированный столбец для старых и новых квартир
-                df_old_apart["combined_area"] = (df_old_apart["living_area"] + df_old_apart["full_living_area"])
-                df_new_apart["combined_area"] = (df_new_apart["living_area"] + df_new_apart["full_living_area"])
-
-                # Присваиваем ранги старым квартирам
-                df_old_apart["rank"] = df_old_apart.groupby("room_count")["combined_area"].rank(method="dense").astype(int)
-
-                # Определяем минимальную площадь среди старых квартир 1 ранга
-                min_area_rank_1 = df_old_apart[df_old_apart["rank"] == 1].groupby("room_count")["combined_area"].min().to_dict()
 
-                # Создаем словарь для хранения максимальных рангов по количеству комнат среди старых квартир
-                max_rank_by_room_count = df_old_apart.groupby("room_count")["rank"].max().to_dict()
-
-                # Присваиваем ранги новым квартирам на основе рангов старых
-                df_new_apart["rank"] = 0  # Инициализация колонки для рангов в новых квартирах
-                
-
-                for idx, new_row in df_new_apart.iterrows():
-                    # Определяем минимальную площадь для 1 ранга
-                    min_area_1_rank = min_area_rank_1.get(new_row["room_count"], float("inf"))
-
-                    # Присваиваем ранг 0, если площадь новой квартиры меньше минимальной площади старой квартиры с 1 рангом
-                    if new_row["combined_area"] < min_area_1_rank:
-                        df_new_apart.at[idx, "rank"] = 0
-                    else:
-                        # Фильтруем старые квартиры, чтобы найти максимальную старую квартиру, которая покрывается новой
-                        filtered_old = df_old_apart[
-                            (df_old_apart["room_count"] == new_row["room_count"]) &
-                            (df_old_apart["living_area"] <= new_row["living_area"]) &
-                            (df_old_apart["full_living_area"] <= new_row["full_living_area"]) &
-                            (df_old_apart["total_living_area"] <= new_row["total_living_area"]) & 
-                            (df_old_apart["is_special_needs_marker"] == new_row["for_special_needs_marker"])
-                        ]
-
-                        if not filtered_old.empty:
-                            max_rank = filtered_old["rank"].max()
-                            df_new_apart.at[idx, "rank"] = max_rank
+                report_progress("rank", old_apart=len(df_old_apart), new_apart=len(df_new_apart))
+                df_old_apart, df_new_apart = rank_frames(df_old_apart, df_new_apart)
 
                 # Объединяем данные старых и новых квартир
                 df_combined = pd.concat([df_old_apart.assign(status="old"), df_new_apart.assign(status="new")], ignore_index=True)
@@ -309,26 +70,12 @@ def match_new_apart_to_family_batch(
                 df_combined["rank_group"] = df_combined["rank"].astype(int)
 
                 # Обновляем ранги в базе данных для старых и новых квартир
-                old_apart_rank_update = list(zip(df_old_apart["rank"], df_old_apart["affair_id"]))
-                new_apart_rank_update = list(zip(df_new_apart["rank"], df_new_apart["new_apart_id"]))
-
-                cursor.executemany(
-                    """UPDATE public.old_apart
-                                    SET rank = %s
-                                    WHERE affair_id = %s""",
-                    old_apart_rank_update,
-                )
-                cursor.executemany(
-                    """UPDATE public.new_apart
-                                    SET rank = %s
-                                    WHERE new_apart_id = %s
-                                """,
-                    new_apart_rank_update,
-                )
+                update_ranks(cursor, "old_apart", "affair_id", zip(df_old_apart["affair_id"], df_old_apart["rank"]))
+                update_ranks(cursor, "new_apart", "new_apart_id", zip(df_new_apart["new_apart_id"], df_new_apart["rank"]))
 
                 # Prepare lists of IDs directly from the result sets
-                old_apart_ids_for_history = [row[0] for row in old_aparts]
-                new_apart_ids_for_history = [row[0] for row in new_aparts]
+                old_apart_ids_for_history = df_old_apart["affair_id"].tolist()
+                new_apart_ids_for_history = df_new_apart["new_apart_id"].tolist()
 
                 cursor.execute("SELECT history_id, old_house_addresses, new_house_addresses FROM public.history")
                 history_data = cursor.fetchall()
@@ -393,522 +140,13 @@ def match_new_apart_to_family_batch(
                     conn.commit()
 
                 # --- Логика поиска соответствий ---
-                offers_to_insert = []
-                cannot_offer_to_insert = []
-
-                old_apart_ranks = df_old_apart.groupby("room_count")["rank"].max().to_dict()
-                old_apart_count = df_old_apart.groupby("room_count")["affair_id"].count().to_dict()
-                new_apart_count = df_new_apart.groupby("room_count")["new_apart_id"].count().to_dict()
-
-                df_old_apart_reversed = df_old_apart.loc[::-1]
-                a = {}
-                delta = {1: 1.5, 2: 3, 3: 5, 4: 6.5, 5: 8, 6: 9.5, 7: 11, 8: 12.5}
-                df_new_apart_second = df_new_apart_rev.loc[::-1]
-                min_rank_by_room = {}
-                flag_ficit = {}
-
-                for i in range(1, (df_old_apart['room_count'].max() if df_old_apart['room_count'].max() > df_new_apart['room_count'].max() else df_new_apart['room_count'].max()) + 1):
-                    if (((old_apart_ranks[i] if old_apart_ranks.get(i) is not None else  0) > (max_rank_by_room_count[i] if max_rank_by_room_count.get(i) is not None else  0)) 
-                    or ((old_apart_count[i] if old_apart_count.get(i) is not None else  0) > (new_apart_count[i] if new_apart_count.get(i) is not None else  0))):
-                        a[i] = 0
-
-                        old_apart_list = []
-
-                        print("DEFICIT")
-                        flag_ficit[i] = 2
-
-                        for _, old_apart in df_old_apart_reversed[df_old_apart_reversed["room_count"] == i].iterrows():
-                            old_apart_id = int(old_apart["affair_id"])
-                            # Определяем условие по этажу
-                            floor_condition = (
-                                ((df_new_apart["floor"] >= (old_apart["min_floor"] - 2)) & 
-                                 (df_new_apart["floor"] <= (old_apart["max_floor"] + 2))
-                                ) if old_apart["min_floor"] or old_apart["max_floor"] else True
-                            )
-
-                            if (old_apart["is_queue"] == 1) and (ochered):
-                                suitable_aparts = df_new_apart[
-                                    (df_new_apart["full_living_area"]>= old_apart["full_living_area"])&
-                                    (df_new_apart["total_living_area"]>= old_apart["total_living_area"])& 
-                                    (df_new_apart["living_area"]>= old_apart["living_area"])& 
-                                    (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"])& 
-                                    (df_new_apart["floor"] >= (old_apart["min_floor"]))&
-                                    (df_new_apart["floor"]<= (old_apart["max_floor"]))
-                                ]
-
-                                # Проверка наличия подходящих квартир
-                                if suitable_aparts.empty:
-                                    suitable_aparts = df_new_apart[
-                                        (df_new_apart["full_living_area"]>= old_apart["full_living_area"])& 
-                                        (df_new_apart["total_living_area"]>= old_apart["total_living_area"])& 
-                                        (df_new_apart["living_area"]>= old_apart["living_area"])& 
-                                        (df_new_apart["for_special_needs_marker"]== old_apart["is_special_needs_marker"])
-                                        & floor_condition
-                                    ]
-
-                                    if suitable_aparts.empty:
-                                        suitable_aparts = df_new_apart[
-                                            (df_new_apart["full_living_area"]>= old_apart["full_living_area"])&
-                                            (df_new_apart["total_living_area"]>= old_apart["total_living_area"])&
-                                            (df_new_apart["living_area"]>= old_apart["living_area"])&
-                                            (df_new_apart["for_special_needs_marker"]== old_apart["is_special_needs_marker"])
-                                        ]
-                                        if suitable_aparts.empty:
-                                            cannot_offer_to_insert.append((old_apart_id,))
-                                            if i in min_rank_by_room:
-                                                if old_apart["rank"] < min_rank_by_room[i]:
-                                                    min_rank_by_room[i] = old_apart["rank"]
-                                            else:
-                                                min_rank_by_room[i] = old_apart["rank"]
-                                        else:
-                                            suitable_apart = suitable_aparts.iloc[0]
-                                            new_apart_id = int(suitable_apart["new_apart_id"])
-                                            old_apart_list.append(old_apart_id)
-                                            df_new_apart = df_new_apart[df_new_apart["new_apart_id"]!= new_apart_id]
-                                    else:
-                                        suitable_apart = suitable_aparts.iloc[0]
-                                        new_apart_id = int(suitable_apart["new_apart_id"])
-                                        old_apart_list.append(old_apart_id)
-                                        df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                else:
-                                    suitable_apart = suitable_aparts.iloc[0]
-                                    new_apart_id = int(suitable_apart["new_apart_id"])
-                                    old_apart_list.append(old_apart_id)
-                                    df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                continue
-
-                            # Условие для даты "Дата покупки"
-                            elif (
-                                old_apart["buying_date"] is not None and old_apart["buying_date"] > datetime.strptime("2017-08-01", "%Y-%m-%d").date()
-                                and not (old_apart["min_floor"] or old_apart["max_floor"])
-                            ):
-                                s = df_new_apart[
-                                    (df_new_apart["room_count"]== old_apart["room_count"])&
-                                    (df_new_apart["full_living_area"]>= old_apart["full_living_area"])&
-                                    (df_new_apart["total_living_area"]>= old_apart["total_living_area"])&
-                                    (df_new_apart["living_area"]>= old_apart["living_area"])&
-                                    (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"])
-                                ]
-
-                                if not s.empty:
-                                    sap = s.iloc[0]
-
-                                    suitable_aparts = df_new_apart[
-                                        (df_new_apart["room_count"]== old_apart["room_count"])& 
-                                        (df_new_apart["full_living_area"]>= old_apart["full_living_area"])&
-                                        (df_new_apart["total_living_area"]>= old_apart["total_living_area"])& 
-                                        (df_new_apart["living_area"]>= old_apart["living_area"])&
-                                        (df_new_apart["for_special_needs_marker"]== old_apart["is_special_needs_marker"])&
-                                        ((df_new_apart["full_living_area"] - sap["full_living_area"])<= delta[i])
-                                    ].sort_values(by="floor", ascending=True)
-
-                                    # Если подходящих квартир нет, проверяем с условием floor_condition
-                                    if suitable_aparts.empty:
-                                        suitable_aparts = df_new_apart[ 
-                                            (df_new_apart["room_count"]== old_apart["room_count"])& 
-                                            (df_new_apart["full_living_area"]>= old_apart["full_living_area"])&
-                                            (df_new_apart["total_living_area"]>= old_apart["total_living_area"])&
-                                            (df_new_apart["living_area"]>= old_apart["living_area"])&
-                                            (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"])
-                                        ]
-
-                                        if suitable_aparts.empty:
-                                            cannot_offer_to_insert.append((old_apart_id,))
-                                            if i in min_rank_by_room:
-                                                if old_apart["rank"] < min_rank_by_room[i]:
-                                                    min_rank_by_room[i] = old_apart["rank"]
-                                            else:
-                                                min_rank_by_room[i] = old_apart["rank"]
-                                        else:
-                                            suitable_apart = suitable_aparts.iloc[0]
-                                            new_apart_id = int(suitable_apart["new_apart_id"])
-                                            df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                            offers_to_insert.append((old_apart_id, new_apart_id))
-                                    else:
-                                        suitable_apart = suitable_aparts.iloc[0]
-                                        new_apart_id = int(suitable_apart["new_apart_id"])
-                                        df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                        offers_to_insert.append((old_apart_id, new_apart_id,))
-                                else:
-                                    cannot_offer_to_insert.append((old_apart_id, ))
-                                    if i in min_rank_by_room:
-                                        if old_apart["rank"] < min_rank_by_room[i]:
-                                            min_rank_by_room[i] = old_apart["rank"]
-                                    else:
-                                        min_rank_by_room[i] = old_apart["rank"]
-
-                            else:
-                                # Если "Дата покупки" <= 2017-08-01 или пустая, используем floor_condition
-                                suitable_aparts = df_new_apart[
-                                    (df_new_apart["room_count"]== old_apart["room_count"])&
-                                    (df_new_apart["full_living_area"]>= old_apart["full_living_area"])&
-                                    (df_new_apart["total_living_area"] >= old_apart["total_living_area"])&
-                                    (df_new_apart["living_area"]>= old_apart["living_area"])&
-                                    (df_new_apart["for_special_needs_marker"]== old_apart["is_special_needs_marker"])&
-                                    (df_new_apart["floor"]>= (old_apart["min_floor"]))& 
-                                    (df_new_apart["floor"] <= (old_apart["max_floor"]))
-                                ]
-                                # Проверка наличия подходящих квартир
-                                if suitable_aparts.empty:
-                                    suitable_aparts = df_new_apart[
-                                        (df_new_apart["room_count"] == old_apart["room_count"])&
-                                        (df_new_apart["full_living_area"] >= old_apart["full_living_area"])&
-                                        (df_new_apart["total_living_area"] >= old_apart["total_living_area"])&
-                                        (df_new_apart["living_area"]>= old_apart["living_area"])&
-                                        (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"])&
-                                        floor_condition
-                                    ]
-
-                                    if suitable_aparts.empty:
-                                        suitable_aparts = df_new_apart[
-                                            (df_new_apart["room_count"] == old_apart["room_count"])&
-                                            (df_new_apart["full_living_area"] >= old_apart["full_living_area"])& 
-                                            (df_new_apart["total_living_area"] >= old_apart["total_living_area"])&
-                                            (df_new_apart["living_area"] >= old_apart["living_area"])& 
-                                            (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"])
-                                        ]
-                                        if suitable_aparts.empty:
-                                            cannot_offer_to_insert.append((old_apart_id, ))
-                                            if i in min_rank_by_room:
-                                                if old_apart["rank"] < min_rank_by_room[i]:
-                                                    min_rank_by_room[i] = old_apart["rank"]
-                                            else:
-                                                min_rank_by_room[i] = old_apart["rank"]
-                                        else:
-                                            suitable_apart = suitable_aparts.iloc[0]
-                                            new_apart_id = int(suitable_apart["new_apart_id"])
-                                            old_apart_list.append(old_apart_id)
-                                            df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                    else:
-                                        suitable_apart = suitable_aparts.iloc[0]
-                                        new_apart_id = int(suitable_apart["new_apart_id"])
-                                        old_apart_list.append(old_apart_id)
-                                        df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                else:
-                                    suitable_apart = suitable_aparts.iloc[0]
-                                    new_apart_id = int(suitable_apart["new_apart_id"])
-                                    old_apart_list.append(old_apart_id)
-                                    df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-
-                        print('REVERSED NEW', df_new_apart_second[df_new_apart_second['room_count'] == 2])
-                        print('REVERSED OLD', df_old_apart_reversed[df_old_apart_reversed["room_count"] == 2])
-
-                        for _, old_apart in df_old_apart_reversed[df_old_apart_reversed["room_count"] == i].iterrows():
-                            old_apart_id = int(old_apart["affair_id"])
-                            #if old_apart_id not in old_apart_list:
-                            #    continue
-                            # Определяем условие по этажу
-                            floor_condition = (
-                                ((df_new_apart_second["floor"]>= (old_apart["min_floor"] - 2))&
-                                (df_new_apart_second["floor"] <= (old_apart["max_floor"] + 2)))
-                                if old_apart["min_floor"] or old_apart["max_floor"]
-                                else True
-                            )
-
-                            # Условие для даты "Дата покупки"
-                            if (old_apart["buying_date"] is not None and old_apart["buying_date"] > datetime.strptime("2017-08-01", "%Y-%m-%d").date()
-                                and not (old_apart["min_floor"] or old_apart["max_floor"])
-                            ):
-                                s = df_new_apart_second[
-                                    (df_new_apart_second["room_count"]== old_apart["room_count"])&
-                                    (df_new_apart_second["full_living_area"]>= old_apart["full_living_area"])& 
-                                    (df_new_apart_second["total_living_area"]>= old_apart["total_living_area"])& 
-                                    (df_new_apart_second["living_area"]>= old_apart["living_area"])& 
-                                    (df_new_apart_second["for_special_needs_marker"]== old_apart["is_special_needs_marker"])
-                                ]
-
-                                if not s.empty:
-                                    sap = s.iloc[0]
-
-                                    suitable_aparts = df_new_apart_second[
-                                        (df_new_apart_second["room_count"] == old_apart["room_count"])& 
-                                        (df_new_apart_second["full_living_area"]>= old_apart["full_living_area"])& 
-                                        (df_new_apart_second["total_living_area"]>= old_apart["total_living_area"])&
-                                        (df_new_apart_second["living_area"]>= old_apart["living_area"])& 
-                                        (df_new_apart_second["for_special_needs_marker"]== old_apart["is_special_needs_marker"])& 
-                                        ((df_new_apart_second["full_living_area"]- sap["full_living_area"] ) <= delta[i])
-                                    ].sort_values(by="floor", ascending=True)
-
-                                    # Если подходящих квартир нет, проверяем с условием floor_condition
-                                    if suitable_aparts.empty:
-                                        suitable_aparts = df_new_apart_second[
-                                            (df_new_apart_second["room_count"]  == old_apart["room_count"])& 
-                                            (df_new_apart_second["full_living_area"]>= old_apart["full_living_area"])& 
-                                            (df_new_apart_second["total_living_area"]>= old_apart["total_living_area"])& 
-                                            (df_new_apart_second["living_area"] >= old_apart["living_area"])& 
-                                            (df_new_apart_second[ "for_special_needs_marker"]== old_apart["is_special_needs_marker"])
-                                        ]
-
-                                        if suitable_aparts.empty:
-                                            cannot_offer_to_insert.append((old_apart_id,))
-                                            if i in min_rank_by_room:
-                                                if old_apart["rank"] < min_rank_by_room[i]:
-                                                    min_rank_by_room[i] = old_apart["rank"]
-                                            else:
-                                                min_rank_by_room[i] = old_apart["rank"]
-                                        else:
-                                            suitable_apart = suitable_aparts.iloc[0]
-                                            new_apart_id = int(suitable_apart["new_apart_id"])
-                                            df_new_apart_second = df_new_apart_second[df_new_apart_second["new_apart_id"]!= new_apart_id]
-                                            offers_to_insert.append((old_apart_id, new_apart_id,))
-                                    else:
-                                        suitable_apart = suitable_aparts.iloc[0]
-                                        new_apart_id = int(suitable_apart["new_apart_id"])
-                                        df_new_apart_second = df_new_apart_second[df_new_apart_second["new_apart_id"] != new_apart_id]
-                                        print(df_new_apart_second[df_new_apart_second["new_apart_id"] == new_apart_id])
-                                        offers_to_insert.append((old_apart_id, new_apart_id,))
-                                else:
-                                    cannot_offer_to_insert.append((old_apart_id, ))
-                                    if i in min_rank_by_room:
-                                        if old_apart["rank"] < min_rank_by_room[i]:
-                                            min_rank_by_room[i] = old_apart["rank"]
-                                    else:
-                                        min_rank_by_room[i] = old_apart["rank"]
-                            else:
-                                # Если "Дата покупки" <= 2017-08-01 или пустая, используем floor_condition
-                                suitable_aparts = df_new_apart_second[
-                                    (df_new_apart_second["room_count"]  == old_apart["room_count"])& 
-                                    (df_new_apart_second["full_living_area"] >= old_apart["full_living_area"])& 
-                                    (df_new_apart_second["total_living_area"]>= old_apart["total_living_area"])& 
-                                    (df_new_apart_second["living_area"]>= old_apart["living_area"])& 
-                                    ( df_new_apart_second["for_special_needs_marker"] == old_apart["is_special_needs_marker"])& 
-                                    (df_new_apart_second["floor"] >= (old_apart["min_floor"]))& 
-                                    (df_new_apart_second["floor"]<= (old_apart["max_floor"]))
-                                ]
-
-                                # Проверка наличия подходящих квартир
-                                if suitable_aparts.empty:
-                                    suitable_aparts = df_new_apart_second[
-                                        (df_new_apart_second["room_count"] == old_apart["room_count"])& 
-                                        (df_new_apart_second["full_living_area"]>= old_apart["full_living_area"])& 
-                                        (df_new_apart_second["total_living_area"]>= old_apart["total_living_area"])& 
-                                        (df_new_apart_second["living_area"]>= old_apart["living_area"])& 
-                                        (df_new_apart_second["for_special_needs_marker"]== old_apart["is_special_needs_marker"])
-                                        & floor_condition
-                                    ]
-                                    if suitable_aparts.empty:
-                                        suitable_aparts = df_new_apart_second[
-                                            (df_new_apart_second["room_count"] == old_apart["room_count"])& 
-                                            (df_new_apart_second["full_living_area"] >= old_apart["full_living_area"])& 
-                                            (df_new_apart_second["total_living_area"] >= old_apart["total_living_area"])&
-                                            (df_new_apart_second["living_area"]>= old_apart["living_area"])& 
-                                            (df_new_apart_second["for_special_needs_marker"] == old_apart["is_special_needs_marker"])
-                                        ]
-                                        if suitable_aparts.empty:
-                                            print('PROBLEM --- ',old_apart_id)
-                                            cannot_offer_to_insert.append((old_apart_id,))
-                                            if i in min_rank_by_room:
-                                                if old_apart["rank"] < min_rank_by_room[i]:
-                                                    min_rank_by_room[i] = old_apart["rank"]
-                                            else:
-                                                min_rank_by_room[i] = old_apart["rank"]
-                                        else:
-                                            suitable_apart = suitable_aparts.iloc[0]
-                                            new_apart_id = int(suitable_apart["new_apart_id"])
-                                            df_new_apart_second = df_new_apart_second[df_new_apart_second["new_apart_id"]!= new_apart_id]
-                                            print(df_new_apart_second[df_new_apart_second["new_apart_id"] == new_apart_id])
-                                            offers_to_insert.append((old_apart_id, new_apart_id,))
-
-                                    else:
-                                        suitable_apart = suitable_aparts.iloc[0]
-                                        new_apart_id = int(suitable_apart["new_apart_id"])
-                                        df_new_apart_second = df_new_apart_second[df_new_apart_second["new_apart_id"] != new_apart_id]
-                                        print(df_new_apart_second[df_new_apart_second["new_apart_id"] == new_apart_id])
-                                        offers_to_insert.append((old_apart_id, new_apart_id, ))
-                                else:
-                                    suitable_apart = suitable_aparts.iloc[0]
-                                    new_apart_id = int(suitable_apart["new_apart_id"])
-                                    df_new_apart_second = df_new_apart_second[df_new_apart_second["new_apart_id"] != new_apart_id]
-                                    print(df_new_apart_second[df_new_apart_second["new_apart_id"] == new_apart_id])
-                                    offers_to_insert.append((old_apart_id, new_apart_id,))
-                    else:
-                        a[i] = 1
-                        flag_ficit[i] = 1
-                        print("PROFICIT")
-
-                        for _, old_apart in df_old_apart[
-                            df_old_apart["room_count"] == i
-                        ].iterrows():
-                            old_apart_id = int(old_apart["affair_id"])
-                            # Определяем условие по этажу
-                            floor_condition = ((
-                                    (df_new_apart["floor"]>= (old_apart["min_floor"] - 2))& 
-                                    (df_new_apart["floor"] <= (old_apart["max_floor"] + 2)))
-                                if old_apart["min_floor"] or old_apart["max_floor"]
-                                else True
-                            )
-
-                            if (old_apart["is_queue"] == 1) and (ochered):
-                                suitable_aparts = df_new_apart[
-                                    (df_new_apart["full_living_area"]>= old_apart["full_living_area"])& 
-                                    (df_new_apart["total_living_area"]>= old_apart["total_living_area"])& 
-                                    (df_new_apart["living_area"]>= old_apart["living_area"])& 
-                                    (df_new_apart["for_special_needs_marker"]== old_apart["is_special_needs_marker"])& 
-                                    (df_new_apart["floor"]>= (old_apart["min_floor"]))& 
-                                    (df_new_apart["floor"]<= (old_apart["max_floor"]))
-                                ]
-
-                                # Проверка наличия подходящих квартир
-                                if suitable_aparts.empty:
-                                    suitable_aparts = df_new_apart[
-                                        (df_new_apart["full_living_area"]>= old_apart["full_living_area"])& 
-                                        (df_new_apart["total_living_area"]>= old_apart["total_living_area"])& 
-                                        (df_new_apart["living_area"]>= old_apart["living_area"])&
-                                        (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"]) & floor_condition
-                                    ]
-                                    if suitable_aparts.empty:
-                                        suitable_aparts = df_new_apart[
-                                            (df_new_apart["full_living_area"] >= old_apart["full_living_area"])&
-                                            (df_new_apart["total_living_area"] >= old_apart["total_living_area"])&
-                                            (df_new_apart["living_area"] >= old_apart["living_area"])&
-                                            (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"])
-                                        ]
-
-                                        if suitable_aparts.empty:
-                                            cannot_offer_to_insert.append((old_apart_id, ))
-                                            if i in min_rank_by_room:
-                                                if old_apart["rank"] < min_rank_by_room[i]:
-                                                    min_rank_by_room[i] = old_apart["rank"]
-                                            else:
-                                                min_rank_by_room[i] = old_apart["rank"]
-
-                                        else:
-                                            suitable_apart = suitable_aparts.iloc[0]
-                                            new_apart_id = int(suitable_apart["new_apart_id"])
-                                            df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                            offers_to_insert.append((old_apart_id, new_apart_id,))
-
-                                    else:
-                                        suitable_apart = suitable_aparts.iloc[0]
-                                        new_apart_id = int(suitable_apart["new_apart_id"])
-                                        df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                        offers_to_insert.append((old_apart_id, new_apart_id,))
-
-                                else:
-                                    suitable_apart = suitable_aparts.iloc[0]
-                                    new_apart_id = int(suitable_apart["new_apart_id"])
-                                    df_new_apart = df_new_apart[
-                                        df_new_apart["new_apart_id"] != new_apart_id
-                                    ]
-                                    offers_to_insert.append((old_apart_id, new_apart_id,))
-                                continue
-
-                            # Условие для даты "Дата покупки"
-                            if (old_apart["buying_date"] is not None and old_apart["buying_date"] > datetime.strptime("2017-08-01", "%Y-%m-%d").date() 
-                                and not (old_apart["min_floor"] or old_apart["max_floor"])
-                            ):
-                                s = df_new_apart[
-                                    (df_new_apart["room_count"] == old_apart["room_count"]) &
-                                    (df_new_apart["full_living_area"] >= old_apart["full_living_area"]) &
-                                    (df_new_apart["total_living_area"] >= old_apart["total_living_area"]) &
-                                    (df_new_apart["living_area"] >= old_apart["living_area"]) &
-                                    (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"])
-                                ]
-
-                                if not s.empty:
-                                    sap = s.iloc[0]
-
-                                    suitable_aparts = df_new_apart[
-                                        (df_new_apart["room_count"] == old_apart["room_count"]) &
-                                        (df_new_apart["full_living_area"] >= old_apart["full_living_area"]) &
-                                        (df_new_apart["total_living_area"] >= old_apart["total_living_area"]) &
-                                        (df_new_apart["living_area"] >= old_apart["living_area"]) &
-                                        (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"]) &
-                                        ((df_new_apart["full_living_area"] - sap["full_living_area"]) <= delta[i])
-                                    ].sort_values(by="floor", ascending=True)
-
-                                    # Если подходящих квартир нет, проверяем с условием floor_condition
-                                    if suitable_aparts.empty:
-                                        suitable_aparts = df_new_apart[
-                                            (df_new_apart["room_count"] == old_apart["room_count"])  &
-                                            (df_new_apart["full_living_area"] >= old_apart["full_living_area"])  &
-                                            (df_new_apart["total_living_area"] >= old_apart["total_living_area"]) &
-                                            (df_new_apart["living_area"] >= old_apart["living_area"]) &
-                                            (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"])
-                                        ]
-
-                                        if suitable_aparts.empty:
-                                            cannot_offer_to_insert.append((old_apart_id,))
-                                            if i in min_rank_by_room:
-                                                if old_apart["rank"] < min_rank_by_room[i]:
-                                                    min_rank_by_room[i] = old_apart["rank"]
-                                            else:
-                                                min_rank_by_room[i] = old_apart["rank"]
-                                        else:
-                                            suitable_apart = suitable_aparts.iloc[0]
-                                            new_apart_id = int(suitable_apart["new_apart_id"])
-                                            df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                            offers_to_insert.append((old_apart_id,new_apart_id,))
-                                    else:
-                                        suitable_apart = suitable_aparts.iloc[0]
-                                        new_apart_id = int(suitable_apart["new_apart_id"])
-                                        df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                        offers_to_insert.append((old_apart_id, new_apart_id,))
-                                else:
-                                    cannot_offer_to_insert.append((old_apart_id,))
-                                    if i in min_rank_by_room:
-                                        if old_apart["rank"] < min_rank_by_room[i]:
-                                            min_rank_by_room[i] = old_apart["rank"]
-                                    else:
-                                        min_rank_by_room[i] = old_apart["rank"]
-                            else:
-                                suitable_aparts = df_new_apart[
-                                    (df_new_apart["room_count"] == old_apart["room_count"])  &
-                                    (df_new_apart["full_living_area"] >= old_apart["full_living_area"])  & 
-                                    (df_new_apart["total_living_area"] >= old_apart["total_living_area"])  &
-                                    (df_new_apart["living_area"] >= old_apart["living_area"])  &
-                                    (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"])  &
-                                    (df_new_apart["floor"] >= (old_apart["min_floor"])) & 
-                                    (df_new_apart["floor"] <= (old_apart["max_floor"]))
-                                ]
-
-                                # Проверка наличия подходящих квартир
-                                if suitable_aparts.empty:
-                                    suitable_aparts = df_new_apart[
-                                        (df_new_apart["room_count"] == old_apart["room_count"]) &
-                                        (df_new_apart["full_living_area"] >= old_apart["full_living_area"]) & 
-                                        (df_new_apart["total_living_area"] >= old_apart["total_living_area"]) & 
-                                        (df_new_apart["living_area"] >= old_apart["living_area"]) & 
-                                        (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"]) &
-                                        floor_condition
-                                    ]
-                                    if suitable_aparts.empty:
-                                        suitable_aparts = df_new_apart[
-                                            (df_new_apart["room_count"] == old_apart["room_count"]) &
-                                            (df_new_apart["full_living_area"] >= old_apart["full_living_area"]) &
-                                            (df_new_apart["total_living_area"] >= old_apart["total_living_area"]) &
-                                            (df_new_apart["living_area"] >= old_apart["living_area"])&
-                                            (df_new_apart["for_special_needs_marker"] == old_apart["is_special_needs_marker"])
-                                            ]
-
-                                        if suitable_aparts.empty:
-                                            cannot_offer_to_insert.append((old_apart_id,))
-                                            if i in min_rank_by_room:
-                                                if old_apart["rank"] < min_rank_by_room[i]:
-                                                    min_rank_by_room[i] = old_apart["rank"]
-                                            else:
-                                                min_rank_by_room[i] = old_apart["rank"]
-
-                                        else:
-                                            suitable_apart = suitable_aparts.iloc[0]
-                                            new_apart_id = int(suitable_apart["new_apart_id"])
-                                            df_new_apart = df_new_apart[df_new_apart["new_apart_id"]!= new_apart_id]
-
-                                            offers_to_insert.append((old_apart_id, new_apart_id,))
-                                    else:
-                                        suitable_apart = suitable_aparts.iloc[0]
-                                        new_apart_id = int(suitable_apart["new_apart_id"])
-                                        df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-                                        offers_to_insert.append((old_apart_id, new_apart_id,))
-
-                                else:
-                                    suitable_apart = suitable_aparts.iloc[0]
-                                    new_apart_id = int(suitable_apart["new_apart_id"])
-                                    df_new_apart = df_new_apart[df_new_apart["new_apart_id"] != new_apart_id]
-
-                                    offers_to_insert.append(
-                                        (old_apart_id, new_apart_id,)
-                                    )
+                report_progress("match", history_id=last_history_id)
+                save_rank_baseline(cursor, last_history_id, df_old_apart, df_new_apart)
+                matching = match_families(df_old_apart, df_new_apart, ochered=ochered, workers=MatchingSetting.WORKERS)
+                offers_to_insert = matching.offers
+                cannot_offer_to_insert = matching.cannot_offer
+                min_rank_by_room = matching.min_rank_by_room
+                flag_ficit = matching.flag_ficit
 
                 # Удаление дубликатов из cannot_offer_to_insert
                 cannot_offer_to_insert = list(set(cannot_offer_to_insert))
@@ -916,56 +154,22 @@ def match_new_apart_to_family_batch(
                 print('offers_to_insert - ', len(offers_to_insert))
                 print('cannot offer to insert - ', len(cannot_offer_to_insert))
                 # --- Обновление базы данных ---
-                # Создаем словарь для сопоставления affair_id с rank
-                old_apart_ranks = df_old_apart.set_index("affair_id")["rank"].astype(str).to_dict()
-
-                # Список для массового обновления рангов в new_apart
-                new_apart_rank_update = []
-
-                for old_apart_id, new_apart_id in offers_to_insert:
-                    # Получаем rank из словаря
-                    rank = old_apart_ranks.get(old_apart_id)
-
-                    # Добавляем данные для обновления new_apart
-                    if rank is not None:
-                        new_apart_rank_update.append((rank, new_apart_id))
-
-                    # Обновляем запись в offer (без добавления rank в JSON)
-                    cursor.execute(
-                        "SELECT new_aparts FROM public.offer WHERE affair_id = %s",
-                        (old_apart_id,)
-                    )
-                    result = cursor.fetchone()
-
-                    current_new_aparts = {}
-                    if result and result[0]:
-                        current_new_aparts = json.loads(result[0])
-
-                    current_new_aparts[str(new_apart_id)] = {
-                        "status_id": 7  # Только статус, без ранга
-                    }
-
-                    new_aparts_json = json.dumps(current_new_aparts, ensure_ascii=False)
-
-                    if result:
-                        cursor.execute(
-                            "UPDATE public.offer SET new_aparts = %s WHERE affair_id = %s",
-                            (new_aparts_json, old_apart_id)
-                        )
-                    else:
-                        cursor.execute(
-                            "INSERT INTO public.offer (affair_id, new_aparts, status_id) VALUES (%s, %s, 7)",
-                            (old_apart_id, new_aparts_json)
-                        )
-
-                # Массовое обновление рангов в new_apart
-                if new_apart_rank_update:
-                    cursor.executemany(
-                        """UPDATE public.new_apart
-                            SET rank = %s
-                            WHERE new_apart_id = %s""",
-                        new_apart_rank_update
-                    )
+                report_progress("persist", offer=len(offers_to_insert), cannot_offer=len(cannot_offer_to_insert))
+                # Ранг семьи переносится на предложенную ей квартиру
+                old_apart_ranks = df_old_apart.set_index("affair_id")["rank"].to_dict()
+                update_ranks(
+                    cursor,
+                    "new_apart",
+                    "new_apart_id",
+                    (
+                        (new_apart_id, old_apart_ranks[old_apart_id])
+                        for old_apart_id, new_apart_id in offers_to_insert
+                        if old_apart_id in old_apart_ranks
+                    ),
+                )
+                merge_offers(cursor, offers_to_insert)
+                # Ранги, выставленные подбором, пересчет после выгрузки не затирает
+                pinned_new_apart_ids = [new_apart_id for _, new_apart_id in offers_to_insert]
 
                 # Определяем, из какого DataFrame брать данные в зависимости от flag_ficit
                 if cannot_offer_to_insert:
@@ -973,18 +177,9 @@ def match_new_apart_to_family_batch(
                     
                     # Обрабатываем каждую room_count отдельно
                     for room_count, flag_value in flag_ficit.items():
-                        # Выбираем соответствующий DataFrame в зависимости от значения flag_ficit
-                        if flag_value == 2:
-                            df_source = df_new_apart_second
-                        else:
-                            df_source = df_new_apart
-                            
-                        if df_source.empty:
-                            continue
-                            
-                        # Фильтруем DataFrame по текущей room_count
-                        df_filtered = df_source[df_source['room_count'] == room_count]
-                        
+                        # Оставшиеся квартиры берем из того пула, которым подбиралась комнатность
+                        free_new_apart_ids = matching.free_new_apart_ids(room_count)
+
                         # Получаем минимальный ранг для данной комнатности
                         min_rank = min_rank_by_room.get(room_count)
                         if not min_rank:
@@ -993,23 +188,19 @@ def match_new_apart_to_family_batch(
                         print(f'min_rank {"DEFECIT" if flag_value == 2 else "PROFICIT"} -------------- ', min_rank, room_count)
                         
                         # Добавляем данные для обновления
-                        for _, row in df_filtered.iterrows():
-                            update_data.append((min_rank-1, row['new_apart_id']))
+                        update_data.extend((new_apart_id, min_rank - 1) for new_apart_id in free_new_apart_ids)
 
                     # Выполняем массовое обновление
-                    if update_data:
-                        cursor.executemany(
-                            """UPDATE public.new_apart
-                                SET rank = %s
-                                WHERE new_apart_id = %s""",
-                            update_data
-                        )
+                    update_ranks(cursor, "new_apart", "new_apart_id", update_data)
+                    pinned_new_apart_ids.extend(new_apart_id for new_apart_id, _ in update_data)
+                pin_matched_ranks(cursor, last_history_id, df_new_apart, pinned_new_apart_ids)
                 conn.commit()
                 uploads_folder = os.path.join(os.getcwd(), "././uploads/")
                 file_name = f"matching_result_{last_history_id}.xlsx"
                 output_path = os.path.join(uploads_folder, file_name)
                 if date: 
-                    save_views_to_excel(output_path=output_path, history_id=last_history_id)
+                    report_progress("excel", file=output_path)
+                    save_views_to_excel(output_path=output_path, history_id=last_history_id, conn=conn)
                     cursor.execute('''
                         DELETE FROM offer 
                         WHERE affair_id IN (
@@ -1032,8 +223,56 @@ def match_new_apart_to_family_batch(
                     cursor.execute('DELETE FROM manual_load WHERE manual_load_id = (SELECT MAX(manual_load_id) FROM manual_load)')
                     
                 conn.commit()
-                res = {'cannot_offer': len(cannot_offer_to_insert), 'offer':  len(offers_to_insert)}
+                res = {'cannot_offer': len(cannot_offer_to_insert), 'offer':  len(offers_to_insert), 'history_id': last_history_id}
+                if date:
+                    res['file'] = output_path
                 return res
     except Exception as e:
         print(f"Error: {e}")
         raise
+
+
+def simulate_matching(
+    new_selected_addresses=None,
+    old_selected_addresses=None,
+    new_selected_districts=None,
+    old_selected_districts=None,
+    new_selected_areas=None,
+    old_selected_areas=None,
+    date=False,
+    ochered=False,
+    workbook=False,
+):
+    """
+    Пробный подбор: те же выборки, ранги и каскад, что у match_new_apart_to_family_batch,
+    но в транзакции только для чтения - ни рангов, ни истории, ни предложений в базе.
+    Возвращает статистику по комнатностям и предложенные пары; с workbook - и путь
+    к временной книге, которую вызывающий удаляет после отправки.
+    """
+    if (new_selected_addresses is None or old_selected_addresses is None) and not date:
+        return None
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            # Случайная запись в пробном подборе упадет, а не изменит данные
+            cursor.execute("SET TRANSACTION READ ONLY")
+            snapshot = snapshot_cache.get(cursor)
+    df_old_apart = snapshot.families(old_selected_addresses, old_selected_districts, old_selected_areas, date)
+    if df_old_apart.empty:
+        return ("No old apartments found.")
+    df_new_apart = snapshot.new_aparts(new_selected_addresses, new_selected_districts, new_selected_areas, date)
+    if df_new_apart.empty:
+        return("No new apartments found.")
+
+    report_progress("rank", old_apart=len(df_old_apart), new_apart=len(df_new_apart))
+    df_old_apart, df_new_apart = rank_frames(df_old_apart, df_new_apart)
+    report_progress("match")
+    matching = match_families(df_old_apart, df_new_apart, ochered=ochered, workers=MatchingSetting.WORKERS)
+    res = summarize(df_old_apart, df_new_apart, matching)
+    print('DRY RUN offer -', res['offer'], 'cannot offer -', res['cannot_offer'])
+    if workbook:
+        # Временный файл: книгу удаляет тот, кто ее отдал
+        fd, output_path = tempfile.mkstemp(prefix="dry_run_", suffix=".xlsx")
+        os.close(fd)
+        report_progress("excel", file=output_path)
+        res['file'] = write_summary(res, output_path)
+    return res
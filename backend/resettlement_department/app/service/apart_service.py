@@ -85,8 +85,20 @@ class ApartService:
         statuses : List[str] = None,
         fio : str = None,
         stage: List[str] = None,
-        otsel_type: List[str] = None
+        otsel_type: List[str] = None,
+        sort_by: str = None,
+        sort_order: str = "asc",
+        cursor: str = None,
+        page_size: int = None,
+        with_total: bool = False,
     ):
+        page_params = dict(
+            sort_by=sort_by,
+            sort_order=sort_order,
+            cursor=cursor,
+            page_size=page_size,
+            with_total=with_total,
+        )
         if apart_type == ApartType.OLD:
             return await self.old_apart_repository.get_apartments(
                 apart_type=apart_type,
@@ -103,7 +115,8 @@ class ApartService:
                 statuses=statuses,
                 fio=fio,
                 stage=stage,
-                otsel_type=otsel_type
+                otsel_type=otsel_type,
+                **page_params,
             )
         elif apart_type == ApartType.NEW:
             return await self.new_apart_repository.get_apartments(
@@ -119,6 +132,7 @@ class ApartService:
                 is_queue=is_queue,
                 is_private=is_private,
                 statuses=statuses,
+                **page_params,
             )
         else:
             raise NotFoundException
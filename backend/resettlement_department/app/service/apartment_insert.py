@@ -5,6 +5,8 @@ import pandas as pd
 import psycopg2
 from core.config import settings
 from psycopg2.extras import execute_values
+from repository.database import db_connection
+from service.bulk_upsert import staged_upsert
 
 district_mapping = {
     "Восточный АО": "ВАО",
@@ -46,8 +48,161 @@ district_mapping = {
     "Академический": "ЮЗАО"  # Район в ЮЗАО
 }
 
+def _batches(data):
+    # DataFrame целиком или итератор пачек листа (utils.xlsx_reader.iter_sheet)
+    return [data] if isinstance(data, pd.DataFrame) else data
+
+
+def _insert_new_apart_batch(cursor, new_apart_df, manual_load_id):
+    new_apart_df['К_Инв/к'] = new_apart_df['К_Инв/к'].astype(str).str.lower()
+    new_apart_df['К_Инв/к'] = new_apart_df['К_Инв/к'].apply(lambda x: 1 if 'да' in x else 0)
+    
+    rename_new = {
+        'Адрес_Округ': 'district', 
+        'Адрес_Мун.округ': 'municipal_district',
+        'Адрес_Короткий': 'house_address',
+        'Адрес_№ кв': 'apart_number',
+        'К_Комн': 'room_count',
+        'К_Этаж': 'floor',
+        'К_Ресурс': 'type_of_settlement',
+        'Площадь общая': 'full_living_area',
+        'Площадь общая(б/л)': 'total_living_area', 
+        'Площадь жилая': 'living_area',
+        'Сл.инф_APART_ID': 'new_apart_id',
+        'Кадастровый номер': 'cad_num',
+        'К_Инв/к': 'for_special_needs_marker'
+    }
+    
+    new_apart_df = new_apart_df.rename(columns=rename_new)
+    new_apart_df['manual_load_id'] = manual_load_id
+    
+    # Фильтрация и добавление колонок
+    new_apart_required = [
+        "district", "municipal_district", "house_address", "floor", "apart_number",
+        "full_living_area", "total_living_area", "living_area", "room_count",
+        "type_of_settlement", "for_special_needs_marker", "cad_num", "new_apart_id", 
+        "manual_load_id"
+    ]
+    new_apart_df['district'] = new_apart_df['district'].map(district_mapping).fillna(new_apart_df['district'])
+    for col in new_apart_required:
+        if col not in new_apart_df.columns:
+            new_apart_df[col] = None
+
+    new_apart_values = [tuple(row) for row in new_apart_df[new_apart_required].to_numpy()]
+    try:
+        execute_values(
+            cursor,
+            f"""INSERT INTO new_apart ({", ".join(new_apart_required)})
+                VALUES %s
+                ON CONFLICT (new_apart_id)
+                DO UPDATE SET 
+                    updated_at = NOW()""",
+            new_apart_values
+        )
+    except Exception as e:
+        print(e)
+
+
+def _insert_old_apart_batch(cursor, old_apart_df, manual_load_id):
+    rename_old = {
+        'Округ': 'district',
+        'район': 'municipal_district',
+        'ФИО': 'fio',
+        'адрес дома': 'house_address',
+        '№ кв-ры': 'apart_number',
+        'Вид засел.': 'type_of_settlement',
+        'тип кв-ры': 'apart_type',
+        'кол-во комнат': 'room_count',
+        'площ. жил. пом.': 'full_living_area',
+        'общ. пл.': 'total_living_area',
+        'жил. пл.': 'living_area',
+        'Кол-во членов семьи': 'people_v_dele',
+        'Потребность': 'is_special_needs_marker',
+        'мин этаж': 'min_floor',
+        'макс этаж': 'max_floor',
+        'Дата покупки': 'buying_date',
+        'ID': 'affair_id'
+    }
+    
+    old_apart_df = old_apart_df.rename(columns=rename_old)
+    old_apart_df['manual_load_id'] = manual_load_id
+    
+    # Обработка даты
+    if 'buying_date' in old_apart_df.columns:
+        old_apart_df['buying_date'] = pd.to_datetime(old_apart_df['buying_date'], errors='coerce')
+        old_apart_df['buying_date'] = old_apart_df['buying_date'].apply(lambda x: x if pd.notnull(x) else None)
+
+    # Фильтрация колонок
+    old_apart_required = [
+        "affair_id", "kpu_number", "fio", "surname", "firstname", "lastname",
+        "people_in_family", "category", "cad_num", "rsm_notes", "documents", "district",
+        "house_address", "apart_number", "room_count", "floor", "full_living_area",
+        "living_area", "people_v_dele", "people_uchet", "total_living_area", "apart_type",
+        "manipulation_notes", "municipal_district", "is_special_needs_marker", "min_floor",
+        "max_floor", "buying_date", "type_of_settlement", "history_id", 
+        "kpu_another", "manual_load_id"
+    ]
+    old_apart_df['district'] = old_apart_df['district'].map(district_mapping).fillna(old_apart_df['district'])
+    for col in old_apart_required:
+        if col not in old_apart_df.columns:
+            old_apart_df[col] = None
+
+    old_apart_values = [tuple(row) for row in old_apart_df[old_apart_required].to_numpy()]
+    
+    execute_values(
+        cursor,
+        f"""INSERT INTO old_apart ({", ".join(old_apart_required)})
+            VALUES %s
+            ON CONFLICT (affair_id)
+            DO UPDATE SET 
+                is_special_needs_marker = EXCLUDED.is_special_needs_marker,
+                updated_at = NOW()""",
+        old_apart_values
+    )
+
+
+def _insert_cin_batch(cursor, cin_df, manual_load_id):
+    # Подготовка данных
+    data_to_insert = []
+    cin_df["Дата начала работы"] = pd.to_datetime(cin_df["Дата начала работы"], errors="coerce").dt.date
+    
+    for _, row in cin_df.iterrows():
+        data_to_insert.append({
+            "unom": str(row["УНОМ"]),
+            "old_address": str(row["Адрес отселения"]),
+            "cin_address": str(row["Адрес ЦИНа"]),
+            "cin_schedule": str(row["График работы ЦИН"]),
+            "dep_schedule": str(row["График работы Департамента в ЦИНе"]),
+            "phone_osmotr": str(row["Телефон для осмота"]) if pd.notna(row["Телефон для осмота"]) else None,
+            "phone_otvet": str(row["Телефон для ответа"]) if pd.notna(row["Телефон для ответа"]) else None,
+            "start_date": row["Дата начала работы"] if pd.notna(row["Дата начала работы"]) else None,
+            "otdel": str(row["Адрес Отдела"]),
+            "manual_load_id": manual_load_id
+        })
+
+    # Вставка данных
+    for data in data_to_insert:
+        cursor.execute(
+            """INSERT INTO cin (
+                unom, old_address, cin_address, cin_schedule, 
+                dep_schedule, phone_osmotr, phone_otvet, 
+                start_date, otdel, manual_load_id
+            ) VALUES (
+                %(unom)s, %(old_address)s, %(cin_address)s, 
+                %(cin_schedule)s, %(dep_schedule)s, %(phone_osmotr)s, 
+                %(phone_otvet)s, %(start_date)s, %(otdel)s, %(manual_load_id)s
+            )
+            ON CONFLICT (unom) DO UPDATE SET 
+                updated_at = NOW()""",
+            data
+        )
+
+
 def insert_to_db(new_apart_df, old_apart_df, cin_df, file_name, file_path):
-    global district_mapping
+    """
+    Загружает листы ручной выгрузки. Каждый лист - DataFrame или итератор пачек
+    (utils.xlsx_reader.iter_sheet): пачки обрабатываются по одной в общей транзакции.
+    """
     connection = psycopg2.connect(
         host=settings.project_management_setting.DB_HOST,
         user=settings.project_management_setting.DB_USER,
@@ -58,170 +213,41 @@ def insert_to_db(new_apart_df, old_apart_df, cin_df, file_name, file_path):
     cursor = connection.cursor()
 
     try:
-        # 1. Вставка в manual_load с обработкой конфликтов
-        is_new_apart = not new_apart_df.empty
-        is_old_apart = not old_apart_df.empty
-        is_cin = not cin_df.empty
-
+        # 1. Вставка в manual_load с обработкой конфликтов; признаки листов проставляются после загрузки
         cursor.execute(
             """INSERT INTO manual_load 
                 (filename, is_old_apart, is_new_apart, is_cin, file_path) 
-             VALUES (%s, %s, %s, %s, %s)
+             VALUES (%s, FALSE, FALSE, FALSE, %s)
              ON CONFLICT (filename) DO UPDATE SET
-                 is_old_apart = EXCLUDED.is_old_apart,
-                 is_new_apart = EXCLUDED.is_new_apart,
-                 is_cin = EXCLUDED.is_cin,
                  file_path = EXCLUDED.file_path,
                  updated_at = NOW()
              RETURNING manual_load_id""",
-            (file_name, is_old_apart, is_new_apart, is_cin, file_path)
+            (file_name, file_path)
         )
         manual_load_id = cursor.fetchone()[0]
 
-        # 2. Обработка new_apart
-        if not new_apart_df.empty:
-            new_apart_df['К_Инв/к'] = new_apart_df['К_Инв/к'].astype(str).str.lower()
-            new_apart_df['К_Инв/к'] = new_apart_df['К_Инв/к'].apply(lambda x: 1 if 'да' in x else 0)
-            
-            rename_new = {
-                'Адрес_Округ': 'district', 
-                'Адрес_Мун.округ': 'municipal_district',
-                'Адрес_Короткий': 'house_address',
-                'Адрес_№ кв': 'apart_number',
-                'К_Комн': 'room_count',
-                'К_Этаж': 'floor',
-                'К_Ресурс': 'type_of_settlement',
-                'Площадь общая': 'full_living_area',
-                'Площадь общая(б/л)': 'total_living_area', 
-                'Площадь жилая': 'living_area',
-                'Сл.инф_APART_ID': 'new_apart_id',
-                'Кадастровый номер': 'cad_num',
-                'К_Инв/к': 'for_special_needs_marker'
-            }
-            
-            new_apart_df = new_apart_df.rename(columns=rename_new)
-            new_apart_df['manual_load_id'] = manual_load_id
-            
-            # Фильтрация и добавление колонок
-            new_apart_required = [
-                "district", "municipal_district", "house_address", "floor", "apart_number",
-                "full_living_area", "total_living_area", "living_area", "room_count",
-                "type_of_settlement", "for_special_needs_marker", "cad_num", "new_apart_id", 
-                "manual_load_id"
-            ]
-            new_apart_df['district'] = new_apart_df['district'].map(district_mapping).fillna(new_apart_df['district'])
-            for col in new_apart_required:
-                if col not in new_apart_df.columns:
-                    new_apart_df[col] = None
-
-            new_apart_values = [tuple(row) for row in new_apart_df[new_apart_required].to_numpy()]
-            try:
-                execute_values(
-                    cursor,
-                    f"""INSERT INTO new_apart ({", ".join(new_apart_required)})
-                        VALUES %s
-                        ON CONFLICT (new_apart_id)
-                        DO UPDATE SET 
-                            updated_at = NOW()""",
-                    new_apart_values
-                )
-            except Exception as e:
-                print(e)
-
-        # 3. Обработка old_apart
-        if not old_apart_df.empty:
-            rename_old = {
-                'Округ': 'district',
-                'район': 'municipal_district',
-                'ФИО': 'fio',
-                'адрес дома': 'house_address',
-                '№ кв-ры': 'apart_number',
-                'Вид засел.': 'type_of_settlement',
-                'тип кв-ры': 'apart_type',
-                'кол-во комнат': 'room_count',
-                'площ. жил. пом.': 'full_living_area',
-                'общ. пл.': 'total_living_area',
-                'жил. пл.': 'living_area',
-                'Кол-во членов семьи': 'people_v_dele',
-                'Потребность': 'is_special_needs_marker',
-                'мин этаж': 'min_floor',
-                'макс этаж': 'max_floor',
-                'Дата покупки': 'buying_date',
-                'ID': 'affair_id'
-            }
-            
-            old_apart_df = old_apart_df.rename(columns=rename_old)
-            old_apart_df['manual_load_id'] = manual_load_id
-            
-            # Обработка даты
-            if 'buying_date' in old_apart_df.columns:
-                old_apart_df['buying_date'] = pd.to_datetime(old_apart_df['buying_date'], errors='coerce')
-                old_apart_df['buying_date'] = old_apart_df['buying_date'].apply(lambda x: x if pd.notnull(x) else None)
-
-            # Фильтрация колонок
-            old_apart_required = [
-                "affair_id", "kpu_number", "fio", "surname", "firstname", "lastname",
-                "people_in_family", "category", "cad_num", "rsm_notes", "documents", "district",
-                "house_address", "apart_number", "room_count", "floor", "full_living_area",
-                "living_area", "people_v_dele", "people_uchet", "total_living_area", "apart_type",
-                "manipulation_notes", "municipal_district", "is_special_needs_marker", "min_floor",
-                "max_floor", "buying_date", "type_of_settlement", "history_id", 
-                "kpu_another", "manual_load_id"
-            ]
-            old_apart_df['district'] = old_apart_df['district'].map(district_mapping).fillna(old_apart_df['district'])
-            for col in old_apart_required:
-                if col not in old_apart_df.columns:
-                    old_apart_df[col] = None
-
-            old_apart_values = [tuple(row) for row in old_apart_df[old_apart_required].to_numpy()]
-            
-            execute_values(
-                cursor,
-                f"""INSERT INTO old_apart ({", ".join(old_apart_required)})
-                    VALUES %s
-                    ON CONFLICT (affair_id)
-                    DO UPDATE SET 
-                        is_special_needs_marker = EXCLUDED.is_special_needs_marker,
-                        updated_at = NOW()""",
-                old_apart_values
-            )
-        
-        # 4. Обработка CIN
-        if not cin_df.empty:
-            # Подготовка данных
-            data_to_insert = []
-            cin_df["Дата начала работы"] = pd.to_datetime(cin_df["Дата начала работы"], errors="coerce").dt.date
-            
-            for _, row in cin_df.iterrows():
-                data_to_insert.append({
-                    "unom": str(row["УНОМ"]),
-                    "old_address": str(row["Адрес отселения"]),
-                    "cin_address": str(row["Адрес ЦИНа"]),
-                    "cin_schedule": str(row["График работы ЦИН"]),
-                    "dep_schedule": str(row["График работы Департамента в ЦИНе"]),
-                    "phone_osmotr": str(row["Телефон для осмота"]) if pd.notna(row["Телефон для осмота"]) else None,
-                    "phone_otvet": str(row["Телефон для ответа"]) if pd.notna(row["Телефон для ответа"]) else None,
-                    "start_date": row["Дата начала работы"] if pd.notna(row["Дата начала работы"]) else None,
-                    "otdel": str(row["Адрес Отдела"]),
-                    "manual_load_id": manual_load_id
-                })
-
-            # Вставка данных
-            for data in data_to_insert:
-                cursor.execute(
-                    """INSERT INTO cin (
-                        unom, old_address, cin_address, cin_schedule, 
-                        dep_schedule, phone_osmotr, phone_otvet, 
-                        start_date, otdel, manual_load_id
-                    ) VALUES (
-                        %(unom)s, %(old_address)s, %(cin_address)s, 
-                        %(cin_schedule)s, %(dep_schedule)s, %(phone_osmotr)s, 
-                        %(phone_otvet)s, %(start_date)s, %(otdel)s, %(manual_load_id)s
-                    )
-                    ON CONFLICT (unom) DO UPDATE SET 
-                        updated_at = NOW()""",
-                    data
-                )
+        # 2-4. new_apart, old_apart и cin пачками
+        loaded = {}
+        for name, data, insert_batch in (
+            ("is_new_apart", new_apart_df, _insert_new_apart_batch),
+            ("is_old_apart", old_apart_df, _insert_old_apart_batch),
+            ("is_cin", cin_df, _insert_cin_batch),
+        ):
+            loaded[name] = False
+            for batch in _batches(data):
+                if batch.empty:
+                    continue
+                loaded[name] = True
+                insert_batch(cursor, batch, manual_load_id)
+
+        cursor.execute(
+            """UPDATE manual_load
+             SET is_old_apart = %(is_old_apart)s,
+                 is_new_apart = %(is_new_apart)s,
+                 is_cin = %(is_cin)s
+             WHERE manual_load_id = %(manual_load_id)s""",
+            {**loaded, "manual_load_id": manual_load_id}
+        )
 
         connection.commit()
         return manual_load_id
@@ -235,9 +261,9 @@ def insert_to_db(new_apart_df, old_apart_df, cin_df, file_name, file_path):
         connection.close()
 
 def insert_data_to_old_apart(df: pd.DataFrame):
+    """Загружает выгрузку КПУ в old_apart. Возвращает число вставленных, обновленных и не изменившихся строк или исключение."""
     try:
         global district_mapping
-        connection = None
 
         columns_name = {
             "Идентификатор дела": "affair_id",
@@ -348,40 +374,6 @@ def insert_data_to_old_apart(df: pd.DataFrame):
         # Важно чтобы порядок колонок в df был такой же как в columns_db
         df = df[columns_db]
         
-        args = df.itertuples(index=False, name=None)
-        # Prepare the arguments string for the SQL query
-        args_str = ",".join(
-            "({})".format(
-                ", ".join(
-                    "'{}'".format(x.replace("'", "''"))
-                    if isinstance(x, str)
-                    else "NULL"
-                    if x is None
-                    else str(x)
-                    for x in arg
-                )
-            )
-            for arg in args
-        )
-        
-        connection = psycopg2.connect(
-            host=settings.project_management_setting.DB_HOST,
-            user=settings.project_management_setting.DB_USER,
-            password=settings.project_management_setting.DB_PASSWORD,
-            port=settings.project_management_setting.DB_PORT,
-            database=settings.project_management_setting.DB_NAME
-        )
-        insert_data_sql = f"""
-            INSERT INTO public.old_apart (
-                {", ".join(columns_db)}
-            )
-            VALUES 
-                {args_str}
-            ON CONFLICT (affair_id) 
-            DO UPDATE SET 
-            {", ".join(f"{col} = EXCLUDED.{col}" for col in columns_db_for_do_update)},
-            updated_at = NOW()
-        """
         # Запрос для обновления справочной информации об успешной выгрузке
         set_env_true_sql = """
             UPDATE env.data_updates
@@ -389,12 +381,11 @@ def insert_data_to_old_apart(df: pd.DataFrame):
             updated_at = NOW()
             WHERE name = 'old_aparts_kpu'
         """
-        out = 0
-        with connection:
+        with db_connection() as connection:
             with connection.cursor() as cursor:
                 print("DEBUG: Connection is open")
-                cursor.execute(insert_data_sql)
-                print("DEBUG: Data to old_apart is inserted")
+                out = staged_upsert(cursor, "old_apart", "affair_id", df, columns_db, columns_db_for_do_update)
+                print("DEBUG: Data to old_apart is inserted", out)
                 cursor.execute(set_env_true_sql)
                 print("DEBUG: Env is set to true")
     except Exception as e:
@@ -402,16 +393,7 @@ def insert_data_to_old_apart(df: pd.DataFrame):
         print(e)
         print("DEBUG: Exception occurred")
         # Корректно обновляем справочную информацию о неудачной выгрузке
-        if not connection:
-            print("DEBUG: Connection is None. Creating new one")
-            connection = psycopg2.connect(
-                host=settings.project_management_setting.DB_HOST,
-                user=settings.project_management_setting.DB_USER,
-                password=settings.project_management_setting.DB_PASSWORD,
-                port=settings.project_management_setting.DB_PORT,
-                database=settings.project_management_setting.DB_NAME
-            )
-        with connection:
+        with db_connection() as connection:
             with connection.cursor() as cursor:
                 print("DEBUG: Connection is open in except block")
                 set_env_false_sql = """
@@ -423,9 +405,6 @@ def insert_data_to_old_apart(df: pd.DataFrame):
                 cursor.execute(set_env_false_sql)
     finally:
         print("DEBUG: finally block")
-        if connection:
-            print("DEBUG: connection found and closed")
-            connection.close()
         return out
     
 def insert_data_to_new_apart(new_apart_df: pd.DataFrame):
@@ -1,21 +1,24 @@
 
-from openpyxl.styles import PatternFill, Font, Alignment
+from contextlib import nullcontext
+
 import pandas as pd
-from openpyxl.utils.dataframe import dataframe_to_rows
-from repository.database import get_db_connection
+from repository.database import db_connection
+from service.report_writer import ReportWriter, rank_balance
 
 
 def save_views_to_excel(
     output_path,
     history_id,
     date=False,
+    conn=None,
 ):
-    """РАБОЧИЙ ВАРИАНТ"""
+    """РАБОЧИЙ ВАРИАНТ. conn - уже открытое соединение вызывающего (данные зафиксированы), иначе берется из пула"""
     print('in func')
+    caller_conn = conn
     try:
         views = ["rank", "new_apart_all", "res_of_rec", "where_not"]
-        with get_db_connection() as conn:
-            with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
+        with nullcontext(conn) if conn is not None else db_connection() as conn:
+            with ReportWriter(output_path) as writer:
                 for view in views:
                     print(f"Обработка представления: {view}")
                     try:
@@ -97,164 +100,19 @@ def save_views_to_excel(
                             # Присваиваем ранги и группируем данные
                             df_combined["Ранг"] = df_combined["rank"].astype(int)
 
-                            df = (
-                                df_combined.groupby(["room_count", "Ранг"])
-                                .agg(
-                                    Пот_ть=("old_apart_id", "count"),
-                                    Ресурс=("new_apart_id", "count"),
-                                )
-                                .reset_index()
+                            # Баланс по рангам с итогами; здесь ранги склеиваются и при нулевом балансе
+                            df_grouped = rank_balance(
+                                df_combined,
+                                "old_apart_id",
+                                "new_apart_id",
+                                max_rank_by_room_count,
+                                merge_zero_balance=True,
                             )
 
-                            # Рассчитываем баланс
-                            df["Баланс"] = df["Ресурс"] - df["Пот_ть"]
-
-                            def add_totals(df, max_rank_by_room_count):
-                                # Инициализируем итоговые переменные
-                                total_potency = 0
-                                total_resource = 0
-                                total_balance = 0
-
-                                # Список для хранения новых строк
-                                new_rows = []
-                                previous_row = None
-                                start_rank = None
-
-                                for i in range(len(df)):
-                                    row = df.iloc[i].to_dict()
-                                    current_rank = row["Ранг"]
-                                    room_count = row["room_count"]
-                                    max_rank = max_rank_by_room_count.get(room_count, 0) + 1
-
-                                    if previous_row is not None:
-                                        # Парсим предыдущий ранг
-                                        if (
-                                            isinstance(previous_row["Ранг"], str)
-                                            and "-" in previous_row["Ранг"]
-                                        ):
-                                            previous_rank = int(previous_row["Ранг"].split("-")[-1])
-                                        else:
-                                            previous_rank = previous_row["Ранг"]
-
-                                        # Новое условие объединения: Ресурс ИЛИ Баланс равны 0
-                                        if (
-                                            (previous_row["Ресурс"] == 0 or previous_row["Баланс"] == 0) 
-                                            and current_rank != max_rank
-                                            and previous_rank != max_rank
-                                        ):
-                                            # Объединяем строки
-                                            previous_row["Пот_ть"] += row["Пот_ть"]
-                                            previous_row["Ресурс"] += row["Ресурс"]
-                                            previous_row["Баланс"] += row["Баланс"]
-                                            previous_row["Ранг"] = f"{start_rank}-{current_rank}"
-                                        else:
-                                            # Сохраняем предыдущую строку
-                                            new_rows.append(previous_row)
-                                            previous_row = row
-                                            start_rank = current_rank
-                                    else:
-                                        # Инициализация первой строки
-                                        previous_row = row
-                                        start_rank = current_rank
-
-                                # Добавляем последнюю строку
-                                if previous_row is not None:
-                                    new_rows.append(previous_row)
-
-                                # Создаем новый DataFrame
-                                df_new = pd.DataFrame(new_rows)
-
-                                # Пересчитываем итоги
-                                total_potency = df_new["Пот_ть"].sum()
-                                total_resource = df_new["Ресурс"].sum()
-                                total_balance = df_new["Баланс"].sum()
-
-                                # Добавляем строку с итогами
-                                totals = pd.DataFrame([{
-                                    "Ранг": "Итог",
-                                    "Пот_ть": total_potency,
-                                    "Ресурс": total_resource,
-                                    "Баланс": total_balance
-                                }])
-
-                                return pd.concat([df_new, totals], ignore_index=True)
-
-                            # Добавляем итоговые данные по рангу для каждого типа квартиры с использованием add_totals
-                            result_data = []
-                            for room in df["room_count"].unique():
-                                room_df = df[df["room_count"] == room].copy()
-                                grouped_df = add_totals(room_df, max_rank_by_room_count)
-                                grouped_df["room_count"] = room
-                                result_data.append(grouped_df)
-
-                            # Объединяем результаты в одну таблицу
-                            df_grouped = pd.concat(result_data, ignore_index=True)
-
                             if df_grouped.empty:
                                 print(f"Представление {view} не вернуло данных.")
                             else:
-                                # Начальная позиция для вставки данных на листе
-                                sheet_name = "Ранг"
-                                ws = writer.book.create_sheet(sheet_name)
-                                current_row, current_col = 1, 1
-
-                                # Настройка стилей
-                                header_font = Font(bold=True)
-                                header_fill = PatternFill(
-                                    start_color="FFFF99",
-                                    end_color="FFFF99",
-                                    fill_type="solid",
-                                )
-                                header_alignment = Alignment(horizontal="center")
-
-                                # Перебор всех типов комнат и запись данных в Excel
-                                for room in df_grouped["room_count"].unique():
-                                    room_df = df_grouped[df_grouped["room_count"] == room][
-                                        ["Ранг", "Пот_ть", "Ресурс", "Баланс"]
-                                    ]
-                                    # Заголовок типа квартир
-                                    ws.cell(
-                                        row=current_row, column=current_col
-                                    ).value = f"{room} комната(ы)"
-                                    ws.cell(
-                                        row=current_row, column=current_col
-                                    ).font = header_font
-                                    ws.cell(
-                                        row=current_row, column=current_col
-                                    ).alignment = header_alignment
-                                    ws.merge_cells(
-                                        start_row=current_row,
-                                        start_column=current_col,
-                                        end_row=current_row,
-                                        end_column=current_col + 3,
-                                    )
-                                    current_row += 1
-
-                                    # Запись заголовков
-                                    for idx, col_name in enumerate(room_df.columns):
-                                        cell = ws.cell(
-                                            row=current_row, column=current_col + idx
-                                        )
-                                        cell.value = col_name
-                                        cell.font = header_font
-                                        cell.fill = header_fill
-                                        cell.alignment = header_alignment
-
-                                    current_row += 1
-
-                                    # Запись данных
-                                    for row in dataframe_to_rows(
-                                        room_df, index=False, header=False
-                                    ):
-                                        for idx, value in enumerate(row):
-                                            ws.cell(
-                                                row=current_row, column=current_col + idx
-                                            ).value = value
-                                        current_row += 1
-
-                                    # Переход к следующему блоку для следующего типа комнат
-                                    current_row = 1
-                                    current_col += len(room_df.columns) + 1
+                                writer.write_rank_sheet("Ранг", df_grouped)
 
                         else:
                             query_params = []
@@ -275,12 +133,17 @@ def save_views_to_excel(
                             try:
                                 df = pd.read_sql(query, conn, params=query_params)
                                 df = df.dropna(how="all")
-                                df.to_excel(writer, sheet_name=view, index=False)
+                                writer.write_table(view, df)
                             except Exception as e:
                                 print(
                                     f"Ошибка выполнения запроса для представления {view}: {e}"
                                 )
+                                # Снимаем прерванную транзакцию, чтобы выгрузить остальные представления
+                                conn.rollback()
                     except Exception as e:
                         print(e)
+                        conn.rollback()
     except Exception as e:
-        print(f"Ошибка: {e}")
\ No newline at end of file
+        print(f"Ошибка: {e}")
+        if caller_conn is not None:
+            caller_conn.rollback()
\ No newline at end of file
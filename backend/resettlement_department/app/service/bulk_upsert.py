@@ -0,0 +1,81 @@
+"""
+Загрузка больших выгрузок РСМ в таблицу через COPY.
+
+Строки частями копируются во временную таблицу (не пишется в WAL, живет до конца транзакции),
+затем одним INSERT ... ON CONFLICT сливаются с целевой таблицей. Строки, в которых
+ничего не поменялось, не перезаписываются.
+"""
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 20000
+
+
+def csv_chunks(df, columns, chunk_size=CHUNK_SIZE):
+    """
+    CSV для COPY по chunk_size строк: в памяти одновременно только одна часть.
+
+    Строки берутся в кавычки, None пишется пустым полем без кавычек, поэтому
+    COPY отличает NULL от пустой строки.
+    """
+    for start in range(0, len(df), chunk_size):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_STRINGS, lineterminator="\n")
+        writer.writerows(df[columns].iloc[start:start + chunk_size].itertuples(index=False, name=None))
+        buffer.seek(0)
+        yield buffer
+
+
+def row_hash(df, columns):
+    """
+    Хэш каждой строки по колонкам columns как int64 (для колонки bigint).
+
+    Значения приводятся к строкам, поэтому хэш одинаков между загрузками
+    при одинаковых данных и не зависит от типов колонок во фрейме.
+    """
+    hashes = pd.util.hash_pandas_object(df[columns].astype(str), index=False)
+    return hashes.to_numpy().view(np.int64)
+
+
+def staged_upsert(cursor, table, key, df, insert_columns, update_columns, chunk_size=CHUNK_SIZE, where=None):
+    """
+    Upsert df в public.{table} через временную таблицу.
+
+    insert_columns - колонки df, которые вставляются; update_columns - колонки,
+    которые обновляются при конфликте по key (как EXCLUDED.col). Строка обновляется
+    (и получает updated_at = NOW()), только если хотя бы одна из них изменилась.
+    where - необязательный фильтр строк временной таблицы (алиас stage).
+    Возвращает число вставленных, обновленных и не изменившихся строк.
+    """
+    # При повторе ключа в выгрузке остается последняя строка: ON CONFLICT не обновляет строку дважды
+    df = df.drop_duplicates(subset=[key], keep="last")
+    stage = f"{table}_stage"
+    columns = ", ".join(insert_columns)
+
+    cursor.execute(
+        f"CREATE TEMP TABLE {stage} ON COMMIT DROP AS SELECT {columns} FROM public.{table} WITH NO DATA"
+    )
+    for chunk in csv_chunks(df, insert_columns, chunk_size):
+        cursor.copy_expert(f"COPY {stage} ({columns}) FROM STDIN WITH (FORMAT csv)", chunk)
+    cursor.execute(f"ANALYZE {stage}")
+
+    cursor.execute(
+        f"""WITH merged AS (
+                INSERT INTO public.{table} ({columns})
+                SELECT {columns} FROM {stage} AS stage
+                WHERE {where or "TRUE"}
+                ON CONFLICT ({key})
+                DO UPDATE SET
+                    {", ".join(f"{col} = EXCLUDED.{col}" for col in update_columns)},
+                    updated_at = NOW()
+                WHERE ({", ".join(f"{table}.{col}" for col in update_columns)})
+                    IS DISTINCT FROM ({", ".join(f"EXCLUDED.{col}" for col in update_columns)})
+                RETURNING (xmax = 0) AS inserted
+            )
+            SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM merged"""
+    )
+    inserted, updated = cursor.fetchone()
+    return {"inserted": inserted, "updated": updated, "unchanged": len(df) - inserted - updated}
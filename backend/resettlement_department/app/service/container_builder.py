@@ -0,0 +1,236 @@
+"""
+Контейнер для СПД: по шесть строк на квартиру (VSOOTVET, INFO_SOB, ISPOLNITEL, OSMOTR, GETKEY, OTVET).
+
+Три независимых шага: fetch_container_rows - запрос, render_container - таблица контейнера
+(тексты шаблонов собираются строковыми операциями по колонкам, без цикла по квартирам),
+write_container - запись в XLSX (потоково, xlsxwriter constant_memory) или CSV.
+"""
+import csv
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+CONTAINER_QUERY = """
+    WITH unnst AS (
+        SELECT
+            offer_id,
+            affair_id,
+            new_apart_id
+        FROM offer_last_apart
+        ORDER BY offer_id DESC
+    )
+    SELECT
+        oa.full_house_address,
+        oa.apart_number,
+        oa.type_of_settlement,
+        oa.kpu_number,
+        o.new_apart_id,
+        na.house_address,
+        na.apart_number,
+        na.full_living_area,
+        na.total_living_area,
+        na.room_count,
+        na.living_area,
+        na.floor,
+        cin_address,
+        cin_schedule,
+        dep_schedule,
+        phone_osmotr,
+        phone_otvet,
+        na.entrance_number,
+        (start_dates_by_entrence->>(na.entrance_number::text))::date AS start_date,
+        c.otdel,
+        c.full_house_address,
+        c.full_cin_address,
+        oa.district,
+        na.cad_num,
+        mail_index
+    FROM unnst o
+    JOIN old_apart oa USING (affair_id)
+    JOIN new_apart na USING (new_apart_id)
+    JOIN test_cin c ON c.house_address = na.house_address
+    JOIN mail_index on oa.full_house_address = mail_index.house_address
+    WHERE oa.is_queue <> 1
+"""
+
+CONTAINER_COLUMNS = [
+    'full_old_house_address', 'old_number', 'type_of_settlement', 'kpu_number', 'new_apart_id',
+    'new_address', 'new_number', 'full_living_area', 'total_living_area', 'room_count',
+    'living_area', 'floor', 'cin_address', 'cin_schedule', 'dep_schedule', 'phone_osmotr', 'phone_otvet', 'entrance_number', 'start_date', 'otdel',
+    'full_house_address', 'full_cin_address', 'old_district', 'old_cad_num', 'mail_index'
+]
+
+RUSSIAN_HEADERS = [
+    "Номер заявки", "Заявитель.Тип (1=ФЛ,2=ЮЛ,3=ИП)", "Заявитель.Порядковый номер", "Заявитель.Имя",
+    "Заявитель.Наименование юр.лица", "Заявитель.Почтовый адрес. Адрес строкой", "Заявитель.Почтовый адрес. Индекс",
+    "Заявитель.Почтовый адрес. Населенный пункт", "Помещение. Кадастровый номер", "Помещение. Адресный ориентир",
+    "Помещение. Площадь общая", "Помещение. Площадь жилая", "Помещение. Этаж", "Помещение. Количество комнат",
+    "Помещение. Площадь Жилого помещения", "Помещение. Статус помещения", "Помещение. Идентификатор источника",
+    "Свед.о действ.отнош. Номер", "Доп.параметр.Имя", "Доп.параметр.Значение", "Идентификатор документа для автогенерации"
+]
+ENGLISH_HEADERS = [
+    "NumPP", "appApplicantList.type", "appApplicantList.tab", "appApplicantList.firstname", "appApplicantList.name",
+    "appApplicantList.postAddressList.address", "appApplicantList.postAddressList.index", "appApplicantList.postAddressList.locality",
+    "flatList.cadastralNumber", "flatList.address", "flatList.square", "flatList.livingSquare", "flatList.floorNumber",
+    "flatList.room_number", "flatList.sDwellingArea", "flatList.flatStatus", "flatList.sourceid", "actDocList.documentNumber",
+    "customInputDataList.tagName", "customInputDataList.value", "reportID"
+]
+
+TAGS = ["VSOOTVET", "INFO_SOB", "ISPOLNITEL", "OSMOTR", "GETKEY", "OTVET"]
+
+# Неразрывные пробелы (\xa0) - как в шаблонах СПД
+INFO_SOB = """-\xa0заявление о включении в предмет Договора предлагаемого жилого помещения;\n-\xa0оригиналы документов личного характера и правоустанавливающие документы на освобождаемое жилое помещение.\nПросим довести указанную в письме информацию до всех правообладателей."""
+ISPOLNITEL = "Кандабаров Н.А."
+GETKEY = " "
+TIME2PLAN = "Предварительная запись на показ жилого помещения доступна на сервисе онлайн-записи «Время планировать вместе с ДГИ»: https://time2plan.online."
+
+# Шаблон документа по округу старой квартиры: (частная собственность, остальные)
+REPORT_IDS = {
+    **dict.fromkeys(("ЗелАО", "ВАО", "ЮВАО", "САО", "СВАО"), (108404, 108407)),
+    **dict.fromkeys(("ЗАО", "СЗАО", "ЮАО", "ЮЗАО", "ТАО", "НАО"), (108406, 108409)),
+    "ЦАО": (108405, 108408),
+}
+
+
+def fetch_container_rows(cursor, history_id=None, affair_ids=None):
+    """Квартиры контейнера: последние предложения семей истории (или affair_ids)."""
+    query = CONTAINER_QUERY
+    params = []
+    if history_id:
+        query += " AND na.history_id = %s AND oa.history_id = %s"
+        params.extend([history_id, history_id])
+    if affair_ids:
+        query += " AND oa.affair_id IN %s"
+        params.append(tuple(affair_ids))
+    cursor.execute(query, params)
+    return pd.DataFrame(cursor.fetchall(), columns=CONTAINER_COLUMNS)
+
+
+def _text(series):
+    # Как в f-строке: None -> "None"
+    return series.astype(str)
+
+
+def _report_ids(df):
+    private = df["type_of_settlement"] == "частная собственность"
+    ids = []
+    report_id = None
+    for district, is_private in zip(df["old_district"], private):
+        # Для округа вне справочника берется шаблон предыдущей квартиры
+        if district in REPORT_IDS:
+            report_id = REPORT_IDS[district][0 if is_private else 1]
+        ids.append(report_id)
+    return pd.Series(ids, index=df.index, dtype=object)
+
+
+def _osmotr(df, today):
+    start_date = df["start_date"]
+    has_start = np.array([value is not None and not pd.isna(value) and value > today for value in start_date], dtype=bool)
+    start_text = _text(start_date)
+    since = ("с " + start_text.str[8:] + "." + start_text.str[5:7] + "." + start_text.str[:4]).where(has_start, "")
+    text = (
+        "Для осмотра квартиры необходимо " + since
+        + " в течение 7 рабочих дней обратиться в информационный центр по адресу: г. Москва, "
+        + _text(df["full_cin_address"]) + " (" + _text(df["cin_schedule"]) + ")"
+        + " по предварительной записи онлайн на сайте https://www.mos.ru/ в разделе «Осмотр квартиры»"
+        + " (для перехода наведите камеру смартфона на QR~код) или по тел. " + _text(df["phone_osmotr"]) + "."
+    )
+    return text.where(df["cin_schedule"] != "time2plan", TIME2PLAN)
+
+
+def _otvet(df):
+    in_otdel = df["dep_schedule"] == "отдел"
+    address = _text(df["full_cin_address"]).where(~in_otdel, _text(df["otdel"]))
+    schedule = ("(" + _text(df["dep_schedule"]) + ")").where(~in_otdel, "")
+    return (
+        "Всем правообладателям необходимо предоставить свое согласие либо отказ от предлагаемого жилого помещения"
+        " в срок не позднее 7 рабочих дней в информационный центр по адресу: г.\xa0Москва, "
+        + address + " " + schedule
+        + ", по предварительной записи по вышеуказанному тел., при себе необходимо иметь следующие документы:"
+    )
+
+
+def render_container(df, today=None):
+    """
+    Таблица контейнера (колонки ENGLISH_HEADERS): на каждую квартиру шесть строк подряд,
+    поля квартиры заполнены в первой, тег и текст - в каждой.
+    """
+    today = today or datetime.now().date()
+    df = df.reset_index(drop=True)
+    count = len(df)
+    first = np.tile([True] + [False] * (len(TAGS) - 1), count)
+
+    texts = np.column_stack(
+        [
+            ("Согласно постановлению Правительства Москвы от 01.08.2017 № 497-ПП «О программе реновации жилищного фонда"
+             " в городе Москве» (далее - Программа реновации) в отношении многоквартирного дома по адресу: г. Москва, "
+             + _text(df["full_old_house_address"]) + " принято решение о включении в Программу реновации.").to_numpy(dtype=object),
+            np.full(count, INFO_SOB, dtype=object),
+            np.full(count, ISPOLNITEL, dtype=object),
+            _osmotr(df, today).to_numpy(dtype=object),
+            np.full(count, GETKEY, dtype=object),
+            _otvet(df).to_numpy(dtype=object),
+        ]
+    ) if count else np.empty((0, len(TAGS)), dtype=object)
+
+    first_row_values = {
+        "appApplicantList.type": 1,
+        "appApplicantList.tab": 1,
+        "appApplicantList.firstname": "Уважаемый правообладатель!",
+        "appApplicantList.postAddressList.address": _text(df["full_old_house_address"]) + " кв.\xa0" + _text(df["old_number"]),
+        "appApplicantList.postAddressList.index": df["mail_index"],
+        "appApplicantList.postAddressList.locality": "г.\xa0Москва",
+        "flatList.cadastralNumber": df["old_cad_num"],
+        "flatList.address": _text(df["full_house_address"]) + ", кв.\xa0" + _text(df["new_number"]),
+        "flatList.square": df["total_living_area"],
+        "flatList.livingSquare": df["living_area"],
+        "flatList.floorNumber": df["floor"],
+        "flatList.room_number": df["room_count"],
+        "flatList.sDwellingArea": df["full_living_area"],
+        "flatList.flatStatus": 3,
+        "flatList.sourceid": df["new_apart_id"],
+        "actDocList.documentNumber": df["kpu_number"],
+        "reportID": _report_ids(df),
+    }
+
+    columns = {
+        "NumPP": np.repeat(np.arange(1, count + 1), len(TAGS)),
+        "customInputDataList.tagName": np.tile(np.array(TAGS, dtype=object), count),
+        "customInputDataList.value": texts.ravel(),
+    }
+    for name, values in first_row_values.items():
+        column = np.full(count * len(TAGS), None, dtype=object)
+        column[first] = values.to_numpy(dtype=object) if isinstance(values, pd.Series) else values
+        columns[name] = column
+    for name in ENGLISH_HEADERS:
+        columns.setdefault(name, np.full(count * len(TAGS), None, dtype=object))
+
+    frame = pd.DataFrame(columns, columns=ENGLISH_HEADERS)
+    return frame.astype(object).where(frame.notna(), None)
+
+
+def write_container(frame, path):
+    """Пишет контейнер с двумя строками заголовков (русские, затем английские) в .xlsx или .csv."""
+    path = Path(path)
+    rows = frame.itertuples(index=False, name=None)
+    if path.suffix == ".csv":
+        with open(path, "w", encoding="utf-8-sig", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(RUSSIAN_HEADERS)
+            writer.writerow(ENGLISH_HEADERS)
+            writer.writerows(rows)
+        return path
+
+    book = xlsxwriter.Workbook(str(path), {"constant_memory": True, "strings_to_urls": False})
+    try:
+        sheet = book.add_worksheet("Sheet")
+        sheet.write_row(0, 0, RUSSIAN_HEADERS)
+        sheet.write_row(1, 0, ENGLISH_HEADERS)
+        for row_number, row in enumerate(rows, start=2):
+            sheet.write_row(row_number, 0, row)
+    finally:
+        book.close()
+    return path
@@ -0,0 +1,42 @@
+"""
+Журнал изменений данных подбора (sql/recommendation/DataChange.sql).
+
+Метка версии - SUM(weight) по строкам журнала истории (отчеты, пересчет рангов) или по всему
+журналу (снимок подбора). Каждая транзакция пишет только свои строки, поэтому загрузки,
+подбор и правки предложений не ждут друг друга; сумма меняется в момент фиксации, а откат
+ничего не меняет. Последовательность (nextval) для этого не годится: ее значение видно до
+фиксации, и кэш успел бы запомнить старые данные под новой меткой.
+
+Сжатие сливает строки завершенных транзакций в одну строку на историю с той же суммой,
+чтобы метки считались по нескольким строкам.
+"""
+from pathlib import Path
+
+from utils.sql_reader import read_sql_query
+
+CREATE_DATA_CHANGE_PATH = Path(__file__).resolve().parents[1] / "sql" / "recommendation" / "DataChange.sql"
+
+COMPACT_DATA_CHANGE_SQL = """
+    WITH merged AS (
+        DELETE FROM public.data_change
+        WHERE txid < pg_snapshot_xmin(pg_current_snapshot())
+        RETURNING history_id, weight
+    )
+    INSERT INTO public.data_change (txid, history_id, weight)
+    SELECT pg_current_xact_id(), history_id, SUM(weight)
+    FROM merged
+    GROUP BY history_id
+    ON CONFLICT (txid, (COALESCE(history_id, -1)))
+    DO UPDATE SET weight = public.data_change.weight + EXCLUDED.weight
+"""
+
+
+def compact_data_change(cursor):
+    """Сливает строки завершенных транзакций по историям; суммы, а значит и метки, не меняются."""
+    cursor.execute(COMPACT_DATA_CHANGE_SQL)
+
+
+def migrate_data_change(cursor):
+    """Миграция при старте: журнал, триггеры на old_apart, new_apart, offer и family_member, сжатие."""
+    cursor.execute(read_sql_query(str(CREATE_DATA_CHANGE_PATH)))
+    compact_data_change(cursor)
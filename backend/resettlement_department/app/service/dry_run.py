@@ -0,0 +1,98 @@
+"""
+Итоги пробного подбора (dry run): статистика по комнатностям и предложенные пары.
+
+Пробный подбор считает ранги и каскад подбора в памяти и ничего не пишет в базу,
+поэтому несколько вариантов адресов можно прогонять одновременно. Модуль не обращается
+к базе: на входе DataFrame семей и ресурса с рангами и MatchingResult.
+"""
+import pandas as pd
+
+from service.report_writer import ReportWriter
+
+PAIR_COLUMNS = [
+    "affair_id", "kpu_number", "old_room_count", "old_rank",
+    "new_apart_id", "house_address", "apart_number", "floor", "new_room_count", "new_rank",
+]
+ROOM_COLUMNS = [
+    "room_count", "families", "new_aparts", "offer", "cannot_offer", "balance", "mode", "min_unmatched_rank",
+]
+
+
+def _plain(value):
+    # numpy и Decimal -> типы JSON
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    if hasattr(value, "as_integer_ratio") and not isinstance(value, int):
+        return float(value)
+    return value
+
+
+def proposed_pairs(df_old_apart, df_new_apart, matching):
+    """Предложенные пары семья -> квартира в порядке подбора."""
+    old = df_old_apart.drop_duplicates("affair_id").set_index("affair_id")
+    new = df_new_apart.drop_duplicates("new_apart_id").set_index("new_apart_id")
+    pairs = []
+    for affair_id, new_apart_id in matching.offers:
+        family, apart = old.loc[affair_id], new.loc[new_apart_id]
+        pairs.append({
+            "affair_id": affair_id,
+            "kpu_number": family.get("kpu_number"),
+            "old_room_count": family["room_count"],
+            "old_rank": family["rank"],
+            "new_apart_id": new_apart_id,
+            "house_address": apart.get("house_address"),
+            "apart_number": apart.get("apart_number"),
+            "floor": apart.get("floor"),
+            "new_room_count": apart["room_count"],
+            "new_rank": apart["rank"],
+        })
+    return [{key: _plain(value) for key, value in pair.items()} for pair in pairs]
+
+
+def room_stats(df_old_apart, df_new_apart, matching):
+    """Семьи, ресурс, предложения и отказы подбора по комнатностям."""
+    families = df_old_apart.groupby("room_count")["affair_id"].count().to_dict()
+    new_aparts = df_new_apart.groupby("room_count")["new_apart_id"].count().to_dict()
+    room_by_affair = df_old_apart.set_index("affair_id")["room_count"].to_dict()
+    offers, cannot_offer = {}, {}
+    for affair_id, _ in matching.offers:
+        room_count = room_by_affair[affair_id]
+        offers[room_count] = offers.get(room_count, 0) + 1
+    for affair_id in {item[0] for item in matching.cannot_offer}:
+        room_count = room_by_affair[affair_id]
+        cannot_offer[room_count] = cannot_offer.get(room_count, 0) + 1
+
+    stats = []
+    for room_count in sorted(set(families) | set(new_aparts)):
+        stats.append({
+            "room_count": _plain(room_count),
+            "families": families.get(room_count, 0),
+            "new_aparts": new_aparts.get(room_count, 0),
+            "offer": offers.get(room_count, 0),
+            "cannot_offer": cannot_offer.get(room_count, 0),
+            "balance": new_aparts.get(room_count, 0) - families.get(room_count, 0),
+            "mode": "дефицит" if matching.flag_ficit.get(room_count) == 2 else "профицит",
+            "min_unmatched_rank": matching.min_rank_by_room.get(room_count),
+        })
+    return stats
+
+
+def summarize(df_old_apart, df_new_apart, matching):
+    """Ответ пробного подбора: итоги, статистика по комнатностям и пары."""
+    pairs = proposed_pairs(df_old_apart, df_new_apart, matching)
+    return {
+        "offer": len(pairs),
+        "cannot_offer": len({item[0] for item in matching.cannot_offer}),
+        "rooms": room_stats(df_old_apart, df_new_apart, matching),
+        "pairs": pairs,
+    }
+
+
+def write_summary(summary, path):
+    """Книга пробного подбора: листы "Комнатность" и "Пары"."""
+    with ReportWriter(path) as writer:
+        writer.write_table("Комнатность", pd.DataFrame(summary["rooms"], columns=ROOM_COLUMNS))
+        writer.write_table("Пары", pd.DataFrame(summary["pairs"], columns=PAIR_COLUMNS))
+    return path
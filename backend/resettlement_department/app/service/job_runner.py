@@ -0,0 +1,128 @@
+"""
+Фоновый запуск подбора и волн в пуле процессов с опросом статуса по job_id.
+
+Когда задача завершается, ее итоговый статус запоминается, а future и прокси прогресса
+в Manager освобождаются. Итог хранится job_ttl секунд после завершения, затем задача
+удаляется из списка.
+"""
+import multiprocessing
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+JOB_TTL = 3600
+
+# Прогресс текущей задачи в процессе-исполнителе (прокси словаря из Manager)
+_progress = None
+
+
+def report_progress(phase, **counts):
+    """Отмечает фазу задачи (load, rank, match, persist, excel) и счетчики. Вне задачи ничего не делает."""
+    if _progress is None:
+        return
+    _progress["phase"] = phase
+    _progress["phase_started_at"] = time.time()
+    if counts:
+        _progress["counts"] = {**_progress["counts"], **counts}
+
+
+def _run_job(func, kwargs, progress):
+    global _progress
+    _progress = progress
+    progress["phase"] = "load"
+    progress["started_at"] = progress["phase_started_at"] = time.time()
+    try:
+        return func(**kwargs)
+    finally:
+        progress["finished_at"] = time.time()
+        _progress = None
+
+
+class JobRunner:
+    def __init__(self, max_workers=2, job_ttl=JOB_TTL):
+        self.max_workers = max_workers
+        self.job_ttl = job_ttl
+        self.jobs = {}
+        self._executor = None
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Пул и Manager создаем при первой задаче, чтобы не плодить процессы при импорте
+        if self._executor is None:
+            context = multiprocessing.get_context("spawn")
+            self._manager = context.Manager()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        return self._executor
+
+    def submit(self, kind, func, **kwargs):
+        executor = self._pool()
+        job_id = uuid.uuid4().hex
+        progress = self._manager.dict(phase="queued", counts={}, submitted_at=time.time())
+        future = executor.submit(_run_job, func, kwargs, progress)
+        with self._lock:
+            self._evict()
+            self.jobs[job_id] = {"kind": kind, "progress": progress, "future": future}
+        future.add_done_callback(lambda future: self._finish(job_id))
+        return job_id
+
+    def _finish(self, job_id):
+        # Итог задачи вместо future и прокси: объект в процессе Manager освобождается
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or "status" in job:
+                return
+            job["status"] = self._live_status(job_id, job)
+            job["finished"] = time.monotonic()
+            del job["progress"], job["future"]
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self.jobs.items() if now - job.get("finished", now) > self.job_ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def status(self, job_id):
+        with self._lock:
+            self._evict()
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if "status" in job:
+                return job["status"]
+            return self._live_status(job_id, job)
+
+    def _live_status(self, job_id, job):
+        progress = dict(job["progress"])
+        future = job["future"]
+        now = time.time()
+        started_at = progress.get("started_at")
+        finished_at = progress.get("finished_at", now)
+        status = {
+            "job_id": job_id,
+            "kind": job["kind"],
+            "state": "queued" if started_at is None else "running",
+            "phase": progress["phase"],
+            "counts": progress["counts"],
+            "elapsed": round(finished_at - started_at, 1) if started_at else 0,
+            "phase_elapsed": round(finished_at - progress["phase_started_at"], 1) if started_at else 0,
+            "result": None,
+            "error": None,
+        }
+        if future.done():
+            exception = future.exception()
+            if exception is None:
+                status["state"] = "done"
+                status["result"] = future.result()
+            else:
+                status["state"] = "failed"
+                status["error"] = "".join(traceback.format_exception_only(type(exception), exception)).strip()
+        return status
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+            self._executor = self._manager = None
@@ -0,0 +1,350 @@
+"""Движок подбора квартир на массивах NumPy.
+
+Общий каскад дефицит/профицит для первичного подбора (match_new_apart_to_family_batch)
+и волн (wave_matching). Вместо фильтрации DataFrame на каждую семью ресурс хранится
+в массивах в порядке ORDER BY запроса новых квартир, занятые квартиры помечаются
+маской. Модуль не обращается к базе: на входе семьи и ресурс, на выходе MatchingResult.
+
+Комнатности подбираются независимо (кандидаты отбираются по room_count), поэтому при
+workers > 1 они считаются параллельно в пуле процессов: каждому процессу передаются
+только семьи и квартиры его комнатности, результаты сливаются в порядке комнатностей.
+Без очередников (ochered=False) результат совпадает с последовательным. Очередники
+выбирают из всего ресурса, поэтому в параллельном режиме они подбираются до разбиения
+по комнатностям - в порядке обхода, тоже воспроизводимо.
+"""
+import copy
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from dataclasses import dataclass, field
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# Допустимое превышение full_living_area над первой подходящей квартирой
+# для семей, купивших жилье после 01.08.2017
+DELTA_BY_ROOM = {1: 1.5, 2: 3, 3: 5, 4: 6.5, 5: 8, 6: 9.5, 7: 11, 8: 12.5}
+BUYING_DATE_CUTOFF = date(2017, 8, 1)
+FLOOR_WINDOW = 2
+# Меньше семей - пул процессов дороже самого подбора, считаем последовательно
+PARALLEL_MIN_FAMILIES = 5000
+
+
+def to_numbers(values):
+    return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=float)
+
+
+def to_cents(values):
+    # Площади в базе Numeric(10, 2): в сотых долях сравнения остаются точными, как с Decimal
+    return np.round(to_numbers(values) * 100)
+
+
+def _subset(table, index):
+    # Копия таблицы только со строками index (все массивы режутся одинаково)
+    part = copy.copy(table)
+    for name, value in vars(table).items():
+        if isinstance(value, np.ndarray):
+            setattr(part, name, value[index])
+    return part
+
+
+class NewApartPool:
+    """Ресурс (новые квартиры) в виде массивов с маской занятых квартир."""
+
+    def __init__(self, df_new_apart):
+        self.new_apart_id = df_new_apart["new_apart_id"].to_numpy(dtype=np.int64)
+        self.room_count = to_numbers(df_new_apart["room_count"])
+        self.floor = to_numbers(df_new_apart["floor"])
+        # Этажи в исходном dtype: по ним сортируем так же, как sort_values(by="floor")
+        self.floor_values = df_new_apart["floor"].to_numpy()
+        self.full_living_area = to_cents(df_new_apart["full_living_area"])
+        self.total_living_area = to_cents(df_new_apart["total_living_area"])
+        self.living_area = to_cents(df_new_apart["living_area"])
+        self.special_needs = to_numbers(df_new_apart["for_special_needs_marker"])
+        self.taken = np.zeros(len(df_new_apart), dtype=bool)
+        self.is_reversed = False
+        # room_count (None - все комнатности) -> индексы еще не занятых квартир в порядке обхода
+        self._alive = {}
+
+    def __len__(self):
+        return len(self.new_apart_id)
+
+    def reversed(self):
+        """Пул с обратным порядком обхода и своей маской занятых, как df.loc[::-1]."""
+        pool = copy.copy(self)
+        pool.taken = np.zeros_like(self.taken)
+        pool.is_reversed = not self.is_reversed
+        pool._alive = {}
+        return pool
+
+    def _indexes(self, room_count):
+        alive = self._alive.get(room_count)
+        if alive is None:
+            if room_count is None:
+                alive = np.arange(len(self))
+            else:
+                alive = np.flatnonzero(self.room_count == room_count)
+            if self.is_reversed:
+                alive = alive[::-1]
+        alive = alive[~self.taken[alive]]
+        self._alive[room_count] = alive
+        return alive
+
+    def candidates(self, families, row, room_count):
+        """Свободные квартиры, не меньшие квартиры семьи по всем площадям, в порядке обхода."""
+        index = self._indexes(room_count)
+        mask = (
+            (self.full_living_area[index] >= families.full_living_area[row])
+            & (self.total_living_area[index] >= families.total_living_area[row])
+            & (self.living_area[index] >= families.living_area[row])
+            & (self.special_needs[index] == families.special_needs[row])
+        )
+        return index[mask]
+
+    def take(self, index):
+        self.taken[index] = True
+
+    def free_ids(self, room_count):
+        return self.new_apart_id[self._indexes(room_count)]
+
+    def subset(self, index):
+        """Пул только из квартир index (в прежнем порядке и с их отметками занятости)."""
+        pool = _subset(self, index)
+        pool._alive = {}
+        return pool
+
+
+class FamilyTable:
+    """Семьи (старые квартиры) в виде массивов, в порядке запроса семей."""
+
+    def __init__(self, df_old_apart):
+        self.affair_id = df_old_apart["affair_id"].to_numpy()
+        self.room_count = to_numbers(df_old_apart["room_count"])
+        self.full_living_area = to_cents(df_old_apart["full_living_area"])
+        self.total_living_area = to_cents(df_old_apart["total_living_area"])
+        self.living_area = to_cents(df_old_apart["living_area"])
+        self.special_needs = to_numbers(df_old_apart["is_special_needs_marker"])
+        self.min_floor = to_numbers(df_old_apart["min_floor"])
+        self.max_floor = to_numbers(df_old_apart["max_floor"])
+        self.rank = df_old_apart["rank"].to_numpy()
+        # Истинность считаем по исходным значениям: NaN истинен, None и 0 - нет
+        self.has_floor = np.array(
+            [bool(low) or bool(high) for low, high in zip(df_old_apart["min_floor"], df_old_apart["max_floor"])],
+            dtype=bool,
+        )
+        self.late_buying = np.array(
+            [value is not None and value > BUYING_DATE_CUTOFF for value in df_old_apart["buying_date"]],
+            dtype=bool,
+        )
+        # Семьи, которым подбираем по правилу даты покупки (самый низкий этаж в пределах delta)
+        self.by_area_delta = self.late_buying & ~self.has_floor
+        self.is_queue = np.array([value == 1 for value in df_old_apart["is_queue"]], dtype=bool)
+
+    def rows(self, room_count):
+        return np.flatnonzero(self.room_count == room_count)
+
+    def subset(self, rows):
+        return _subset(self, rows)
+
+
+@dataclass
+class MatchingResult:
+    offers: list = field(default_factory=list)
+    cannot_offer: list = field(default_factory=list)
+    min_rank_by_room: dict = field(default_factory=dict)
+    flag_ficit: dict = field(default_factory=dict)
+    pool: NewApartPool = None
+    pool_second: NewApartPool = None
+
+    def add_unmatched(self, affair_id, room_count, rank):
+        self.cannot_offer.append((affair_id,))
+        if room_count not in self.min_rank_by_room or rank < self.min_rank_by_room[room_count]:
+            self.min_rank_by_room[room_count] = int(rank)
+
+    def free_new_apart_ids(self, room_count):
+        """Неподобранные квартиры комнатности из того пула, которым она подбиралась."""
+        pool = self.pool_second if self.flag_ficit.get(room_count) == 2 else self.pool
+        return pool.free_ids(room_count)
+
+
+def pick_by_floor(pool, families, row, room_count):
+    """Первая подходящая квартира: сначала в диапазоне этажей, затем в окне ±2, затем любая."""
+    candidates = pool.candidates(families, row, room_count)
+    if candidates.size == 0:
+        return None
+    floor = pool.floor[candidates]
+    in_range = candidates[(floor >= families.min_floor[row]) & (floor <= families.max_floor[row])]
+    if in_range.size:
+        return in_range[0]
+    if families.has_floor[row]:
+        in_window = candidates[
+            (floor >= families.min_floor[row] - FLOOR_WINDOW) & (floor <= families.max_floor[row] + FLOOR_WINDOW)
+        ]
+        if in_window.size:
+            return in_window[0]
+    return candidates[0]
+
+
+def pick_by_area_delta(pool, families, row, room_count):
+    """Для покупки после 2017 года: самый низкий этаж среди квартир, не больше первой подходящей на delta."""
+    candidates = pool.candidates(families, row, room_count)
+    if candidates.size == 0:
+        return None
+    full_living_area = pool.full_living_area[candidates]
+    close = candidates[full_living_area - full_living_area[0] <= DELTA_BY_ROOM[room_count] * 100]
+    if close.size == 0:
+        return candidates[0]
+    # quicksort без пропусков, как sort_values: при равных этажах выбор совпадает с прежним
+    floor = pool.floor_values[close]
+    known = ~pd.isna(floor)
+    if not known.any():
+        return close[0]
+    return close[known][np.argsort(floor[known], kind="quicksort")[0]]
+
+
+def match_family(result, families, row, pool, room_count, queue=False, offer=True):
+    """Подбор одной семьи из пула. Возвращает индекс квартиры в пуле или None."""
+    affair_id = int(families.affair_id[row])
+
+    if queue and families.is_queue[row]:
+        # Очередникам подбираем без учета комнатности
+        index = pick_by_floor(pool, families, row, None)
+        if index is not None:
+            pool.take(index)
+            if offer:
+                result.offers.append((affair_id, int(pool.new_apart_id[index])))
+        else:
+            result.add_unmatched(affair_id, room_count, families.rank[row])
+        return index
+
+    if families.by_area_delta[row]:
+        index = pick_by_area_delta(pool, families, row, room_count)
+        offer = True
+    else:
+        index = pick_by_floor(pool, families, row, room_count)
+
+    if index is None:
+        result.add_unmatched(affair_id, room_count, families.rank[row])
+        return None
+
+    pool.take(index)
+    if offer:
+        result.offers.append((affair_id, int(pool.new_apart_id[index])))
+    return index
+
+
+def match_room_count(result, families, pool, room_count, deficit, ochered=False, wave=False, prematched=None):
+    """
+    Подбор одной комнатности.
+
+    При дефиците (семей больше, чем квартир) семьи обходятся с конца дважды:
+    первый проход по прямому пулу, второй - по развернутому пулу, и предложения
+    записываются во втором. При профиците - один проход с начала.
+
+    prematched - строки очередников, уже подобранных заранее: строка -> индекс квартиры или None.
+    """
+    rows = families.rows(room_count)
+    prematched = prematched or {}
+    if deficit:
+        result.flag_ficit[room_count] = 2
+        second_rows = []
+        for row in rows[::-1]:
+            if row in prematched:
+                index = prematched[row]
+            else:
+                index = match_family(result, families, row, pool, room_count, queue=ochered, offer=False)
+            if not wave or (index is not None and not families.by_area_delta[row]):
+                second_rows.append(row)
+        for row in second_rows:
+            match_family(result, families, row, result.pool_second, room_count)
+    else:
+        result.flag_ficit[room_count] = 1
+        for row in rows:
+            if row in prematched:
+                continue
+            match_family(result, families, row, pool, room_count, queue=ochered)
+
+
+def match_queue_first(result, families, pool, deficit_by_room):
+    """
+    Очередники всех комнатностей в порядке обхода (комнатность, затем порядок прохода по ней)
+    подбираются из всего прямого пула. При дефиците предложение записывается во втором проходе.
+    """
+    prematched = {}
+    for room_count, deficit in deficit_by_room.items():
+        rows = families.rows(room_count)
+        for row in rows[::-1] if deficit else rows:
+            if families.is_queue[row]:
+                prematched[int(row)] = match_family(
+                    result, families, row, pool, room_count, queue=True, offer=not deficit
+                )
+    return prematched
+
+
+def _match_partition(families, pool, room_count, deficit, wave, prematched):
+    # Выполняется в процессе пула: families и pool - только строки этой комнатности
+    result = MatchingResult(pool=pool, pool_second=pool.reversed())
+    match_room_count(result, families, pool, room_count, deficit, wave=wave, prematched=prematched)
+    return result.offers, result.cannot_offer, result.min_rank_by_room, pool.taken, result.pool_second.taken
+
+
+def match_parallel(result, families, pool, deficit_by_room, ochered=False, wave=False, workers=None):
+    """Комнатности в пуле процессов; слияние в порядке комнатностей, как при последовательном обходе."""
+    prematched = match_queue_first(result, families, pool, deficit_by_room) if ochered else {}
+    partitions = []
+    # spawn, как в job_runner: fork из многопоточного процесса (пул соединений, uvicorn) небезопасен
+    with ProcessPoolExecutor(workers, mp_context=get_context("spawn")) as executor:
+        for room_count, deficit in deficit_by_room.items():
+            rows = families.rows(room_count)
+            index = np.flatnonzero(pool.room_count == room_count)
+            future = None
+            if rows.size:
+                local = {position: prematched[int(row)] for position, row in enumerate(rows) if int(row) in prematched}
+                future = executor.submit(
+                    _match_partition, families.subset(rows), pool.subset(index), room_count, deficit, wave, local
+                )
+            partitions.append((room_count, deficit, index, future))
+
+        for room_count, deficit, index, future in partitions:
+            result.flag_ficit[room_count] = 2 if deficit else 1
+            if future is None:
+                continue
+            offers, cannot_offer, min_rank_by_room, taken, taken_second = future.result()
+            result.offers.extend(offers)
+            result.cannot_offer.extend(cannot_offer)
+            for room, rank in min_rank_by_room.items():
+                if room not in result.min_rank_by_room or rank < result.min_rank_by_room[room]:
+                    result.min_rank_by_room[room] = rank
+            pool.taken[index] |= taken
+            result.pool_second.taken[index] |= taken_second
+
+
+def match_families(df_old_apart, df_new_apart, ochered=False, wave=False, workers=None):
+    """
+    Каскад подбора по комнатностям (см. match_room_count).
+
+    wave=True - режим волн: во второй проход попадают только семьи, которым в первом
+    нашлась квартира по этажам (без правила даты покупки).
+
+    workers > 1 - комнатности считаются в пуле из workers процессов, если семей
+    не меньше PARALLEL_MIN_FAMILIES.
+    """
+    families = FamilyTable(df_old_apart)
+    pool = NewApartPool(df_new_apart)
+    result = MatchingResult(pool=pool, pool_second=pool.reversed())
+
+    old_apart_count = df_old_apart.groupby("room_count")["affair_id"].count().to_dict()
+    new_apart_count = df_new_apart.groupby("room_count")["new_apart_id"].count().to_dict()
+    max_room_count = max(df_old_apart["room_count"].max(), df_new_apart["room_count"].max())
+    deficit_by_room = {
+        i: old_apart_count.get(i, 0) > new_apart_count.get(i, 0) for i in range(1, int(max_room_count) + 1)
+    }
+
+    if workers and workers > 1 and len(df_old_apart) >= PARALLEL_MIN_FAMILIES:
+        match_parallel(result, families, pool, deficit_by_room, ochered=ochered, wave=wave, workers=workers)
+        return result
+
+    for i, deficit in deficit_by_room.items():
+        match_room_count(result, families, pool, i, deficit, ochered=ochered, wave=wave)
+
+    return result
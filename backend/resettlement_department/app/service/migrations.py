@@ -0,0 +1,33 @@
+"""
+Миграции схемы, которые приложение выполняет при старте.
+
+Отдельного инструмента миграций в проекте нет, поэтому таблицы и триггеры, от которых
+зависят запросы сервиса, создаются здесь. Каждый шаг идемпотентен и сам решает, нужно ли
+заполнять новую таблицу. Шаги выполняются в одной транзакции под advisory lock, чтобы
+несколько воркеров uvicorn не выполняли их одновременно.
+"""
+from contextlib import nullcontext
+
+from repository.database import db_connection
+from service.data_change import migrate_data_change
+from service.offer_projection import migrate_offer_item, migrate_offer_last
+from service.rank_refresh import migrate_rank_breakpoint
+
+MIGRATION_LOCK_ID = 7_300_001
+
+MIGRATIONS = [
+    migrate_offer_item,
+    migrate_offer_last,
+    migrate_data_change,
+    migrate_rank_breakpoint,
+]
+
+
+def run_migrations(conn=None):
+    with nullcontext(conn) if conn is not None else db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            for migration in MIGRATIONS:
+                migration(cursor)
+        conn.commit()
+    print("MIGRATIONS done", len(MIGRATIONS))
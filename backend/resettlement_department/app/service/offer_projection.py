@@ -0,0 +1,95 @@
+"""
+Реляционные проекции offer.new_aparts.
+
+offer_item - квартиры всех предложений построчно (sql/recommendation/OfferItem.sql),
+offer_last и offer_last_apart - последнее предложение по семье (sql/recommendation/OfferLast.sql).
+Таблицы обновляются триггерами на offer, поэтому подбор, таблица квартир, контейнер
+и массовая смена статусов не разворачивают jsonb_each и не считают ROW_NUMBER/MAX(offer_id)
+по всей offer на каждый запрос.
+
+Таблицы создаются и заполняются миграцией при старте (service/migrations.py);
+rebuild_offer_projection нужен только для ручной пересборки после сбоя.
+"""
+from contextlib import nullcontext
+from pathlib import Path
+
+from repository.database import db_connection
+from utils.sql_reader import read_sql_query
+
+SQL_PATH = Path(__file__).resolve().parents[1] / "sql" / "recommendation"
+CREATE_OFFER_ITEM_PATH = SQL_PATH / "OfferItem.sql"
+CREATE_PROJECTION_PATH = SQL_PATH / "OfferLast.sql"
+
+
+def table_exists(cursor, name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (f"public.{name}",))
+    return cursor.fetchone()[0]
+
+
+def create_offer_projection(cursor):
+    """Создает таблицы проекций, функции пересчета и триггеры на offer (повторный запуск безопасен)."""
+    cursor.execute(read_sql_query(str(CREATE_OFFER_ITEM_PATH)))
+    cursor.execute(read_sql_query(str(CREATE_PROJECTION_PATH)))
+
+
+def backfill_offer_items(cursor):
+    """Заполняет offer_item по всем предложениям. Возвращает число строк."""
+    cursor.execute("TRUNCATE public.offer_item")
+    cursor.execute(
+        """INSERT INTO public.offer_item (offer_id, affair_id, new_apart_id, status_id, decline_reason_id)
+            SELECT
+                offer_id,
+                affair_id,
+                (key)::bigint,
+                (value->>'status_id')::int,
+                (value->>'decline_reason_id')::int
+            FROM public.offer,
+            jsonb_each(new_aparts)"""
+    )
+    return cursor.rowcount
+
+
+def migrate_offer_item(cursor):
+    """Миграция при старте: offer_item и его триггеры; заполнение - только при создании таблицы."""
+    created = not table_exists(cursor, "offer_item")
+    cursor.execute(read_sql_query(str(CREATE_OFFER_ITEM_PATH)))
+    if created:
+        print("OFFER ITEM backfilled", backfill_offer_items(cursor))
+
+
+def backfill_offer_last(cursor):
+    """Заполняет offer_last и offer_last_apart по всем семьям с предложениями."""
+    cursor.execute("TRUNCATE public.offer_last, public.offer_last_apart")
+    cursor.execute(
+        "SELECT public.refresh_offer_last(ARRAY(SELECT DISTINCT affair_id FROM public.offer WHERE affair_id IS NOT NULL))"
+    )
+
+
+def migrate_offer_last(cursor):
+    """
+    Миграция при старте: функции и триггеры offer_last обновляются всегда, а заполнение
+    выполняется только при создании таблицы - дальше проекцию ведут триггеры.
+    """
+    created = not table_exists(cursor, "offer_last")
+    cursor.execute(read_sql_query(str(CREATE_PROJECTION_PATH)))
+    if created:
+        backfill_offer_last(cursor)
+        print("OFFER LAST backfilled")
+
+
+def rebuild_offer_projection(conn=None):
+    """Пересобирает проекции по всей таблице offer. Возвращает число строк offer_item, семей и квартир последних предложений."""
+    with nullcontext(conn) if conn is not None else db_connection() as conn:
+        with conn.cursor() as cursor:
+            create_offer_projection(cursor)
+            items = backfill_offer_items(cursor)
+            backfill_offer_last(cursor)
+            cursor.execute("SELECT (SELECT COUNT(*) FROM public.offer_last), (SELECT COUNT(*) FROM public.offer_last_apart)")
+            families, aparts = cursor.fetchone()
+        conn.commit()
+    print("OFFER PROJECTION items", items, "families", families, "aparts", aparts)
+    return {"items": items, "families": families, "aparts": aparts}
+
+
+if __name__ == "__main__":
+    rebuild_offer_projection()
@@ -0,0 +1,109 @@
+"""Запись результатов подбора в базу одним набором запросов вместо запроса на каждую семью."""
+import json
+
+from psycopg2.extras import execute_values
+
+PAGE_SIZE = 1000
+
+
+def update_ranks(cursor, table, id_column, ranks):
+    """
+    Одним UPDATE ... FROM (VALUES ...) проставляет ранги.
+
+    ranks - пары (id, rank). При повторе id остается последний ранг,
+    как при последовательных UPDATE через executemany.
+    """
+    ranks = {int(apart_id): int(rank) for apart_id, rank in ranks}
+    if not ranks:
+        return
+    execute_values(
+        cursor,
+        f"""UPDATE public.{table}
+            SET rank = data.rank
+            FROM (VALUES %s) AS data ({id_column}, rank)
+            WHERE {table}.{id_column} = data.{id_column}""",
+        list(ranks.items()),
+        template="(%s::bigint, %s::int)",
+        page_size=PAGE_SIZE,
+    )
+
+
+def offers_by_family(offers):
+    """Собирает пары (affair_id, new_apart_id) в JSON new_aparts по каждой семье."""
+    new_aparts_by_family = {}
+    for old_apart_id, new_apart_id in offers:
+        new_aparts_by_family.setdefault(int(old_apart_id), {})[str(new_apart_id)] = {"status_id": 7}
+    return new_aparts_by_family
+
+
+def merge_offers(cursor, offers):
+    """
+    Дописывает подобранные квартиры в offer.new_aparts.
+
+    Пары загружаются во временную таблицу, затем одним UPDATE объединяются
+    с существующими предложениями семьи (jsonb ||), а семьям без предложения
+    одним INSERT создается новая запись со статусом 7.
+    """
+    new_aparts_by_family = offers_by_family(offers)
+    if not new_aparts_by_family:
+        return
+    cursor.execute(
+        """CREATE TEMP TABLE matching_offer (
+                affair_id bigint PRIMARY KEY,
+                new_aparts jsonb NOT NULL
+            )"""
+    )
+    execute_values(
+        cursor,
+        "INSERT INTO matching_offer (affair_id, new_aparts) VALUES %s",
+        [(affair_id, json.dumps(new_aparts, ensure_ascii=False)) for affair_id, new_aparts in new_aparts_by_family.items()],
+        template="(%s, %s::jsonb)",
+        page_size=PAGE_SIZE,
+    )
+    cursor.execute(
+        """UPDATE public.offer
+            SET new_aparts = COALESCE(offer.new_aparts, '{}'::jsonb) || matching_offer.new_aparts
+            FROM matching_offer
+            WHERE offer.affair_id = matching_offer.affair_id"""
+    )
+    cursor.execute(
+        """INSERT INTO public.offer (affair_id, new_aparts, status_id)
+            SELECT affair_id, new_aparts, 7
+            FROM matching_offer
+            WHERE NOT EXISTS (
+                SELECT 1 FROM public.offer WHERE offer.affair_id = matching_offer.affair_id
+            )"""
+    )
+    cursor.execute("DROP TABLE matching_offer")
+
+
+def insert_offers(cursor, offers):
+    """Новая запись offer на каждую пару (affair_id, new_apart_id), одним INSERT."""
+    if not offers:
+        return
+    execute_values(
+        cursor,
+        "INSERT INTO public.offer (affair_id, new_aparts, status_id) VALUES %s",
+        [
+            (int(old_apart_id), json.dumps({str(new_apart_id): {"status_id": 7}}, ensure_ascii=False))
+            for old_apart_id, new_apart_id in offers
+        ],
+        template="(%s, %s::jsonb, 7)",
+        page_size=PAGE_SIZE,
+    )
+
+
+def insert_family_offers(cursor, new_aparts_by_family):
+    """Новая запись offer со статусом 7 на каждую семью: affair_id -> new_aparts целиком, одним INSERT."""
+    if not new_aparts_by_family:
+        return
+    execute_values(
+        cursor,
+        "INSERT INTO public.offer (affair_id, new_aparts, status_id) VALUES %s",
+        [
+            (int(affair_id), json.dumps(new_aparts, ensure_ascii=False))
+            for affair_id, new_aparts in new_aparts_by_family.items()
+        ],
+        template="(%s, %s::jsonb, 7)",
+        page_size=PAGE_SIZE,
+    )
@@ -0,0 +1,144 @@
+"""Индекс доминирования для расчета рангов новых квартир.
+
+Ранг новой квартиры - максимальный ранг старой квартиры той же комнатности и
+того же признака инвалидности, которую новая покрывает по всем трем площадям
+(living_area, full_living_area, total_living_area). Для каждой пары
+(room_count, special_needs) строится k-d дерево по трем площадям с максимумом
+ранга в каждом узле, поэтому запрос не перебирает все старые квартиры.
+"""
+import numpy as np
+
+from service.matching_engine import to_cents, to_numbers
+
+LEAF_SIZE = 32
+
+
+class RangeMaxTree:
+    """k-d дерево по точкам (living, full, total) с максимальным рангом в узлах."""
+
+    def __init__(self, points, ranks):
+        self.points = points.copy()
+        self.ranks = ranks.copy()
+        # Узлы: (lo, hi, max_rank, left, right, start, end)
+        self.nodes = []
+        self._build(0, len(self.ranks))
+
+    def _build(self, start, end):
+        points = self.points[start:end]
+        node_id = len(self.nodes)
+        self.nodes.append(None)
+        lo, hi = points.min(axis=0), points.max(axis=0)
+        left = right = -1
+        if end - start > LEAF_SIZE:
+            axis = int(np.argmax(hi - lo))
+            middle = (end - start) // 2
+            order = np.argpartition(points[:, axis], middle)
+            self.points[start:end] = points[order]
+            self.ranks[start:end] = self.ranks[start:end][order]
+            left = self._build(start, start + middle)
+            right = self._build(start + middle, end)
+        self.nodes[node_id] = (
+            tuple(lo.tolist()),
+            tuple(hi.tolist()),
+            int(self.ranks[start:end].max()),
+            left,
+            right,
+            start,
+            end,
+        )
+        return node_id
+
+    def max_rank(self, query):
+        """Максимальный ранг среди точек, покомпонентно не больших query, или None."""
+        best = None
+        stack = [0]
+        while stack:
+            lo, hi, max_rank, left, right, start, end = self.nodes[stack.pop()]
+            if best is not None and max_rank <= best:
+                continue
+            if lo[0] > query[0] or lo[1] > query[1] or lo[2] > query[2]:
+                continue
+            if hi[0] <= query[0] and hi[1] <= query[1] and hi[2] <= query[2]:
+                best = max_rank
+                continue
+            if left < 0:
+                mask = (self.points[start:end] <= query).all(axis=1)
+                if mask.any():
+                    rank = int(self.ranks[start:end][mask].max())
+                    if best is None or rank > best:
+                        best = rank
+                continue
+            # Сначала обходим узел с большим максимумом: остальное чаще отсекается
+            if self.nodes[left][2] > self.nodes[right][2]:
+                stack.extend((right, left))
+            else:
+                stack.extend((left, right))
+        return best
+
+
+class DominanceIndex:
+    """Деревья RangeMaxTree по ключу (room_count, special_needs) для старых квартир."""
+
+    def __init__(self, df_old_apart):
+        room_count = to_numbers(df_old_apart["room_count"])
+        special_needs = to_numbers(df_old_apart["is_special_needs_marker"])
+        points = np.column_stack(
+            [
+                to_cents(df_old_apart["living_area"]),
+                to_cents(df_old_apart["full_living_area"]),
+                to_cents(df_old_apart["total_living_area"]),
+            ]
+        )
+        ranks = df_old_apart["rank"].to_numpy(dtype=np.int64)
+        combined_area = points[:, 0] + points[:, 1]
+
+        # Квартиры с пропусками не покрываются ни одной новой: в индекс их не кладем
+        valid = ~(np.isnan(points).any(axis=1) | np.isnan(room_count) | np.isnan(special_needs))
+        self.trees = {}
+        for key in set(zip(room_count[valid].tolist(), special_needs[valid].tolist())):
+            mask = valid & (room_count == key[0]) & (special_needs == key[1])
+            self.trees[key] = RangeMaxTree(points[mask], ranks[mask])
+
+        # Минимальная суммарная площадь среди квартир 1 ранга по комнатности
+        self.min_area_rank_1 = {}
+        rank_1 = (ranks == 1) & ~np.isnan(combined_area)
+        for room, area in zip(room_count[rank_1].tolist(), combined_area[rank_1].tolist()):
+            if area < self.min_area_rank_1.get(room, float("inf")):
+                self.min_area_rank_1[room] = area
+
+    def max_rank(self, room_count, special_needs, living_area, full_living_area, total_living_area):
+        tree = self.trees.get((room_count, special_needs))
+        if tree is None:
+            return None
+        return tree.max_rank((living_area, full_living_area, total_living_area))
+
+    def rank_new_aparts(self, df_new_apart):
+        """Ранги всех новых квартир за один проход, в порядке строк df_new_apart."""
+        room_count = to_numbers(df_new_apart["room_count"])
+        special_needs = to_numbers(df_new_apart["for_special_needs_marker"])
+        living_area = to_cents(df_new_apart["living_area"])
+        full_living_area = to_cents(df_new_apart["full_living_area"])
+        total_living_area = to_cents(df_new_apart["total_living_area"])
+        combined_area = living_area + full_living_area
+
+        ranks = np.zeros(len(df_new_apart), dtype=np.int64)
+        rows = zip(
+            room_count.tolist(),
+            special_needs.tolist(),
+            living_area.tolist(),
+            full_living_area.tolist(),
+            total_living_area.tolist(),
+            combined_area.tolist(),
+        )
+        for i, (room, special, living, full, total, combined) in enumerate(rows):
+            # Ранг 0, если новая квартира меньше самой маленькой старой квартиры 1 ранга
+            if combined < self.min_area_rank_1.get(room, float("inf")):
+                continue
+            rank = self.max_rank(room, special, living, full, total)
+            if rank is not None:
+                ranks[i] = rank
+        return ranks
+
+
+def rank_new_aparts(df_old_apart, df_new_apart):
+    return DominanceIndex(df_old_apart).rank_new_aparts(df_new_apart)
@@ -0,0 +1,262 @@
+"""
+Инкрементальный пересчет рангов после выгрузки из РСМ.
+
+Для каждой пары (history_id, room_count) в rank_breakpoint хранятся отсортированные
+уникальные суммарные площади семей (по ним считается dense rank) и отпечаток площадей
+семей и квартир группы. После выгрузки читаются только истории, у которых сумма журнала
+data_change изменилась с прошлого пересчета; в них пересчитываются только группы, у которых сдвинулись
+границы или изменился отпечаток, и в базу пишутся только изменившиеся ранги.
+
+Ранги квартир, выставленные подбором (ранг предложенной семьи, min_rank - 1 для свободных),
+хранятся в pinned и заново не считаются: ранг r переносится на площадь границы r в новых
+границах, чтобы остаться согласованным с пересчитанными рангами семей.
+"""
+from collections import defaultdict
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from service.data_change import compact_data_change
+from service.matching_engine import to_cents, to_numbers
+from service.offer_writer import update_ranks
+from service.rank_index import rank_new_aparts
+from utils.sql_reader import read_sql_query
+
+CREATE_TABLE_PATH = Path(__file__).resolve().parents[1] / "sql" / "recommendation" / "RankBreakpoint.sql"
+
+CHANGED_HISTORIES_SQL = """
+    SELECT DISTINCT rb.history_id
+    FROM public.rank_breakpoint rb
+    LEFT JOIN (
+        SELECT history_id, SUM(weight) AS version
+        FROM public.data_change
+        WHERE history_id IS NOT NULL
+        GROUP BY history_id
+    ) dc ON dc.history_id = rb.history_id
+    WHERE rb.history_version IS DISTINCT FROM dc.version
+"""
+
+OLD_APART_COLUMNS = [
+    "affair_id", "history_id", "room_count", "living_area", "full_living_area", "total_living_area",
+    "is_special_needs_marker", "rank",
+]
+NEW_APART_COLUMNS = [
+    "new_apart_id", "history_id", "room_count", "living_area", "full_living_area", "total_living_area",
+    "for_special_needs_marker", "rank",
+]
+
+
+class AreaTable:
+    """Площади квартир в сотых и разбиение строк на группы (history_id, room_count), упорядоченные по id."""
+
+    def __init__(self, df, id_column, special_needs_column, history_id=None):
+        self.df = df
+        self.rank = df["rank"].to_numpy() if "rank" in df.columns else None
+        # id, living, full, total, special_needs: по этим строкам считается отпечаток группы
+        self.rows = np.column_stack(
+            [
+                to_numbers(df[id_column]),
+                to_cents(df["living_area"]),
+                to_cents(df["full_living_area"]),
+                to_cents(df["total_living_area"]),
+                to_numbers(df[special_needs_column]),
+            ]
+        )
+        history = to_numbers(df["history_id"]) if history_id is None else np.full(len(df), float(history_id))
+        room_count = to_numbers(df["room_count"])
+        order = np.lexsort((self.rows[:, 0], room_count, history))
+        order = order[~(np.isnan(history[order]) | np.isnan(room_count[order]))]
+        keys = np.column_stack([history[order], room_count[order]])
+        starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)]) if len(order) else np.array([], dtype=int)
+        self.groups = {
+            (int(keys[start, 0]), int(keys[start, 1])): order[start:end]
+            for start, end in zip(starts, np.r_[starts[1:], len(order)].astype(int))
+        }
+
+    def group(self, key):
+        return self.groups.get(key, np.array([], dtype=int))
+
+
+def area_breakpoints(combined_area):
+    """Границы dense rank: уникальные living_area + full_living_area в сотых, по возрастанию."""
+    return [int(area) for area in np.unique(combined_area[~np.isnan(combined_area)])]
+
+
+def group_state(old_rows, new_rows):
+    """Границы и отпечаток группы: отпечаток меняется при любом изменении состава и площадей."""
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(old_rows).tobytes())
+    digest.update(b"|")
+    digest.update(np.ascontiguousarray(new_rows).tobytes())
+    return area_breakpoints(old_rows[:, 1] + old_rows[:, 2]), digest.hexdigest()
+
+
+def remap_ranks(ranks, old_breakpoints, new_breakpoints):
+    """Переносит ранги на новые границы: ранг r - площадь old_breakpoints[r - 1]. Ранги вне границ (0) не меняются."""
+    ranks = np.asarray(ranks, dtype=float)
+    old_breakpoints = np.asarray(old_breakpoints, dtype=float)
+    inside = (ranks >= 1) & (ranks <= len(old_breakpoints))
+    remapped = ranks.copy()
+    remapped[inside] = np.searchsorted(
+        np.asarray(new_breakpoints, dtype=float), old_breakpoints[ranks[inside].astype(int) - 1]
+    ) + 1
+    return remapped.astype(np.int64)
+
+
+def plan_rank_refresh(df_old_apart, df_new_apart, stored_states):
+    """
+    Определяет, какие группы (history_id, room_count) пересчитать.
+
+    stored_states - {(history_id, room_count): (breakpoints, fingerprint, pinned)}.
+    Возвращает изменившиеся ранги семей и квартир парами (id, rank) и новые
+    состояния групп. Группа без сохраненного состояния только запоминается:
+    ранги после подбора в ней не трогаем.
+    """
+    old_aparts = AreaTable(df_old_apart, "affair_id", "is_special_needs_marker")
+    new_aparts = AreaTable(df_new_apart, "new_apart_id", "for_special_needs_marker")
+    old_apart_updates = []
+    new_apart_updates = []
+    states = {}
+
+    for key in sorted(set(old_aparts.groups) | set(new_aparts.groups)):
+        old_index, new_index = old_aparts.group(key), new_aparts.group(key)
+        old_rows = old_aparts.rows[old_index]
+        breakpoints, fingerprint = group_state(old_rows, new_aparts.rows[new_index])
+
+        stored = stored_states.get(key)
+        if stored is not None and list(stored[0]) == breakpoints and stored[1] == fingerprint:
+            continue
+        states[key] = (breakpoints, fingerprint)
+        if stored is None:
+            continue
+
+        old_ranks = np.searchsorted(np.array(breakpoints, dtype=float), old_rows[:, 1] + old_rows[:, 2]) + 1
+        current = old_aparts.rank[old_index]
+        changed = pd.isna(current) | (current != old_ranks)
+        old_apart_updates.extend(zip(old_rows[changed, 0].astype(np.int64).tolist(), old_ranks[changed].tolist()))
+
+        if len(new_index):
+            group_new = df_new_apart.iloc[new_index]
+            if len(old_index):
+                new_ranks = rank_new_aparts(df_old_apart.iloc[old_index].assign(rank=old_ranks), group_new)
+            else:
+                new_ranks = np.zeros(len(new_index), dtype=np.int64)
+            current = new_aparts.rank[new_index]
+            new_ids = new_aparts.rows[new_index, 0].astype(np.int64)
+            is_pinned = np.isin(new_ids, list(stored[2])) & ~pd.isna(current)
+            if is_pinned.any():
+                new_ranks = new_ranks.copy()
+                new_ranks[is_pinned] = remap_ranks(current[is_pinned], stored[0], breakpoints)
+            changed = pd.isna(current) | (current != new_ranks)
+            new_apart_updates.extend(zip(new_ids[changed].tolist(), new_ranks[changed].tolist()))
+
+    return old_apart_updates, new_apart_updates, states
+
+
+def migrate_rank_breakpoint(cursor):
+    """Миграция при старте: таблица rank_breakpoint."""
+    cursor.execute(read_sql_query(str(CREATE_TABLE_PATH)))
+
+
+def save_rank_states(cursor, states):
+    if not states:
+        return
+    execute_values(
+        cursor,
+        """INSERT INTO public.rank_breakpoint (history_id, room_count, breakpoints, fingerprint)
+            VALUES %s
+            ON CONFLICT (history_id, room_count)
+            DO UPDATE SET
+                breakpoints = EXCLUDED.breakpoints,
+                fingerprint = EXCLUDED.fingerprint,
+                updated_at = NOW()""",
+        [(history_id, room_count, breakpoints, fingerprint) for (history_id, room_count), (breakpoints, fingerprint) in states.items()],
+        template="(%s, %s, %s::bigint[], %s)",
+    )
+
+
+def save_rank_baseline(cursor, history_id, df_old_apart, df_new_apart):
+    """Запоминает состояние групп подбора, чтобы следующие выгрузки пересчитывали ранги инкрементально."""
+    old_aparts = AreaTable(df_old_apart, "affair_id", "is_special_needs_marker", history_id=history_id)
+    new_aparts = AreaTable(df_new_apart, "new_apart_id", "for_special_needs_marker", history_id=history_id)
+    states = {
+        key: group_state(old_aparts.rows[old_aparts.group(key)], new_aparts.rows[new_aparts.group(key)])
+        for key in set(old_aparts.groups) | set(new_aparts.groups)
+    }
+    save_rank_states(cursor, states)
+
+
+def pin_matched_ranks(cursor, history_id, df_new_apart, new_apart_ids):
+    """Запоминает квартиры, которым подбор выставил ранг: пересчет после выгрузки их не затирает."""
+    room_by_id = df_new_apart.drop_duplicates("new_apart_id").set_index("new_apart_id")["room_count"]
+    pinned = defaultdict(list)
+    for new_apart_id in set(new_apart_ids):
+        if new_apart_id in room_by_id.index and not pd.isna(room_by_id[new_apart_id]):
+            pinned[int(room_by_id[new_apart_id])].append(int(new_apart_id))
+    if not pinned:
+        return
+    execute_values(
+        cursor,
+        """UPDATE public.rank_breakpoint rb
+            SET pinned = data.pinned
+            FROM (VALUES %s) AS data (history_id, room_count, pinned)
+            WHERE rb.history_id = data.history_id AND rb.room_count = data.room_count""",
+        [(history_id, room_count, sorted(ids)) for room_count, ids in pinned.items()],
+        template="(%s::integer, %s::integer, %s::bigint[])",
+    )
+
+
+def refresh_ranks(conn):
+    """
+    Пересчитывает ранги после выгрузки: читаются только истории, изменившиеся с прошлого
+    пересчета, пишутся только изменившиеся ранги. Возвращает число групп и обновленных рангов.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(CHANGED_HISTORIES_SQL)
+        history_ids = [row[0] for row in cursor.fetchall()]
+        if not history_ids:
+            print("RANK REFRESH nothing changed")
+            return {"histories": 0, "groups": 0, "old_apart": 0, "new_apart": 0}
+        cursor.execute(
+            f"SELECT {', '.join(OLD_APART_COLUMNS)} FROM public.old_apart WHERE history_id = ANY(%s)", (history_ids,)
+        )
+        df_old_apart = pd.DataFrame(cursor.fetchall(), columns=OLD_APART_COLUMNS)
+        cursor.execute(
+            f"SELECT {', '.join(NEW_APART_COLUMNS)} FROM public.new_apart WHERE history_id = ANY(%s)", (history_ids,)
+        )
+        df_new_apart = pd.DataFrame(cursor.fetchall(), columns=NEW_APART_COLUMNS)
+        cursor.execute(
+            """SELECT history_id, room_count, breakpoints, fingerprint, pinned
+                FROM public.rank_breakpoint
+                WHERE history_id = ANY(%s)""",
+            (history_ids,),
+        )
+        stored_states = {(row[0], row[1]): (row[2], row[3], row[4]) for row in cursor.fetchall()}
+
+        old_apart_updates, new_apart_updates, states = plan_rank_refresh(df_old_apart, df_new_apart, stored_states)
+        update_ranks(cursor, "old_apart", "affair_id", old_apart_updates)
+        update_ranks(cursor, "new_apart", "new_apart_id", new_apart_updates)
+        save_rank_states(cursor, states)
+        # Версия берется после своих записей рангов: следующий пересчет их не перечитывает
+        cursor.execute(
+            """UPDATE public.rank_breakpoint rb
+                SET history_version = (
+                    SELECT SUM(dc.weight) FROM public.data_change dc WHERE dc.history_id = rb.history_id
+                )
+                WHERE rb.history_id = ANY(%s)""",
+            (history_ids,),
+        )
+        # Сжатие сохраняет суммы, поэтому записанные версии остаются верными
+        compact_data_change(cursor)
+    conn.commit()
+    result = {
+        "histories": len(history_ids),
+        "groups": len(states),
+        "old_apart": len(old_apart_updates),
+        "new_apart": len(new_apart_updates),
+    }
+    print("RANK REFRESH", result)
+    return result
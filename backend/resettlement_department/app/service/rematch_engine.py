@@ -0,0 +1,158 @@
+"""
+Переподбор квартир взамен отказных (POST /tables/apartment/rematch) в памяти.
+
+Правила те же, что у посемейного цикла rematch: на каждую отказную квартиру семьи
+ищется свободная квартира той же комнатности с площадями не меньше, чем у старой,
+тем же признаком особых потребностей, в адресах истории семьи, с рангом семьи или
+max_rank комнатности, сначала в окне этажей причины отказа, затем без него.
+Порядок - ORDER BY rank, (full_living_area + living_area), при равенстве new_apart_id.
+Семьи обрабатываются в порядке запроса; подобранная квартира сразу становится занятой
+для следующих семей, как после commit в цикле.
+
+Модуль не обращается к базе: контекст семей и ресурс загружает rematch_service.
+"""
+from dataclasses import dataclass, field, replace
+
+REMATCH_STATUS = 7
+EXCLUDED_STATUSES = (12, 13)
+NO_APARTS_REASON = "Не нашлось подходящих квартир"
+
+
+@dataclass
+class RematchFamily:
+    affair_id: int
+    rank: object
+    full_living_area: object
+    total_living_area: object
+    living_area: object
+    is_special_needs_marker: object
+    is_queue: object
+    new_house_addresses: list
+    max_rank_by_room_count: dict
+    # new_apart_id (строкой) -> значение из new_aparts для квартир со статусом 1
+    approved: dict = field(default_factory=dict)
+    # Все квартиры из предложений семьи, с любым статусом
+    offered: set = field(default_factory=set)
+    # Отказные квартиры последнего предложения: dict(room_count, min_floor, max_floor)
+    declined: list = field(default_factory=list)
+
+
+@dataclass
+class RematchResult:
+    # affair_id -> new_aparts новой записи offer (одобренные + подобранные)
+    offers: dict = field(default_factory=dict)
+    matched: dict = field(default_factory=dict)
+    unmatched: dict = field(default_factory=dict)
+
+
+def _ge(value, bound):
+    # Сравнение SQL: с NULL условие не выполняется
+    return value is not None and bound is not None and value >= bound
+
+
+def _order_key(apart):
+    rank = apart["rank"]
+    area = (
+        apart["full_living_area"] + apart["living_area"]
+        if apart["full_living_area"] is not None and apart["living_area"] is not None
+        else None
+    )
+    return (rank is None, rank or 0, area is None, area or 0, apart["new_apart_id"])
+
+
+class RematchPool:
+    """Свободный ресурс по комнатностям в порядке выбора, с множеством занятых квартир."""
+
+    def __init__(self, resource, taken=()):
+        self.by_room_count = {}
+        for apart in sorted(resource, key=_order_key):
+            if apart["status_id"] in EXCLUDED_STATUSES or apart["status_id"] is None:
+                continue
+            self.by_room_count.setdefault(apart["room_count"], []).append(apart)
+        self.taken = set(taken)
+
+    def find(self, family, room_count, max_rank, floor_window=None):
+        """Первая подходящая квартира или None."""
+        if room_count is None:
+            return None
+        ranks = {rank for rank in (family.rank, max_rank) if rank is not None}
+        addresses = set(family.new_house_addresses or ())
+        for apart in self.by_room_count.get(room_count, ()):
+            new_apart_id = apart["new_apart_id"]
+            if new_apart_id in self.taken or new_apart_id in family.offered:
+                continue
+            if apart["rank"] not in ranks:
+                continue
+            if not (
+                _ge(apart["full_living_area"], family.full_living_area)
+                and _ge(apart["total_living_area"], family.total_living_area)
+                and _ge(apart["living_area"], family.living_area)
+            ):
+                continue
+            if apart["for_special_needs_marker"] is None or apart["for_special_needs_marker"] != family.is_special_needs_marker:
+                continue
+            if addresses and apart["house_address"] not in addresses:
+                continue
+            if floor_window is not None:
+                low, high = floor_window
+                if not (_ge(apart["floor"], low) and _ge(high, apart["floor"])):
+                    continue
+            return new_apart_id
+        return None
+
+
+def _floor_window(decline, max_rank):
+    # Как в посемейном цикле: верхняя граница окна - max_rank, а не max_floor
+    if decline["min_floor"] == 0 and max_rank == 0:
+        return None
+    return decline["min_floor"], max_rank
+
+
+def rematch_family(family, pool):
+    """Подбор взамен отказных квартир одной семьи; занятые квартиры отмечаются в pool."""
+    is_special_needs_marker = family.is_special_needs_marker
+    if is_special_needs_marker == 1 and family.is_queue == 1:
+        is_special_needs_marker = 0
+    # replace копирует поверхностно: offered остается общим множеством семьи
+    family_view = replace(family, is_special_needs_marker=is_special_needs_marker)
+
+    new_aparts = dict(family.approved)
+    found = []
+    for decline in family.declined:
+        max_rank = (family.max_rank_by_room_count or {}).get(str(decline["room_count"]))
+        window = _floor_window(decline, max_rank)
+        new_apart_id = None
+        if window is not None:
+            new_apart_id = pool.find(family_view, decline["room_count"], max_rank, window)
+        if new_apart_id is None:
+            new_apart_id = pool.find(family_view, decline["room_count"], max_rank)
+        if new_apart_id is None:
+            print("NO NEW APARTS")
+            continue
+        pool.taken.add(new_apart_id)
+        family.offered.add(new_apart_id)
+        new_aparts[str(new_apart_id)] = {"status_id": REMATCH_STATUS}
+        found.append(new_apart_id)
+    return new_aparts, found
+
+
+def rematch_families(apart_ids, families, pool):
+    """
+    Переподбор для apart_ids по порядку. families - affair_id -> RematchFamily
+    (семьи без предложений со статусом, отличным от 1, пропускаются, как в цикле).
+    """
+    result = RematchResult()
+    for apart_id in apart_ids:
+        family = families.get(apart_id)
+        if family is None:
+            print("NO APART INFO")
+            continue
+        new_aparts, found = rematch_family(family, pool)
+        if found:
+            result.offers[apart_id] = new_aparts
+            result.matched[apart_id] = len(found)
+            # Новое предложение становится последним: отказных в нем нет
+            family.declined = []
+        else:
+            result.unmatched[apart_id] = NO_APARTS_REASON
+    return result
@@ -1,9 +1,92 @@
 import json
 
 from fastapi import HTTPException  # Импортируем HTTPException для возврата ошибок
-from repository.database import project_managment_session
+from repository.database import db_connection, project_managment_session
+from service.offer_writer import insert_family_offers
+from service.rematch_engine import RematchFamily, RematchPool, rematch_families
 from sqlalchemy import text
 
+# Контекст всех семей запроса тремя запросами вместо трех запросов на семью.
+# max_rank по комнатности - как в rematch: по квартирам предложений семьи со статусом не 1
+REMATCH_FAMILIES_SQL = """
+    WITH unnst_join AS (
+        SELECT
+            oi.affair_id,
+            oi.new_apart_id,
+            na.room_count,
+            max(na.rank) AS max_rank
+        FROM public.offer_item oi
+        JOIN public.new_apart na USING (new_apart_id)
+        WHERE oi.affair_id = ANY(%(ids)s)
+            AND oi.status_id != 1
+        GROUP BY oi.affair_id, oi.new_apart_id, na.room_count
+    ),
+    build_max_rank_json AS (
+        SELECT affair_id, jsonb_object_agg(room_count::integer, max_rank) AS max_rank_by_room_count
+        FROM unnst_join
+        GROUP BY affair_id
+    )
+    SELECT
+        build_max_rank_json.affair_id,
+        rank,
+        full_living_area,
+        total_living_area,
+        living_area,
+        is_special_needs_marker,
+        is_queue,
+        new_house_addresses,
+        max_rank_by_room_count
+    FROM build_max_rank_json
+    JOIN old_apart USING (affair_id)
+    JOIN history USING (history_id)
+"""
+
+# Одобренные квартиры (статус 1) и все квартиры из предложений каждой семьи
+REMATCH_OFFERS_SQL = """
+    SELECT
+        o.affair_id,
+        jsonb_object_agg(e.key, e.value) FILTER (WHERE (e.value->>'status_id')::int = 1) AS approved_aparts,
+        array_agg(DISTINCT (e.key)::bigint) AS offered_aparts
+    FROM public.offer o, jsonb_each(o.new_aparts) e
+    WHERE o.affair_id = ANY(%(ids)s)
+    GROUP BY o.affair_id
+"""
+
+REMATCH_DECLINED_SQL = """
+    SELECT
+        ola.affair_id,
+        new_apart.room_count,
+        decline_reason.min_floor,
+        decline_reason.max_floor
+    FROM offer_last_apart ola
+    JOIN decline_reason USING (decline_reason_id)
+    JOIN new_apart USING (new_apart_id)
+    WHERE ola.affair_id = ANY(%(ids)s)
+        AND ola.status_id = 2
+"""
+
+# Свободный ресурс нужных комнатностей: нет в предложениях со статусом, отличным от отказа
+REMATCH_RESOURCE_SQL = """
+    SELECT
+        na.new_apart_id,
+        na.room_count,
+        na.full_living_area,
+        na.total_living_area,
+        na.living_area,
+        na.for_special_needs_marker,
+        na.house_address,
+        na.rank,
+        na.floor,
+        na.status_id
+    FROM public.new_apart na
+    WHERE na.room_count = ANY(%(room_counts)s)
+        AND na.status_id NOT IN (12, 13)
+        AND NOT EXISTS (
+            SELECT 1 FROM public.offer_item oi
+            WHERE oi.new_apart_id = na.new_apart_id AND oi.status_id != 2
+        )
+"""
+
 
 async def rematch(apart_ids):
     cant_offer_aparts_raise_ids = {}
@@ -77,9 +160,9 @@ async def rematch(apart_ids):
             # Check declined apartments
             check_declined_query = text("""
                 WITH declined_aparts AS (
-                    SELECT (key)::int as new_apart_id, (value->>'decline_reason_id')::int as decline_reason_id
-                    FROM offer, jsonb_each(new_aparts)
-                    WHERE (value->>'status_id')::int = 2 AND offer_id = (SELECT max(offer_id) FROM offer WHERE affair_id = :apart_id)
+                    SELECT new_apart_id, decline_reason_id
+                    FROM offer_last_apart
+                    WHERE affair_id = :apart_id AND status_id = 2
                 )
                 SELECT 
                     new_apart_id, 
@@ -213,4 +296,62 @@ async def rematch(apart_ids):
     if not matched_aparts and not unmatched_aparts:
         raise HTTPException(status_code=500, detail="Не удалось обработать ни одну заявку")
     
-    return data
\ No newline at end of file
+    return data
+
+
+def load_rematch_families(cursor, ids):
+    """affair_id -> RematchFamily для семей ids, у которых есть предложения."""
+    cursor.execute(REMATCH_FAMILIES_SQL, {"ids": ids})
+    families = {}
+    for affair_id, *values in cursor.fetchall():
+        families.setdefault(affair_id, RematchFamily(affair_id, *values))
+
+    cursor.execute(REMATCH_OFFERS_SQL, {"ids": ids})
+    for affair_id, approved_aparts, offered_aparts in cursor.fetchall():
+        if affair_id in families:
+            families[affair_id].approved = approved_aparts or {}
+            families[affair_id].offered = set(offered_aparts or ())
+
+    cursor.execute(REMATCH_DECLINED_SQL, {"ids": ids})
+    for affair_id, room_count, min_floor, max_floor in cursor.fetchall():
+        if affair_id in families:
+            families[affair_id].declined.append(
+                {"room_count": room_count, "min_floor": min_floor, "max_floor": max_floor}
+            )
+    return families
+
+
+def load_rematch_resource(cursor, room_counts):
+    if not room_counts:
+        return []
+    cursor.execute(REMATCH_RESOURCE_SQL, {"room_counts": room_counts})
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def rematch_batch(apart_ids):
+    """
+    То же, что rematch, но пакетно: контекст семей и ресурс загружаются один раз,
+    подбор идет в памяти (rematch_engine), все новые предложения пишутся одной транзакцией.
+    """
+    apart_ids = list(apart_ids)
+    with db_connection() as conn:
+        with conn.cursor() as cursor:
+            families = load_rematch_families(cursor, sorted(set(apart_ids)))
+            room_counts = sorted({
+                decline["room_count"]
+                for family in families.values()
+                for decline in family.declined
+                if decline["room_count"] is not None
+            })
+            pool = RematchPool(load_rematch_resource(cursor, room_counts))
+            result = rematch_families(apart_ids, families, pool)
+            insert_family_offers(cursor, result.offers)
+
+    total_matched = sum(result.matched.values())
+    print("\n=== ИТОГИ ПОДБОРА КВАРТИР ===")
+    print(f"Найдено квартир для {len(result.matched)} заявок: всего {total_matched} квартир")
+    print(f"Не найдено квартир для {len(result.unmatched)} заявок")
+    if not result.matched and not result.unmatched:
+        raise HTTPException(status_code=500, detail="Не удалось обработать ни одну заявку")
+    return [len(result.matched), len(result.unmatched)]
@@ -0,0 +1,92 @@
+"""
+Кэш готовых отчетов по (history_id, вид отчета).
+
+Рядом с файлом отчета лежит метка версии: сумма журнала data_change по истории, которая
+растет при фиксации любого изменения old_apart, new_apart и offer истории (в том числе рангов
+и статусов), и максимальные ранги ресурса по комнатностям - их отчет берет по всей
+new_apart. Пока метка совпадает, отчет отдается с диска без запросов
+к представлениям; если нет - пересобирается один раз, даже при нескольких одновременных запросах.
+"""
+import json
+import os
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+CACHE_DIR = Path("uploads") / "report_cache"
+
+_locks = defaultdict(threading.Lock)
+_locks_guard = threading.Lock()
+
+REPORT_STAMP_SQL = """
+    SELECT
+        (SELECT SUM(weight) FROM public.data_change WHERE history_id = %(history_id)s),
+        (SELECT string_agg(concat(room_count, ':', max_rank), ',' ORDER BY room_count)
+            FROM (
+                SELECT room_count, MAX(rank) AS max_rank
+                FROM public.new_apart
+                GROUP BY room_count
+            ) max_ranks)
+"""
+
+
+def report_stamp(cursor, history_id):
+    """Метка версии данных истории: сумма журнала изменений истории и максимальные ранги ресурса."""
+    cursor.execute(REPORT_STAMP_SQL, {"history_id": history_id})
+    return "|".join("" if value is None else str(value) for value in cursor.fetchone())
+
+
+def report_path(history_id, kind, cache_dir=CACHE_DIR):
+    return Path(cache_dir) / f"{kind}_{history_id}.xlsx"
+
+
+def _meta_path(path):
+    return path.with_suffix(".json")
+
+
+def cached_stamp(path):
+    try:
+        with open(_meta_path(path), encoding="utf-8") as file:
+            return json.load(file)["stamp"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _is_fresh(path, stamp):
+    return path.exists() and cached_stamp(path) == stamp
+
+
+def _lock(key):
+    with _locks_guard:
+        return _locks[key]
+
+
+def get_report(history_id, kind, stamp, render, cache_dir=CACHE_DIR):
+    """
+    Путь к отчету версии stamp. render(path) строит отчет в path, если в кэше его нет
+    или метка устарела. Файл и метка заменяются атомарно: читатели видят либо старую
+    версию, либо новую целиком.
+    """
+    path = report_path(history_id, kind, cache_dir)
+    if _is_fresh(path, stamp):
+        print("REPORT CACHE HIT", kind, history_id)
+        return path
+
+    with _lock((kind, history_id)):
+        # Пока ждали блокировку, отчет мог собрать другой запрос
+        if _is_fresh(path, stamp):
+            return path
+        print("REPORT CACHE MISS", kind, history_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(f"{path}.part")
+        render(tmp_path)
+        if not tmp_path.exists():
+            raise RuntimeError(f"Отчет {kind} для истории {history_id} не сформирован")
+        # Сначала убираем метку: при сбое между заменами старая метка не подтвердит новый файл
+        _meta_path(path).unlink(missing_ok=True)
+        os.replace(tmp_path, path)
+        tmp_meta = Path(f"{_meta_path(path)}.part")
+        with open(tmp_meta, "w", encoding="utf-8") as file:
+            json.dump({"stamp": stamp}, file)
+        os.replace(tmp_meta, _meta_path(path))
+    return path
@@ -0,0 +1,182 @@
+"""
+Отчет matching_result_{history_id}.xlsx: листы рангов с балансом и выгрузки представлений.
+
+Книга пишется xlsxwriter в режиме constant_memory: каждая строка уходит на диск, как только
+начата следующая, поэтому листы пишутся строго сверху вниз и в памяти нет всей книги.
+Стили задаются форматами на строку или колонку при записи, а не правкой ячеек после.
+"""
+from datetime import date, datetime
+
+import pandas as pd
+import xlsxwriter
+
+RANK_COLUMNS = ["Ранг", "Пот_ть", "Ресурс", "Баланс"]
+ROWS_PER_CHUNK = 10000
+
+STYLES = {
+    # Заголовок блока комнатности над таблицей ранга
+    "title": {"bold": True, "align": "center"},
+    # Шапка таблицы ранга
+    "rank_header": {"bold": True, "align": "center", "bg_color": "#FFFF99"},
+    # Шапка выгрузки представления (как у pandas.to_excel)
+    "header": {"bold": True, "border": 1, "align": "center", "valign": "top"},
+    "date": {"num_format": "yyyy-mm-dd"},
+    "datetime": {"num_format": "yyyy-mm-dd hh:mm:ss"},
+}
+
+
+def add_totals(df, max_rank_by_room_count, merge_zero_balance=False):
+    """
+    Склеивает подряд идущие ранги одной комнатности и добавляет строку "Итог".
+
+    Ранг присоединяется к предыдущему, если у предыдущего нет ресурса (или, при
+    merge_zero_balance, нулевой баланс) и ни один из них не последний ранг комнатности.
+    """
+    new_rows = []
+    previous_row = None
+    start_rank = None
+
+    for row in df.to_dict("records"):
+        current_rank = row["Ранг"]
+        max_rank = max_rank_by_room_count.get(row["room_count"], 0) + 1
+
+        if previous_row is None:
+            previous_row = row
+            start_rank = current_rank
+            continue
+
+        # Ранг предыдущей строки может быть уже диапазоном "start-end"
+        if isinstance(previous_row["Ранг"], str) and "-" in previous_row["Ранг"]:
+            previous_rank = int(previous_row["Ранг"].split("-")[-1])
+        else:
+            previous_rank = previous_row["Ранг"]
+
+        if (
+            (previous_row["Ресурс"] == 0 or (merge_zero_balance and previous_row["Баланс"] == 0))
+            and current_rank != max_rank
+            and previous_rank != max_rank
+        ):
+            previous_row["Пот_ть"] += row["Пот_ть"]
+            previous_row["Ресурс"] += row["Ресурс"]
+            previous_row["Баланс"] += row["Баланс"]
+            previous_row["Ранг"] = f"{start_rank}-{current_rank}"
+        else:
+            new_rows.append(previous_row)
+            previous_row = row
+            start_rank = current_rank
+
+    if previous_row is not None:
+        new_rows.append(previous_row)
+
+    df_new = pd.DataFrame(new_rows)
+    totals = pd.DataFrame(
+        [
+            {
+                "Ранг": "Итог",
+                "Пот_ть": df_new["Пот_ть"].sum(),
+                "Ресурс": df_new["Ресурс"].sum(),
+                "Баланс": df_new["Баланс"].sum(),
+            }
+        ]
+    )
+    return pd.concat([df_new, totals], ignore_index=True)
+
+
+def rank_balance(df_combined, old_id, new_id, max_rank_by_room_count, merge_zero_balance=False):
+    """
+    Потребность и ресурс по (комнатность, Ранг) с диапазонами и итогами по каждой комнатности.
+
+    df_combined - старые и новые квартиры вместе с колонкой "Ранг"; old_id/new_id - колонки
+    идентификаторов, по которым считаются старые и новые квартиры.
+    """
+    df = (
+        df_combined.groupby(["room_count", "Ранг"])
+        .agg(Пот_ть=(old_id, "count"), Ресурс=(new_id, "count"))
+        .reset_index()
+    )
+    df["Баланс"] = df["Ресурс"] - df["Пот_ть"]
+
+    result_data = []
+    for room in df["room_count"].unique():
+        grouped_df = add_totals(df[df["room_count"] == room], max_rank_by_room_count, merge_zero_balance)
+        grouped_df["room_count"] = room
+        result_data.append(grouped_df)
+    if not result_data:
+        return pd.DataFrame(columns=["room_count", *RANK_COLUMNS])
+    return pd.concat(result_data, ignore_index=True)
+
+
+def _cell_format(value, formats):
+    if isinstance(value, datetime):
+        return formats["datetime"]
+    if isinstance(value, date):
+        return formats["date"]
+    return None
+
+
+def _room_title(room):
+    return f"{int(room) if float(room).is_integer() else room} комната(ы)"
+
+
+class ReportWriter:
+    """Книга отчета. Используется как контекстный менеджер: файл дописывается при выходе."""
+
+    def __init__(self, path):
+        self.book = xlsxwriter.Workbook(
+            path, {"constant_memory": True, "remove_timezone": True, "strings_to_urls": False}
+        )
+        self.formats = {name: self.book.add_format(style) for name, style in STYLES.items()}
+        self.sheetnames = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.book.close()
+
+    def has_sheet(self, sheet_name):
+        return sheet_name in self.sheetnames
+
+    def _add_sheet(self, sheet_name):
+        self.sheetnames.append(sheet_name)
+        return self.book.add_worksheet(sheet_name)
+
+    def write_table(self, sheet_name, df):
+        """Лист с шапкой и строками df (без индекса)."""
+        ws = self._add_sheet(sheet_name)
+        ws.write_row(0, 0, [str(column) for column in df.columns], self.formats["header"])
+        row_number = 1
+        for start in range(0, len(df), ROWS_PER_CHUNK):
+            chunk = df.iloc[start:start + ROWS_PER_CHUNK]
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for row in chunk.itertuples(index=False, name=None):
+                for col, value in enumerate(row):
+                    if isinstance(value, (list, dict)):
+                        value = str(value)
+                    ws.write(row_number, col, value, _cell_format(value, self.formats))
+                row_number += 1
+
+    def write_rank_sheet(self, sheet_name, df_grouped):
+        """
+        Лист ранга: блоки комнатностей рядом слева направо, у каждого заголовок
+        "N комната(ы)", шапка RANK_COLUMNS и строки с итогом. Пишется построчно.
+        """
+        ws = self._add_sheet(sheet_name)
+        blocks = [
+            (room, df_grouped.loc[df_grouped["room_count"] == room, RANK_COLUMNS].astype(object).values.tolist())
+            for room in df_grouped["room_count"].unique()
+        ]
+        width = len(RANK_COLUMNS) + 1
+
+        for index, (room, _) in enumerate(blocks):
+            col = index * width
+            ws.merge_range(0, col, 0, col + len(RANK_COLUMNS) - 1, _room_title(room), self.formats["title"])
+        for index in range(len(blocks)):
+            ws.write_row(1, index * width, RANK_COLUMNS, self.formats["rank_header"])
+        for row_number in range(max((len(rows) for _, rows in blocks), default=0)):
+            for index, (_, rows) in enumerate(blocks):
+                if row_number < len(rows):
+                    ws.write_row(row_number + 2, index * width, rows[row_number])
@@ -0,0 +1,308 @@
+"""
+Снимок семей без действующих предложений и свободного ресурса в памяти процесса.
+
+Тяжелые выборки подбора (family_member с ARRAY_AGG возрастов, NOT IN по offer и old_apart,
+анти-join по offer_item) выполняются один раз без фильтров по адресам. Строки хранятся
+колонками (DataFrame на массивах NumPy) в порядке ORDER BY исходных запросов, с индексом
+позиций по house_address; срез по адресам, секциям, районам и дате берется из памяти,
+и порядок строк в нем тот же, что дал бы запрос с фильтрами.
+
+Снимок помечается суммой журнала data_change: триггеры добавляют в него строку в той же
+транзакции, что и любую запись в old_apart, new_apart, family_member и offer (offer_item
+пересчитывается из offer триггерами), поэтому сумма меняется ровно тогда, когда
+фиксируется изменение. updated_at и xmin для этого не годятся: updated_at выставляют
+не все записи, а MAX(xmin) пропускает транзакции, начатые раньше последней зафиксированной.
+Возраст членов семьи считается AGE() на дату загрузки, поэтому в версию входит и текущая
+дата. Пока версия совпадает, снимок отдается без запросов.
+
+Модуль не зависит от настроек: запросы выполняются через переданный курсор.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_STAMP_SQL = """
+    SELECT
+        (SELECT SUM(weight) FROM public.data_change),
+        CURRENT_DATE
+"""
+
+SNAPSHOT_LATEST_SQL = """
+    SELECT
+        (SELECT MAX(updated_at) FROM public.old_apart),
+        (SELECT MAX(updated_at) FROM public.new_apart)
+"""
+
+SNAPSHOT_FAMILY_SQL = """
+    SELECT
+        o.affair_id,
+        o.kpu_number,
+        o.district,
+        o.municipal_district,
+        o.room_count,
+        o.full_living_area,
+        o.total_living_area,
+        o.living_area,
+        o.is_special_needs_marker,
+        o.min_floor,
+        o.max_floor,
+        o.buying_date,
+        ARRAY_AGG(EXTRACT(YEAR FROM AGE(fm.date_of_birth))) AS ages,
+        count(o.affair_id) AS members_amount,
+        MAX(EXTRACT(YEAR FROM AGE(fm.date_of_birth::timestamp with time zone))) AS oldest,
+        o.is_queue,
+        o.queue_square,
+        o.rank,
+        o.house_address,
+        o.updated_at
+    FROM
+        old_apart o
+    LEFT JOIN
+        family_member fm ON o.kpu_number = fm.kpu_number
+    WHERE (o.rsm_status <> 'снято' or rsm_status is NULL)
+        AND o.affair_id NOT IN (
+            SELECT affair_id
+            FROM offer
+            where status_id not in (2, 14)
+        )
+        AND o.affair_id NOT IN (
+            SELECT affair_id
+            FROM old_apart
+            where status_id = 14
+        )
+    GROUP BY
+        o.affair_id,
+        o.kpu_number,
+        o.district,
+        o.municipal_district,
+        o.room_count,
+        o.full_living_area,
+        o.total_living_area,
+        o.living_area,
+        o.is_special_needs_marker,
+        o.min_floor,
+        o.max_floor,
+        o.buying_date,
+        o.is_queue,
+        o.queue_square
+    ORDER BY
+        o.room_count ASC,
+        (o.full_living_area + o.living_area + (COUNT(fm.family_member_id) / 3.9)) ASC,
+        MAX(EXTRACT(YEAR FROM AGE(fm.date_of_birth::timestamp with time zone))) DESC,
+        o.living_area ASC,
+        o.full_living_area ASC,
+        o.total_living_area ASC;
+"""
+
+SNAPSHOT_NEW_APART_SQL = """
+    SELECT
+        na.new_apart_id,
+        na.district,
+        na.municipal_district,
+        na.house_address,
+        na.apart_number,
+        na.floor,
+        na.room_count,
+        na.full_living_area,
+        na.total_living_area,
+        na.living_area,
+        na.for_special_needs_marker,
+        na.rank,
+        na.updated_at
+    FROM
+        public.new_apart na
+    WHERE
+        NOT EXISTS (
+            SELECT 1
+            FROM public.offer_item oi
+            WHERE
+            oi.new_apart_id = na.new_apart_id
+            AND oi.status_id != 2
+        )
+        AND (na.status_id NOT IN (12, 13, 15) OR na.status_id IS NULL)
+    ORDER BY room_count ASC, (full_living_area + living_area), floor, living_area ASC, full_living_area ASC, total_living_area ASC
+"""
+
+FAMILY_COLUMNS = [
+    "affair_id", "kpu_number", "district", "municipal_district", "room_count", "full_living_area",
+    "total_living_area", "living_area", "is_special_needs_marker", "min_floor", "max_floor", "buying_date",
+    "ages", "members_amount", "oldest", "is_queue", "queue_square",
+]
+NEW_APART_COLUMNS = [
+    "new_apart_id", "district", "municipal_district", "house_address", "apart_number", "floor",
+    "room_count", "full_living_area", "total_living_area", "living_area", "for_special_needs_marker",
+]
+SNAPSHOT_FAMILY_COLUMNS = FAMILY_COLUMNS + ["rank", "house_address", "updated_at"]
+SNAPSHOT_NEW_APART_COLUMNS = NEW_APART_COLUMNS + ["rank", "updated_at"]
+
+
+def normalize_new_addresses(new_selected_addresses):
+    """Адреса новых домов приходят и списком, и списком в списке - разворачиваем."""
+    if isinstance(new_selected_addresses, list) and len(new_selected_addresses) > 0 and isinstance(new_selected_addresses[0], list):
+        return new_selected_addresses[0]
+    return new_selected_addresses
+
+
+def _section_range(section_data):
+    # Диапазон секции как объект {"from", "to"} или массив; некорректный - None
+    if not isinstance(section_data, dict):
+        return None
+    range_data = section_data.get('range', {})
+    try:
+        if isinstance(range_data, dict):
+            return int(range_data.get('from', 0)), int(range_data.get('to', 0))
+        if isinstance(range_data, list) and len(range_data) >= 2:
+            return int(range_data[0]), int(range_data[1])
+    except (ValueError, TypeError):
+        return None
+    return None
+
+
+def address_ranges(new_selected_addresses):
+    """
+    Адреса новых домов с диапазонами квартир: список (адрес, [(от, до), ...] или None - весь дом).
+    Не словари пропускаются; адрес, у которого все секции некорректны, берется целиком.
+    """
+    conditions = []
+    for address_data in normalize_new_addresses(new_selected_addresses) or []:
+        if not isinstance(address_data, dict):
+            continue
+        ranges = [_section_range(section) for section in address_data.get('sections', []) or []]
+        ranges = [section_range for section_range in ranges if section_range is not None]
+        conditions.append((address_data.get('address'), ranges or None))
+    return conditions
+
+
+def _with_ranks(df, id_column, df_ranked):
+    ranks = df_ranked.set_index(id_column)["rank"]
+    df = df.copy()
+    ranked = df[id_column].isin(ranks.index)
+    df["rank"] = df["rank"].astype(object)
+    df.loc[ranked, "rank"] = df.loc[ranked, id_column].map(ranks).to_numpy()
+    return df
+
+
+def _positions_by_address(df):
+    return {address: positions for address, positions in df.groupby("house_address", sort=False).indices.items()}
+
+
+class Snapshot:
+    """Семьи и ресурс одной версии данных; срезы не меняют снимок."""
+
+    def __init__(self, stamp, df_old_apart, df_new_apart, latest=(None, None)):
+        self.stamp = stamp
+        self.df_old_apart = df_old_apart.reset_index(drop=True)
+        self.df_new_apart = df_new_apart.reset_index(drop=True)
+        # MAX(updated_at) по всей таблице - для выборки последней загрузки (date)
+        self.latest_old, self.latest_new = latest
+        self._old_by_address = _positions_by_address(self.df_old_apart)
+        self._new_by_address = _positions_by_address(self.df_new_apart)
+
+    @staticmethod
+    def _take(df, positions, districts, areas, latest, date):
+        mask = np.zeros(len(df), dtype=bool)
+        mask[positions] = True
+        if districts:
+            mask &= df["district"].isin(districts).to_numpy()
+        if areas:
+            mask &= df["municipal_district"].isin(areas).to_numpy()
+        if date:
+            mask &= (df["updated_at"] == latest).to_numpy()
+        return df[mask].reset_index(drop=True)
+
+    def families(self, addresses=None, districts=None, areas=None, date=False, columns=FAMILY_COLUMNS):
+        """Семьи по адресам старых домов (пустой список - все), районам и округам."""
+        df = self.df_old_apart
+        if addresses:
+            positions = [self._old_by_address[address] for address in set(addresses) if address in self._old_by_address]
+            positions = np.concatenate(positions) if positions else np.array([], dtype=int)
+        else:
+            positions = np.arange(len(df))
+        return self._take(df, positions, districts, areas, self.latest_old, date)[columns]
+
+    def new_aparts(self, new_selected_addresses=None, districts=None, areas=None, date=False, columns=NEW_APART_COLUMNS):
+        """Ресурс по адресам новых домов с диапазонами квартир по секциям, районам и округам."""
+        df = self.df_new_apart
+        conditions = address_ranges(new_selected_addresses)
+        if not conditions:
+            positions = np.arange(len(df))
+        else:
+            apart_numbers = df["apart_number"].to_numpy(dtype=float, na_value=np.nan)
+            selected = []
+            for address, ranges in conditions:
+                address_positions = self._new_by_address.get(address)
+                if address_positions is None:
+                    continue
+                if ranges is None:
+                    selected.append(address_positions)
+                    continue
+                numbers = apart_numbers[address_positions]
+                in_ranges = np.zeros(len(address_positions), dtype=bool)
+                for min_apart, max_apart in ranges:
+                    in_ranges |= (numbers >= min_apart) & (numbers <= max_apart)
+                selected.append(address_positions[in_ranges])
+            positions = np.concatenate(selected) if selected else np.array([], dtype=int)
+        return self._take(df, positions, districts, areas, self.latest_new, date)[columns]
+
+    def with_ranks(self, df_old_apart, df_new_apart):
+        """Снимок с рангами, записанными в базу после ранжирования (как их прочитал бы запрос)."""
+        return Snapshot(
+            self.stamp,
+            _with_ranks(self.df_old_apart, "affair_id", df_old_apart),
+            _with_ranks(self.df_new_apart, "new_apart_id", df_new_apart),
+            (self.latest_old, self.latest_new),
+        )
+
+    def without_offers(self, offers):
+        """Снимок после записи предложений (affair_id, new_apart_id): семьи и квартиры выбывают."""
+        affair_ids = {affair_id for affair_id, _ in offers}
+        new_apart_ids = {new_apart_id for _, new_apart_id in offers}
+        return Snapshot(
+            self.stamp,
+            self.df_old_apart[~self.df_old_apart["affair_id"].isin(affair_ids)],
+            self.df_new_apart[~self.df_new_apart["new_apart_id"].isin(new_apart_ids)],
+            (self.latest_old, self.latest_new),
+        )
+
+
+def snapshot_stamp(cursor):
+    """Метка снимка: сумма сжатого журнала data_change (несколько строк на историю) и текущая дата."""
+    cursor.execute(SNAPSHOT_STAMP_SQL)
+    return "|".join("" if value is None else str(value) for value in cursor.fetchone())
+
+
+def load_snapshot(cursor, stamp):
+    cursor.execute(SNAPSHOT_FAMILY_SQL)
+    df_old_apart = pd.DataFrame(cursor.fetchall(), columns=SNAPSHOT_FAMILY_COLUMNS)
+    cursor.execute(SNAPSHOT_NEW_APART_SQL)
+    df_new_apart = pd.DataFrame(cursor.fetchall(), columns=SNAPSHOT_NEW_APART_COLUMNS)
+    cursor.execute(SNAPSHOT_LATEST_SQL)
+    latest = cursor.fetchone()
+    return Snapshot(stamp, df_old_apart, df_new_apart, latest)
+
+
+class SnapshotCache:
+    """Последний снимок процесса; при смене версии перечитывается один раз, даже при одновременных запросах."""
+
+    def __init__(self, load=load_snapshot, stamp=snapshot_stamp):
+        self._load = load
+        self._stamp = stamp
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def get(self, cursor):
+        stamp = self._stamp(cursor)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.stamp == stamp:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot.stamp != stamp:
+                self._snapshot = self._load(cursor, stamp)
+            return self._snapshot
+
+    def clear(self):
+        self._snapshot = None
+
+
+snapshot_cache = SnapshotCache()
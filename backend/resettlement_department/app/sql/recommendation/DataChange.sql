@@ -0,0 +1,160 @@
+-- Журнал изменений данных подбора для меток кэшей отчетов, снимка подбора и пересчета рангов.
+-- Триггеры уровня оператора добавляют строку (txid, history_id) на транзакцию и историю:
+-- ключ содержит txid, поэтому вставки разных транзакций не конфликтуют и не ждут друг друга.
+-- Строка становится видна при фиксации, откат ее убирает, поэтому SUM(weight) по истории
+-- (или по всей таблице) растет ровно тогда, когда фиксируется изменение. history_id IS NULL -
+-- строки без истории и family_member. Сжатие (service/data_change.py) сливает старые строки
+-- истории в одну, сохраняя сумму.
+CREATE TABLE IF NOT EXISTS public.data_change (
+    txid xid8 NOT NULL,
+    history_id integer,
+    weight bigint NOT NULL DEFAULT 1
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS data_change_txid_history_idx ON public.data_change (txid, (COALESCE(history_id, -1)));
+CREATE INDEX IF NOT EXISTS data_change_history_id_idx ON public.data_change (history_id);
+
+-- Счетчик history_version заменен журналом: строки счетчика блокировались до фиксации
+DROP TRIGGER IF EXISTS old_apart_history_version_insert ON public.old_apart;
+DROP TRIGGER IF EXISTS old_apart_history_version_update ON public.old_apart;
+DROP TRIGGER IF EXISTS old_apart_history_version_delete ON public.old_apart;
+DROP TRIGGER IF EXISTS new_apart_history_version_insert ON public.new_apart;
+DROP TRIGGER IF EXISTS new_apart_history_version_update ON public.new_apart;
+DROP TRIGGER IF EXISTS new_apart_history_version_delete ON public.new_apart;
+DROP TRIGGER IF EXISTS offer_history_version_insert ON public.offer;
+DROP TRIGGER IF EXISTS offer_history_version_update ON public.offer;
+DROP TRIGGER IF EXISTS offer_history_version_delete ON public.offer;
+DROP TRIGGER IF EXISTS family_member_history_version ON public.family_member;
+DROP FUNCTION IF EXISTS public.sync_apart_history_version();
+DROP FUNCTION IF EXISTS public.sync_offer_history_version();
+DROP FUNCTION IF EXISTS public.sync_family_member_history_version();
+DROP FUNCTION IF EXISTS public.bump_history_version(integer[]);
+DROP TABLE IF EXISTS public.history_version;
+
+CREATE OR REPLACE FUNCTION public.record_data_change(history_ids integer[])
+ RETURNS void
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    INSERT INTO public.data_change (txid, history_id, weight)
+    SELECT DISTINCT pg_current_xact_id(), history_id, 1
+    FROM unnest(history_ids) AS history_id
+    ON CONFLICT (txid, (COALESCE(history_id, -1))) DO NOTHING;
+END;
+$function$;
+
+-- Триггер уровня оператора на old_apart и new_apart: одна запись на все затронутые истории
+CREATE OR REPLACE FUNCTION public.sync_apart_data_change()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM public.record_data_change(ARRAY(SELECT history_id FROM new_rows));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM public.record_data_change(ARRAY(
+            SELECT history_id FROM new_rows
+            UNION
+            SELECT history_id FROM old_rows
+        ));
+    ELSE
+        PERFORM public.record_data_change(ARRAY(SELECT history_id FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$function$;
+
+-- offer не хранит history_id: история берется по семье из old_apart
+CREATE OR REPLACE FUNCTION public.sync_offer_data_change()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM public.record_data_change(ARRAY(
+            SELECT oa.history_id FROM new_rows LEFT JOIN public.old_apart oa ON oa.affair_id = new_rows.affair_id
+        ));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM public.record_data_change(ARRAY(
+            SELECT oa.history_id
+            FROM (SELECT affair_id FROM new_rows UNION SELECT affair_id FROM old_rows) changed
+            LEFT JOIN public.old_apart oa ON oa.affair_id = changed.affair_id
+        ));
+    ELSE
+        PERFORM public.record_data_change(ARRAY(
+            SELECT oa.history_id FROM old_rows LEFT JOIN public.old_apart oa ON oa.affair_id = old_rows.affair_id
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$function$;
+
+-- family_member связан с семьями по kpu_number и читается только снимком подбора
+CREATE OR REPLACE FUNCTION public.sync_family_member_data_change()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    PERFORM public.record_data_change(ARRAY[NULL]::integer[]);
+    RETURN NULL;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS old_apart_data_change_insert ON public.old_apart;
+CREATE TRIGGER old_apart_data_change_insert
+    AFTER INSERT ON public.old_apart
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_apart_data_change();
+
+DROP TRIGGER IF EXISTS old_apart_data_change_update ON public.old_apart;
+CREATE TRIGGER old_apart_data_change_update
+    AFTER UPDATE ON public.old_apart
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_apart_data_change();
+
+DROP TRIGGER IF EXISTS old_apart_data_change_delete ON public.old_apart;
+CREATE TRIGGER old_apart_data_change_delete
+    AFTER DELETE ON public.old_apart
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_apart_data_change();
+
+DROP TRIGGER IF EXISTS new_apart_data_change_insert ON public.new_apart;
+CREATE TRIGGER new_apart_data_change_insert
+    AFTER INSERT ON public.new_apart
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_apart_data_change();
+
+DROP TRIGGER IF EXISTS new_apart_data_change_update ON public.new_apart;
+CREATE TRIGGER new_apart_data_change_update
+    AFTER UPDATE ON public.new_apart
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_apart_data_change();
+
+DROP TRIGGER IF EXISTS new_apart_data_change_delete ON public.new_apart;
+CREATE TRIGGER new_apart_data_change_delete
+    AFTER DELETE ON public.new_apart
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_apart_data_change();
+
+DROP TRIGGER IF EXISTS offer_data_change_insert ON public.offer;
+CREATE TRIGGER offer_data_change_insert
+    AFTER INSERT ON public.offer
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_offer_data_change();
+
+DROP TRIGGER IF EXISTS offer_data_change_update ON public.offer;
+CREATE TRIGGER offer_data_change_update
+    AFTER UPDATE ON public.offer
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_offer_data_change();
+
+DROP TRIGGER IF EXISTS offer_data_change_delete ON public.offer;
+CREATE TRIGGER offer_data_change_delete
+    AFTER DELETE ON public.offer
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_offer_data_change();
+
+DROP TRIGGER IF EXISTS family_member_data_change ON public.family_member;
+CREATE TRIGGER family_member_data_change
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.family_member
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_family_member_data_change();
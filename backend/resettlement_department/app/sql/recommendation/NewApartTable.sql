@@ -1,18 +1,7 @@
-WITH clr_dt AS (
-    SELECT 
-        offer_id,
-        affair_id, 
-        (KEY)::bigint AS new_apart_id, 
-        sentence_date, 
-        answer_date, 
-		created_at,
-		updated_at,
-        (VALUE->'status_id')::int AS status_id 
-    FROM 
-        offer, 
-        jsonb_each(new_aparts)
-),
-ranked_apartments AS (
+-- Последнее предложение и число предложений по квартире берутся из offer_item по индексу
+-- (new_apart_id, offer_id DESC): без разворота offer.new_aparts и оконных функций условие
+-- курсора и LIMIT применяются к строкам new_apart, а подзапросы считаются только для них.
+WITH ranked_apartments AS (
     SELECT 
         o.offer_id,
         o.created_at::DATE,
@@ -30,19 +19,27 @@ ranked_apartments AS (
         CASE WHEN na.notes IS NULL THEN na.rsm_notes ELSE na.rsm_notes || ';' || na.notes END AS notes,
         na.new_apart_id,
         s.status AS status,
-        is_private,
-        for_special_needs_marker,
-        ROW_NUMBER() OVER (
-            PARTITION BY na.new_apart_id 
-            ORDER BY o.sentence_date DESC, o.answer_date DESC, o.created_at DESC
-        ) AS rn,
-        COUNT(o.affair_id) OVER (PARTITION BY na.new_apart_id) AS selection_count, 
-        rank,
-        rsm_apart_id
+        na.is_private,
+        na.for_special_needs_marker,
+        1 AS rn,
+        sc.selection_count,
+        na.rank,
+        na.rsm_apart_id
     FROM 
         new_apart na
-    LEFT JOIN 
-        clr_dt as o on o.new_apart_id = na.new_apart_id
+    LEFT JOIN LATERAL (
+        SELECT offer.offer_id, offer.created_at
+        FROM offer_item oi
+        JOIN offer ON offer.offer_id = oi.offer_id
+        WHERE oi.new_apart_id = na.new_apart_id
+        ORDER BY offer.sentence_date DESC, offer.answer_date DESC, offer.created_at DESC, offer.offer_id DESC
+        LIMIT 1
+    ) o ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT COUNT(oi.affair_id) AS selection_count
+        FROM offer_item oi
+        WHERE oi.new_apart_id = na.new_apart_id
+    ) sc ON TRUE
     LEFT JOIN 
         status s ON na.status_id = s.status_id
 )
@@ -0,0 +1,58 @@
+-- Квартиры всех предложений построчно: offer.new_aparts остается источником истины,
+-- offer_item поддерживается триггерами и позволяет искать по new_apart_id по индексу.
+CREATE TABLE IF NOT EXISTS public.offer_item (
+    offer_id bigint NOT NULL,
+    affair_id bigint,
+    new_apart_id bigint NOT NULL,
+    status_id int,
+    decline_reason_id int,
+    PRIMARY KEY (offer_id, new_apart_id)
+);
+
+CREATE INDEX IF NOT EXISTS offer_item_affair_id_idx ON public.offer_item (affair_id, offer_id);
+CREATE INDEX IF NOT EXISTS offer_item_new_apart_id_idx ON public.offer_item (new_apart_id, offer_id DESC);
+-- Занятые квартиры (любой статус, кроме отказа): антиджойн при подборе
+CREATE INDEX IF NOT EXISTS offer_item_taken_idx ON public.offer_item (new_apart_id) WHERE status_id != 2;
+
+CREATE OR REPLACE FUNCTION public.sync_offer_item()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM public.offer_item oi
+        USING old_offer
+        WHERE oi.offer_id = old_offer.offer_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO public.offer_item (offer_id, affair_id, new_apart_id, status_id, decline_reason_id)
+        SELECT
+            new_offer.offer_id,
+            new_offer.affair_id,
+            (key)::bigint,
+            (value->>'status_id')::int,
+            (value->>'decline_reason_id')::int
+        FROM new_offer,
+        jsonb_each(new_offer.new_aparts);
+    END IF;
+    RETURN NULL;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS sync_offer_item_insert ON public.offer;
+CREATE TRIGGER sync_offer_item_insert
+    AFTER INSERT ON public.offer
+    REFERENCING NEW TABLE AS new_offer
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_offer_item();
+
+DROP TRIGGER IF EXISTS sync_offer_item_update ON public.offer;
+CREATE TRIGGER sync_offer_item_update
+    AFTER UPDATE ON public.offer
+    REFERENCING OLD TABLE AS old_offer NEW TABLE AS new_offer
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_offer_item();
+
+DROP TRIGGER IF EXISTS sync_offer_item_delete ON public.offer;
+CREATE TRIGGER sync_offer_item_delete
+    AFTER DELETE ON public.offer
+    REFERENCING OLD TABLE AS old_offer
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_offer_item();
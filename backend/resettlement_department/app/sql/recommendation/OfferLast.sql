@@ -0,0 +1,96 @@
+-- Проекция последнего предложения по каждой семье.
+-- offer_last: предложение, которое показывается в таблице (по sentence_date, answer_date, created_at),
+-- max_offer_id (последняя запись offer семьи) и число предложений.
+-- offer_last_apart: квартиры из new_aparts предложения max_offer_id построчно.
+CREATE TABLE IF NOT EXISTS public.offer_last (
+    affair_id bigint PRIMARY KEY,
+    offer_id bigint NOT NULL,
+    max_offer_id bigint NOT NULL,
+    selection_count int NOT NULL,
+    created_at timestamp,
+    updated_at timestamp NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS public.offer_last_apart (
+    affair_id bigint NOT NULL,
+    new_apart_id bigint NOT NULL,
+    offer_id bigint NOT NULL,
+    status_id int,
+    decline_reason_id int,
+    PRIMARY KEY (affair_id, new_apart_id)
+);
+
+CREATE INDEX IF NOT EXISTS offer_last_apart_new_apart_id_idx ON public.offer_last_apart (new_apart_id);
+
+CREATE OR REPLACE FUNCTION public.refresh_offer_last(affair_ids bigint[])
+ RETURNS void
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    DELETE FROM public.offer_last_apart WHERE affair_id = ANY(affair_ids);
+    DELETE FROM public.offer_last WHERE affair_id = ANY(affair_ids);
+
+    INSERT INTO public.offer_last (affair_id, offer_id, max_offer_id, selection_count, created_at)
+    SELECT DISTINCT ON (affair_id)
+        affair_id,
+        offer_id,
+        MAX(offer_id) OVER family,
+        COUNT(*) OVER family,
+        created_at
+    FROM public.offer
+    WHERE affair_id = ANY(affair_ids)
+    WINDOW family AS (PARTITION BY affair_id)
+    ORDER BY affair_id, sentence_date DESC, answer_date DESC, created_at DESC, offer_id DESC;
+
+    INSERT INTO public.offer_last_apart (affair_id, new_apart_id, offer_id, status_id, decline_reason_id)
+    SELECT
+        ol.affair_id,
+        (key)::bigint,
+        ol.max_offer_id,
+        (value->>'status_id')::int,
+        (value->>'decline_reason_id')::int
+    FROM public.offer_last ol
+    JOIN public.offer o ON o.offer_id = ol.max_offer_id,
+    jsonb_each(o.new_aparts)
+    WHERE ol.affair_id = ANY(affair_ids);
+END;
+$function$;
+
+-- Триггер уровня оператора: одно обновление проекции на все семьи, затронутые INSERT/UPDATE/DELETE
+CREATE OR REPLACE FUNCTION public.sync_offer_last()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM public.refresh_offer_last(ARRAY(SELECT DISTINCT affair_id FROM new_offer WHERE affair_id IS NOT NULL));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM public.refresh_offer_last(ARRAY(
+            SELECT affair_id FROM new_offer WHERE affair_id IS NOT NULL
+            UNION
+            SELECT affair_id FROM old_offer WHERE affair_id IS NOT NULL
+        ));
+    ELSE
+        PERFORM public.refresh_offer_last(ARRAY(SELECT DISTINCT affair_id FROM old_offer WHERE affair_id IS NOT NULL));
+    END IF;
+    RETURN NULL;
+END;
+$function$;
+
+DROP TRIGGER IF EXISTS sync_offer_last_insert ON public.offer;
+CREATE TRIGGER sync_offer_last_insert
+    AFTER INSERT ON public.offer
+    REFERENCING NEW TABLE AS new_offer
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_offer_last();
+
+DROP TRIGGER IF EXISTS sync_offer_last_update ON public.offer;
+CREATE TRIGGER sync_offer_last_update
+    AFTER UPDATE ON public.offer
+    REFERENCING OLD TABLE AS old_offer NEW TABLE AS new_offer
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_offer_last();
+
+DROP TRIGGER IF EXISTS sync_offer_last_delete ON public.offer;
+CREATE TRIGGER sync_offer_last_delete
+    AFTER DELETE ON public.offer
+    REFERENCING OLD TABLE AS old_offer
+    FOR EACH STATEMENT EXECUTE FUNCTION public.sync_offer_last();
@@ -1,7 +1,7 @@
 WITH ranked_apartments AS (
     SELECT
-        offer_id,
-        o.created_at::DATE,
+        ol.offer_id,
+        ol.created_at::DATE,
         oa.house_address,
         oa.apart_number,
         oa.district,
@@ -18,8 +18,8 @@ WITH ranked_apartments AS (
         oa.affair_id,
         oa.is_queue,
         oa.is_special_needs_marker,
-        ROW_NUMBER() OVER (PARTITION BY oa.affair_id ORDER BY o.sentence_date DESC, o.answer_date DESC, o.created_at DESC) AS rn,
-        COUNT(o.affair_id) OVER (PARTITION BY oa.affair_id) AS selection_count,
+        1 AS rn,
+        COALESCE(ol.selection_count, 0) AS selection_count,
         oa.people_v_dele,
         oa.rank,
 		apartments_old_temp.classificator,
@@ -37,7 +37,7 @@ WITH ranked_apartments AS (
     FROM
         old_apart oa
     LEFT JOIN
-        offer o USING (affair_id)
+        offer_last ol USING (affair_id)
     LEFT JOIN
         status ON oa.status_id = status.status_id
 	LEFT JOIN renovation.apartments_old_temp using (affair_id)
@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS public.rank_breakpoint (
+    history_id integer NOT NULL,
+    room_count integer NOT NULL,
+    breakpoints bigint[] NOT NULL,
+    fingerprint varchar(40) NOT NULL,
+    updated_at timestamptz DEFAULT now(),
+    PRIMARY KEY (history_id, room_count)
+);
+
+-- Квартиры группы, ранг которых выставил подбор (ранг семьи или min_rank - 1)
+ALTER TABLE public.rank_breakpoint ADD COLUMN IF NOT EXISTS pinned bigint[] NOT NULL DEFAULT '{}';
+-- Сумма журнала data_change истории на момент последнего пересчета: истории без изменений не читаются
+ALTER TABLE public.rank_breakpoint ADD COLUMN IF NOT EXISTS history_version bigint;
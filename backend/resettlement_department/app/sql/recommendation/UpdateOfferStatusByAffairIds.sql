@@ -1,12 +1,11 @@
 WITH last_offers AS (
-    SELECT affair_id, MAX(offer_id) AS last_offer_id
-    FROM offer
+    SELECT affair_id, max_offer_id AS last_offer_id
+    FROM offer_last
     WHERE affair_id IN (
         SELECT affair_id 
         FROM old_apart 
         WHERE affair_id = ANY(%s::int[])
     )
-    GROUP BY affair_id
 ),
 updated_offers AS (
     UPDATE offer
@@ -2,14 +2,13 @@ WITH hstr_id AS (
     SELECT (%s)::int AS hs_id  
 ),
 last_offers AS (
-    SELECT affair_id, MAX(offer_id) AS last_offer_id
-    FROM offer
+    SELECT affair_id, max_offer_id AS last_offer_id
+    FROM offer_last
     WHERE affair_id IN (
         SELECT affair_id 
         FROM old_apart 
         WHERE history_id = (SELECT hs_id FROM hstr_id)
     )
-    GROUP BY affair_id
 ),
 updated_offers AS (
     UPDATE offer
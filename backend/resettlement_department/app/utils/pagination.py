@@ -0,0 +1,124 @@
+"""Keyset-пагинация поверх запросов таблиц квартир: курсор по (ключ сортировки, id)."""
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import text
+
+MAX_PAGE_SIZE = 500
+
+
+def _encode_value(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return ["datetime", value.isoformat()]
+    if isinstance(value, date):
+        return ["date", value.isoformat()]
+    if isinstance(value, Decimal):
+        return ["decimal", str(value)]
+    return ["value", value]
+
+
+def _decode_value(value):
+    if value is None:
+        return None
+    kind, raw = value
+    if kind == "datetime":
+        return datetime.fromisoformat(raw)
+    if kind == "date":
+        return date.fromisoformat(raw)
+    if kind == "decimal":
+        return Decimal(raw)
+    return raw
+
+
+def encode_cursor(sort_value, row_id):
+    payload = json.dumps([_encode_value(sort_value), row_id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return _decode_value(sort_value), int(row_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def build_page_query(query, where_clause, params, id_column, sort_by=None, sort_order="asc", cursor=None, page_size=None):
+    """
+    Добавляет к запросу условие курсора, ORDER BY и LIMIT.
+
+    Сортировка всегда (sort_by, id_column) с NULLS LAST, поэтому порядок однозначный и
+    следующая страница начинается строго после последней строки предыдущей.
+    sort_by должен быть проверен вызывающим по белому списку колонок.
+    Возвращает запрос и параметры; LIMIT на одну строку больше страницы,
+    чтобы понять, есть ли следующая.
+    """
+    if sort_order not in ("asc", "desc"):
+        raise ValueError(f"Invalid sort order: {sort_order}")
+    sort_by = sort_by or id_column
+    params = dict(params)
+    conditions = [where_clause]
+    compare = ">" if sort_order == "asc" else "<"
+
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        params["cursor_id"] = row_id
+        if sort_by == id_column:
+            conditions.append(f"{id_column} {compare} :cursor_id")
+        elif sort_value is None:
+            conditions.append(f"({sort_by} IS NULL AND {id_column} {compare} :cursor_id)")
+        else:
+            params["cursor_value"] = sort_value
+            conditions.append(
+                f"({sort_by} {compare} :cursor_value"
+                f" OR ({sort_by} = :cursor_value AND {id_column} {compare} :cursor_id)"
+                f" OR {sort_by} IS NULL)"
+            )
+
+    order = sort_order.upper()
+    page_query = f"{query} WHERE {' AND '.join(conditions)} ORDER BY {sort_by} {order} NULLS LAST"
+    if sort_by != id_column:
+        page_query += f", {id_column} {order}"
+    if page_size is not None:
+        params["page_limit"] = min(page_size, MAX_PAGE_SIZE) + 1
+        page_query += " LIMIT :page_limit"
+    return page_query, params
+
+
+def make_page(rows, id_column, sort_by, page_size, total_estimate=None):
+    """Страница ответа: строки, курсор следующей страницы (None на последней) и оценка общего числа."""
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    items = rows[:page_size]
+    next_cursor = None
+    if len(rows) > page_size:
+        last = items[-1]
+        next_cursor = encode_cursor(last[sort_by or id_column], last[id_column])
+    return {"items": items, "next_cursor": next_cursor, "total_estimate": total_estimate}
+
+
+async def estimate_count(session, query, params):
+    """Оценка числа строк по плану запроса, без его выполнения."""
+    result = await session.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params)
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def fetch_page(
+    session, query, where_clause, params, id_column, sort_by=None, sort_order="asc", cursor=None, page_size=None, with_total=False
+):
+    """Строки запроса с серверной сортировкой; при page_size - страница с курсором следующей."""
+    page_query, page_params = build_page_query(
+        query, where_clause, params, id_column, sort_by=sort_by, sort_order=sort_order, cursor=cursor, page_size=page_size
+    )
+    result = await session.execute(text(page_query), page_params)
+    rows = [row._mapping for row in result]
+    if page_size is None:
+        return rows
+    total_estimate = await estimate_count(session, f"{query} WHERE {where_clause}", params) if with_total else None
+    return make_page(rows, id_column, sort_by, page_size, total_estimate)
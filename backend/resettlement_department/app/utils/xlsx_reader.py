@@ -0,0 +1,77 @@
+"""
+Потоковое чтение XLSX.
+
+Книга открывается один раз в режиме read_only: openpyxl не строит дерево всех ячеек,
+строки листа читаются по порядку и отдаются пачками DataFrame по batch_size строк.
+Значения приводятся так же, как в pd.read_excel: целые числа из float становятся int,
+пустые ячейки - NaN, пустые строки в конце листа отбрасываются.
+"""
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+BATCH_SIZE = 5000
+
+
+@contextmanager
+def open_workbook(source):
+    """source - путь или файловый объект. Книгу в режиме read_only нужно закрывать явно."""
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        yield workbook
+    finally:
+        workbook.close()
+
+
+def _cell(value):
+    if value is None:
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _columns(header):
+    return [f"Unnamed: {index}" if name is None else name for index, name in enumerate(header)]
+
+
+def _frame(rows, columns):
+    return pd.DataFrame.from_records(rows, columns=columns).infer_objects()
+
+
+def iter_sheet(workbook, sheet_name=None, batch_size=BATCH_SIZE):
+    """
+    Строки листа (по умолчанию первого) пачками DataFrame; первая строка - заголовок.
+
+    Всегда отдает хотя бы одну пачку, для пустого листа - пустую с колонками заголовка.
+    """
+    sheet = workbook[sheet_name] if sheet_name is not None else workbook.worksheets[0]
+    rows = sheet.iter_rows(values_only=True)
+    columns = _columns(next(rows, ()))
+    width = len(columns)
+    batch = []
+    blank_rows = 0
+    yielded = False
+    for row in rows:
+        if all(value is None for value in row):
+            blank_rows += 1
+            continue
+        # Пустые строки внутри листа остаются (как NaN), в конце листа отбрасываются
+        batch.extend([(np.nan,) * width] * blank_rows)
+        blank_rows = 0
+        row = tuple(_cell(value) for value in row[:width])
+        batch.append(row + (np.nan,) * (width - len(row)))
+        if len(batch) >= batch_size:
+            yield _frame(batch, columns)
+            batch = []
+            yielded = True
+    if batch or not yielded:
+        yield _frame(batch, columns)
+
+
+def read_sheet(source, sheet_name=None, batch_size=BATCH_SIZE):
+    """Лист целиком одним DataFrame, прочитанный потоково (без дерева ячеек openpyxl)."""
+    with open_workbook(source) as workbook:
+        return pd.concat(iter_sheet(workbook, sheet_name, batch_size), ignore_index=True).infer_objects()
@@ -0,0 +1,125 @@
+import asyncio
+import sys
+from pathlib import Path
+
+from aiohttp import web
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from RSM.async_client import AsyncRsmClient, fetch_intervals, split_ids, split_interval  # noqa: E402
+
+IDS = list(range(1, 5001))
+PAGE = 30
+
+
+class FakeRsm:
+    """РСМ в миниатюре: поиск по диапазону id, счетчик готов только после начала поиска, иногда 503."""
+
+    def __init__(self, unavailable=0):
+        self.searches = {}
+        self.unavailable = unavailable
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+    async def _enter(self):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+
+    async def get_data(self, request):
+        await self._enter()
+        try:
+            if self.unavailable:
+                self.unavailable -= 1
+                return web.Response(status=503)
+            key, start, end = request.query["key"], int(request.query["a"]), int(request.query["b"])
+            rows = [{"ID": value, "Selected": False} for value in IDS if start <= value <= end]
+            self.searches[key] = rows[PAGE:]
+            return web.json_response({"Data": rows[:PAGE]})
+        finally:
+            self.in_flight -= 1
+
+    async def get_count(self, request):
+        await self._enter()
+        try:
+            key, start, end = request.query["key"], int(request.query["a"]), int(request.query["b"])
+            if key not in self.searches:
+                return web.Response(text="Поиск не найден")
+            return web.Response(text=str(sum(start <= value <= end for value in IDS)))
+        finally:
+            self.in_flight -= 1
+
+    async def get_add_data(self, request):
+        await self._enter()
+        try:
+            rows = self.searches[request.query["uniqueSessionKey"]]
+            page, self.searches[request.query["uniqueSessionKey"]] = rows[:PAGE * 10], rows[PAGE * 10:]
+            return web.json_response({"Data": page})
+        finally:
+            self.in_flight -= 1
+
+
+def run_with_server(fake, scenario):
+    async def main():
+        app = web.Application()
+        app.router.add_get("/Registers/GetData", fake.get_data)
+        app.router.add_get("/Registers/GetCount", fake.get_count)
+        app.router.add_get("/Registers/GetAddData", fake.get_add_data)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with AsyncRsmClient(
+                "cookie", base_url=f"http://127.0.0.1:{port}", concurrency=4, backoff=0.01, poll_interval=0.01
+            ) as client:
+                return await scenario(client)
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def links(interval, key):
+    query = f"key={key}&a={interval[0]}&b={interval[1]}"
+    return f"http://rsm/Registers/GetData?{query}", f"http://rsm/Registers/GetCount?{query}"
+
+
+def test_split_and_fetch_through_one_session():
+    fake = FakeRsm(unavailable=2)
+    keys = iter(range(10**6))
+
+    async def scenario(client):
+        async def count_rows(interval):
+            return await client.row_count(*links(interval, next(keys)))
+
+        intervals = await split_interval([1, 5000], count_rows, split_ids, 1000)
+        searches = []
+        for start, end, _ in intervals:
+            key = next(keys)
+            searches.append((links((start, end), key)[0], key))
+        return intervals, await fetch_intervals(client, searches)
+
+    intervals, df = run_with_server(fake, scenario)
+
+    # Интервалы покрывают весь диапазон без пропусков, в каждом не больше max_rows
+    assert intervals[0][0] == 1 and intervals[-1][1] == 5000
+    assert all(prev[1] + 1 == nxt[0] for prev, nxt in zip(intervals, intervals[1:]))
+    assert all(count <= 1000 for _, _, count in intervals)
+    assert sum(count for _, _, count in intervals) == len(IDS)
+
+    assert sorted(df["ID"]) == IDS and "Selected" not in df.columns
+    assert fake.max_in_flight <= 4
+
+
+def test_count_not_ready_returns_zero():
+    fake = FakeRsm()
+
+    async def scenario(client):
+        # Поиск под другим ключом: счетчик этого ключа так и не станет готов
+        return await client.row_count(links((1, 10), "search")[0], links((1, 10), "other")[1])
+
+    assert run_with_server(fake, scenario) == 0
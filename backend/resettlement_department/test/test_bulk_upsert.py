@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.bulk_upsert import csv_chunks, row_hash  # noqa: E402
+
+
+def test_csv_chunks_keep_null_apart_from_empty_string():
+    df = pd.DataFrame(
+        {
+            "affair_id": [1, 2, 3],
+            "fio": ["Иванов, И.", "", None],
+            "floor": pd.array([5, None, 2], dtype="Int64"),
+            "is_hidden": [False, True, False],
+        }
+    ).replace({np.nan: None})
+    chunks = [chunk.getvalue() for chunk in csv_chunks(df, ["affair_id", "fio", "floor", "is_hidden"], chunk_size=2)]
+
+    assert chunks == [
+        '1,"Иванов, И.",5,False\n2,"",,True\n',
+        "3,,2,False\n",
+    ]
+
+
+def test_row_hash_depends_on_values_not_dtypes():
+    loaded = pd.DataFrame({"order_id": [1, 2], "unom": pd.array([10, None], dtype="Int64"), "fio": ["a", "b"]})
+    reloaded = pd.DataFrame({"order_id": [1, 2], "unom": [10, None], "fio": ["a", "c"]}, dtype=object)
+
+    hashes = row_hash(loaded, ["unom", "fio"])
+    assert hashes.dtype == np.int64
+    assert hashes[0] == row_hash(reloaded, ["unom", "fio"])[0]
+    assert hashes[1] != row_hash(reloaded, ["unom", "fio"])[1]
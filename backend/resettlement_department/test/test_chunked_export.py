@@ -0,0 +1,102 @@
+import io
+import json
+import sys
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from RSM.chunked_export import RsmExportClient, chunked_export, date_windows, merge_chunks  # noqa: E402
+
+
+class FakeRsm(BaseHTTPRequestHandler):
+    """Заглушка РСМ: выгрузка готова со второго опроса, файл - строки окна из post-данных."""
+
+    exports = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        rows = json.loads(body["parametersJson"][0])
+        with self.lock:
+            export_id = len(self.exports) + 1
+            self.exports[export_id] = {"rows": rows, "polls": 0}
+        self.send_response(200)
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/Registers/GetData":
+            with self.lock:
+                data = []
+                for export_id in sorted(self.exports, reverse=True):
+                    export = self.exports[export_id]
+                    export["polls"] += 1
+                    data.append({"ID": export_id, "1000881": "Завершена" if export["polls"] > 2 else "Выполняется"})
+            self._send(json.dumps({"Data": data}).encode())
+        else:
+            export_id = int(parse_qs(url.query)["exportId"][0])
+            buffer = io.BytesIO()
+            pd.DataFrame(self.exports[export_id]["rows"], columns=["affair_id", "value"]).to_excel(buffer, index=False)
+            self._send(buffer.getvalue())
+
+    def _send(self, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_date_windows_cover_range():
+    windows = date_windows(datetime(2017, 1, 1), datetime(2019, 6, 30, 23, 59, 59), days=365)
+    assert windows[0][0] == datetime(2017, 1, 1)
+    assert windows[-1][1] == datetime(2019, 6, 30, 23, 59, 59)
+    assert all((b[0] - a[1]).total_seconds() == 1 for a, b in zip(windows, windows[1:]))
+
+
+def test_merge_keeps_key_from_one_window():
+    first = pd.DataFrame({"order_id": [1, 2, 2], "area": ["a", "b", "c"]})
+    second = pd.DataFrame({"order_id": [2, 3], "area": ["d", "e"]})
+    merged = merge_chunks([first, second], "order_id")
+    assert merged.values.tolist() == [[1, "a"], [2, "d"], [3, "e"]]
+
+
+def test_chunked_export_resumes_failed_window(tmp_path):
+    FakeRsm.exports = {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRsm)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = RsmExportClient("token", base_url=f"http://127.0.0.1:{server.server_port}", poll_interval=0.01, timeout=10)
+    windows = date_windows(datetime(2020, 1, 1), datetime(2022, 12, 31), days=366)
+    rows = {window[0].year: [[window[0].year, "x"], [2020, str(window[0].year)]] for window in windows}
+    failing = {2021}
+
+    def export_window(start, end, path):
+        if start.year in failing:
+            raise ConnectionError("timeout")
+        post_data = {"parametersJson": json.dumps(rows[start.year]), "coreExportType": "Xlsx"}
+        return client.export_df("http://webrsm.mlc.gov:5222/Registers/GetData?IsMine=true", post_data, "key", path)
+
+    try:
+        with pytest.raises(ConnectionError):
+            chunked_export(tmp_path / "kpu", lambda: windows, export_window, "affair_id", max_workers=2, retries=2)
+        assert len(FakeRsm.exports) == 2
+        assert len(list((tmp_path / "kpu").glob("*.pkl"))) == 2
+
+        failing.clear()
+        df = chunked_export(tmp_path / "kpu", lambda: [], export_window, "affair_id", max_workers=2)
+    finally:
+        server.shutdown()
+
+    # Повторный запуск взял окна из manifest и выгрузил только упавшее
+    assert len(FakeRsm.exports) == 3
+    assert df.sort_values("affair_id").values.tolist() == [[2020, "2022"], [2021, "x"], [2022, "x"]]
+    assert not (tmp_path / "kpu").exists()
@@ -0,0 +1,78 @@
+import csv
+import sys
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import load_workbook
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.container_builder import (  # noqa: E402
+    CONTAINER_COLUMNS,
+    ENGLISH_HEADERS,
+    RUSSIAN_HEADERS,
+    TAGS,
+    TIME2PLAN,
+    render_container,
+    write_container,
+)
+
+
+def _apart(**values):
+    row = dict.fromkeys(CONTAINER_COLUMNS)
+    row.update(
+        full_old_house_address="ул. Старая, д. 1", old_number=5, type_of_settlement="частная собственность",
+        kpu_number="КПУ-1", new_apart_id=100, new_number=12, full_living_area=54.3, total_living_area=50.1,
+        room_count=2, living_area=30.5, floor=3, cin_address="ЦИН", cin_schedule="пн-пт", dep_schedule="вт-чт",
+        phone_osmotr="+7 495 000", full_house_address="ул. Новая, д. 2", full_cin_address="ул. Новая, д. 3",
+        old_district="ЦАО", old_cad_num="77:01:1", mail_index=123456,
+    )
+    row.update(values)
+    return row
+
+
+def test_render_container_layout():
+    df = pd.DataFrame(
+        [
+            _apart(start_date=date(2030, 1, 15)),
+            _apart(old_district="ВАО", type_of_settlement="наем", cin_schedule="time2plan", dep_schedule="отдел", otdel="Отдел 1"),
+            _apart(old_district="Неизвестный"),
+        ]
+    )
+    frame = render_container(df, today=date(2025, 1, 1))
+
+    assert list(frame.columns) == ENGLISH_HEADERS
+    assert len(frame) == 3 * len(TAGS)
+    assert frame["NumPP"].tolist() == [1] * 6 + [2] * 6 + [3] * 6
+    assert frame["customInputDataList.tagName"].tolist() == TAGS * 3
+    # Поля квартиры только в первой строке из шести
+    assert frame["flatList.sourceid"].tolist()[:6] == [100, None, None, None, None, None]
+    assert frame.loc[0, "appApplicantList.postAddressList.address"] == "ул. Старая, д. 1 кв.\xa05"
+    assert frame["reportID"].tolist()[::6] == [108405, 108407, 108407]
+
+    values = frame["customInputDataList.value"].tolist()
+    assert "ул. Старая, д. 1 принято решение" in values[0]
+    assert "необходимо с 15.01.2030 в течение 7 рабочих дней" in values[3]
+    assert "ул. Новая, д. 3 (вт-чт), по предварительной" in values[5]
+    assert values[9] == TIME2PLAN
+    assert "г.\xa0Москва, Отдел 1 , по предварительной" in values[11]
+
+
+def test_write_container_xlsx_and_csv(tmp_path):
+    frame = render_container(pd.DataFrame([_apart()]), today=date(2025, 1, 1))
+
+    rows = [list(row) for row in load_workbook(write_container(frame, tmp_path / "c.xlsx")).active.iter_rows(values_only=True)]
+    assert rows[0] == RUSSIAN_HEADERS and rows[1] == ENGLISH_HEADERS
+    assert len(rows) == 2 + len(TAGS)
+    assert rows[2][:3] == [1, 1, 1] and rows[3][:3] == [1, None, None]
+
+    with open(write_container(frame, tmp_path / "c.csv"), encoding="utf-8-sig", newline="") as file:
+        lines = list(csv.reader(file))
+    assert lines[:2] == [RUSSIAN_HEADERS, ENGLISH_HEADERS]
+    assert [line[18] for line in lines[2:]] == TAGS
+
+
+def test_render_empty_container():
+    frame = render_container(pd.DataFrame(columns=CONTAINER_COLUMNS))
+    assert frame.empty and list(frame.columns) == ENGLISH_HEADERS
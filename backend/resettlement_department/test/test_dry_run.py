@@ -0,0 +1,57 @@
+import sys
+from decimal import Decimal
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import load_workbook
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.dry_run import summarize, write_summary  # noqa: E402
+from service.matching_engine import match_families  # noqa: E402
+
+OLD_COLUMNS = [
+    "affair_id", "kpu_number", "room_count", "full_living_area", "total_living_area", "living_area",
+    "is_special_needs_marker", "min_floor", "max_floor", "buying_date", "is_queue", "rank",
+]
+NEW_COLUMNS = [
+    "new_apart_id", "house_address", "apart_number", "floor", "room_count", "full_living_area",
+    "total_living_area", "living_area", "for_special_needs_marker", "rank",
+]
+
+
+def family(affair_id, area, room_count=1, rank=1):
+    area = Decimal(str(area))
+    return (affair_id, f"kpu-{affair_id}", room_count, area, area, area, 0, 0, 0, None, 0, rank)
+
+
+def new_apart(new_apart_id, area, room_count=1, rank=1):
+    area = Decimal(str(area))
+    return (new_apart_id, "ул. Новая, д. 1", new_apart_id, 3, room_count, area, area, area, 0, rank)
+
+
+def test_summary_counts_offers_and_deficit_per_room_count(tmp_path):
+    df_old = pd.DataFrame(
+        [family(1, 30), family(2, 30), family(3, 50, room_count=2), family(4, 55, room_count=2, rank=2)],
+        columns=OLD_COLUMNS,
+    )
+    df_new = pd.DataFrame(
+        [new_apart(10, 31), new_apart(11, 32), new_apart(12, 33), new_apart(20, 51, room_count=2)],
+        columns=NEW_COLUMNS,
+    )
+
+    summary = summarize(df_old, df_new, match_families(df_old, df_new))
+
+    assert (summary["offer"], summary["cannot_offer"]) == (3, 1)
+    rooms = {room["room_count"]: room for room in summary["rooms"]}
+    assert rooms[1]["balance"] == 1 and rooms[1]["mode"] == "профицит"
+    assert rooms[2]["offer"] == 1 and rooms[2]["cannot_offer"] == 1 and rooms[2]["mode"] == "дефицит"
+    assert summary["pairs"][0] == {
+        "affair_id": 1, "kpu_number": "kpu-1", "old_room_count": 1, "old_rank": 1,
+        "new_apart_id": 10, "house_address": "ул. Новая, д. 1", "apart_number": 10, "floor": 3,
+        "new_room_count": 1, "new_rank": 1,
+    }
+
+    workbook = load_workbook(write_summary(summary, tmp_path / "dry_run.xlsx"), read_only=True)
+    assert workbook.sheetnames == ["Комнатность", "Пары"]
+    assert len(list(workbook["Пары"].iter_rows())) == 4
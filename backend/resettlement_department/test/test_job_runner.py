@@ -0,0 +1,54 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.job_runner import JobRunner, report_progress  # noqa: E402
+
+
+def wait(runner, job_id):
+    for _ in range(300):
+        job_status = runner.status(job_id)
+        if job_status["state"] in ("done", "failed"):
+            return job_status
+        time.sleep(0.1)
+    raise AssertionError("job did not finish")
+
+
+def test_job_result_and_failure():
+    runner = JobRunner(max_workers=1)
+    try:
+        done = wait(runner, runner.submit("test", dict, history_id=5, file="x.xlsx"))
+        assert done["result"] == {"history_id": 5, "file": "x.xlsx"}
+        assert done["phase"] == "load"
+
+        failed = wait(runner, runner.submit("test", int, unknown=1))
+        assert failed["state"] == "failed"
+        assert "TypeError" in failed["error"]
+        assert runner.status("missing") is None
+    finally:
+        runner.shutdown()
+
+
+def test_report_progress_outside_job_is_noop():
+    report_progress("match", offer=1)
+
+
+def test_finished_job_releases_progress_and_expires():
+    runner = JobRunner(max_workers=1, job_ttl=0.5)
+    try:
+        job_id = runner.submit("test", dict, history_id=5)
+        done = wait(runner, job_id)
+        for _ in range(50):
+            if "status" in runner.jobs[job_id]:
+                break
+            time.sleep(0.02)
+        job = runner.jobs[job_id]
+        assert "progress" not in job and "future" not in job
+        assert runner.status(job_id) == done
+
+        time.sleep(0.6)
+        assert runner.status(job_id) is None and runner.jobs == {}
+    finally:
+        runner.shutdown()
@@ -0,0 +1,218 @@
+import random
+import sys
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service import matching_engine  # noqa: E402
+from service.matching_engine import match_families  # noqa: E402
+
+OLD_COLUMNS = [
+    "affair_id", "room_count", "full_living_area", "total_living_area", "living_area",
+    "is_special_needs_marker", "min_floor", "max_floor", "buying_date", "is_queue", "rank",
+]
+NEW_COLUMNS = [
+    "new_apart_id", "floor", "room_count", "full_living_area", "total_living_area", "living_area",
+    "for_special_needs_marker",
+]
+
+
+def family(affair_id, area, room_count=1, min_floor=0, max_floor=0, buying_date=None, is_queue=0, rank=1):
+    area = Decimal(str(area))
+    return (affair_id, room_count, area, area, area, 0, min_floor, max_floor, buying_date, is_queue, rank)
+
+
+def new_apart(new_apart_id, area, floor, room_count=1):
+    area = Decimal(str(area))
+    return (new_apart_id, floor, room_count, area, area, area, 0)
+
+
+def run(families, new_aparts, ochered=False):
+    return match_families(
+        pd.DataFrame(families, columns=OLD_COLUMNS),
+        pd.DataFrame(new_aparts, columns=NEW_COLUMNS),
+        ochered=ochered,
+    )
+
+
+def test_proficit_takes_first_suitable_in_query_order():
+    result = run(
+        [family(1, 30), family(2, 30)],
+        [new_apart(10, 29, 3), new_apart(11, 31, 5), new_apart(12, 32, 2)],
+    )
+    assert result.offers == [(1, 11), (2, 12)]
+    assert result.flag_ficit == {1: 1}
+    assert result.free_new_apart_ids(1).tolist() == [10]
+
+
+def test_floor_window_fallback():
+    result = run(
+        [family(1, 30, min_floor=7, max_floor=8)],
+        [new_apart(10, 31, 2), new_apart(11, 32, 5), new_apart(12, 33, 12)],
+    )
+    assert result.offers == [(1, 11)]
+
+
+def test_late_buying_prefers_lowest_floor_within_delta():
+    result = run(
+        [family(1, 30, buying_date=date(2019, 1, 1))],
+        [new_apart(10, 31, 9), new_apart(11, 32.5, 4), new_apart(12, 40, 1)],
+    )
+    assert result.offers == [(1, 11)]
+
+
+def test_deficit_offers_from_reversed_pool_and_tracks_min_rank():
+    result = run(
+        [family(1, 30, rank=1), family(2, 35, rank=2), family(3, 50, rank=3)],
+        [new_apart(10, 36, 3), new_apart(11, 37, 3)],
+    )
+    assert result.flag_ficit == {1: 2}
+    assert result.offers == [(2, 11), (1, 10)]
+    assert result.min_rank_by_room == {1: 3}
+
+
+def test_queue_family_ignores_room_count():
+    result = run(
+        [family(1, 30, room_count=1, is_queue=1)],
+        [new_apart(10, 25, 3, room_count=1), new_apart(11, 45, 3, room_count=2)],
+        ochered=True,
+    )
+    assert result.offers == [(1, 11)]
+
+
+def test_wave_second_pass_skips_unmatched_families():
+    families = [family(1, 30, rank=1), family(2, 35, rank=2), family(3, 50, rank=3)]
+    new_aparts = [new_apart(10, 36, 3), new_apart(11, 37, 3)]
+    assert run(families, new_aparts).cannot_offer == [(3,), (3,)]
+
+    result = match_families(
+        pd.DataFrame(families, columns=OLD_COLUMNS), pd.DataFrame(new_aparts, columns=NEW_COLUMNS), wave=True
+    )
+    assert result.offers == [(2, 11), (1, 10)]
+    assert result.cannot_offer == [(3,)]
+
+
+def random_frames(seed, queue=False):
+    rnd = random.Random(seed)
+    families = [
+        family(
+            affair_id,
+            rnd.randint(200, 600) / 10,
+            room_count=rnd.randint(1, 4),
+            min_floor=rnd.choice([0, 2, 5]),
+            max_floor=rnd.choice([0, 6, 9]),
+            buying_date=rnd.choice([None, date(2019, 1, 1)]),
+            is_queue=int(queue and rnd.random() < 0.1),
+            rank=rnd.randint(1, 5),
+        )
+        for affair_id in range(1, 301)
+    ]
+    new_aparts = [
+        new_apart(new_apart_id, rnd.randint(200, 650) / 10, rnd.randint(1, 12), room_count=rnd.randint(1, 4))
+        for new_apart_id in range(1000, 1280)
+    ]
+    return pd.DataFrame(families, columns=OLD_COLUMNS), pd.DataFrame(new_aparts, columns=NEW_COLUMNS)
+
+
+def outcome(result):
+    return (
+        result.offers,
+        result.cannot_offer,
+        result.min_rank_by_room,
+        list(result.flag_ficit.items()),
+        {room: result.free_new_apart_ids(room).tolist() for room in result.flag_ficit},
+    )
+
+
+def test_parallel_room_counts_match_serial(monkeypatch):
+    monkeypatch.setattr(matching_engine, "PARALLEL_MIN_FAMILIES", 0)
+    for seed, wave in ((1, False), (2, True)):
+        df_old, df_new = random_frames(seed)
+        serial = match_families(df_old, df_new, wave=wave)
+        assert outcome(match_families(df_old, df_new, wave=wave, workers=2)) == outcome(serial)
+
+    # Очередники подбираются до разбиения по комнатностям: результат одинаков от запуска к запуску
+    df_old, df_new = random_frames(3, queue=True)
+    first = outcome(match_families(df_old, df_new, ochered=True, workers=2))
+    assert first == outcome(match_families(df_old, df_new, ochered=True, workers=3))
+    assert first[0]
+
+
+def legacy_pick(df, old, room_count, any_room=False):
+    """Выбор квартиры фильтрами DataFrame, как в цикле подбора до движка на массивах."""
+    fits = (
+        (df["full_living_area"] >= old["full_living_area"])
+        & (df["total_living_area"] >= old["total_living_area"])
+        & (df["living_area"] >= old["living_area"])
+        & (df["for_special_needs_marker"] == old["is_special_needs_marker"])
+    )
+    if not any_room:
+        fits &= df["room_count"] == old["room_count"]
+    has_floor = bool(old["min_floor"] or old["max_floor"])
+    late_buying = old["buying_date"] is not None and old["buying_date"] > date(2017, 8, 1)
+    if not any_room and late_buying and not has_floor:
+        suitable = df[fits]
+        if suitable.empty:
+            return None
+        first = suitable.iloc[0]
+        close = df[fits & (df["full_living_area"] - first["full_living_area"] <= matching_engine.DELTA_BY_ROOM[room_count])]
+        return close.sort_values(by="floor").iloc[0] if not close.empty else first
+    window = (df["floor"] >= old["min_floor"] - 2) & (df["floor"] <= old["max_floor"] + 2) if has_floor else True
+    for condition in ((df["floor"] >= old["min_floor"]) & (df["floor"] <= old["max_floor"]), window, True):
+        suitable = df[fits & condition]
+        if not suitable.empty:
+            return suitable.iloc[0]
+    return None
+
+
+def legacy_match(df_old, df_new, ochered=False):
+    """Прежний каскад дефицит/профицит: offers, cannot_offer, min_rank_by_room и остаток ресурса."""
+    offers, cannot_offer, min_rank_by_room, free = [], [], {}, {}
+    pool, pool_second = df_new, df_new.loc[::-1]
+    old_count = df_old.groupby("room_count")["affair_id"].count().to_dict()
+    new_count = df_new.groupby("room_count")["new_apart_id"].count().to_dict()
+
+    def unmatched(old, room_count):
+        cannot_offer.append((int(old["affair_id"]),))
+        min_rank_by_room[room_count] = min(min_rank_by_room.get(room_count, old["rank"]), old["rank"])
+
+    def match(df, old, room_count, offer, queue):
+        apart = legacy_pick(df, old, room_count, any_room=queue)
+        if apart is None:
+            unmatched(old, room_count)
+            return df
+        if offer:
+            offers.append((int(old["affair_id"]), int(apart["new_apart_id"])))
+        return df[df["new_apart_id"] != apart["new_apart_id"]]
+
+    for i in range(1, int(max(df_old["room_count"].max(), df_new["room_count"].max())) + 1):
+        families = df_old[df_old["room_count"] == i]
+        if old_count.get(i, 0) > new_count.get(i, 0):
+            for _, old in families[::-1].iterrows():
+                queue = bool(ochered and old["is_queue"] == 1)
+                late_buying = old["buying_date"] is not None and old["buying_date"] > date(2017, 8, 1)
+                by_area_delta = late_buying and not (old["min_floor"] or old["max_floor"])
+                pool = match(pool, old, i, offer=by_area_delta and not queue, queue=queue)
+            for _, old in families[::-1].iterrows():
+                pool_second = match(pool_second, old, i, offer=True, queue=False)
+            free[i] = pool_second[pool_second["room_count"] == i]["new_apart_id"].tolist()
+        else:
+            for _, old in families.iterrows():
+                pool = match(pool, old, i, offer=True, queue=bool(ochered and old["is_queue"] == 1))
+            free[i] = pool[pool["room_count"] == i]["new_apart_id"].tolist()
+    return offers, sorted(set(cannot_offer)), min_rank_by_room, free
+
+
+def test_engine_matches_legacy_pandas_loop():
+    for seed, ochered in ((4, False), (5, True), (6, False)):
+        df_old, df_new = random_frames(seed, queue=ochered)
+        result = match_families(df_old, df_new, ochered=ochered)
+        offers, cannot_offer, min_rank_by_room, free = legacy_match(df_old, df_new, ochered=ochered)
+        assert result.offers == offers
+        assert sorted(set(result.cannot_offer)) == cannot_offer
+        assert result.min_rank_by_room == min_rank_by_room
+        assert {room: result.free_new_apart_ids(room).tolist() for room in free} == free
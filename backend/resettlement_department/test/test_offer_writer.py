@@ -0,0 +1,13 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.offer_writer import offers_by_family  # noqa: E402
+
+
+def test_offers_are_grouped_per_family():
+    assert offers_by_family([(1, 10), (2, 11), (1, 12)]) == {
+        1: {"10": {"status_id": 7}, "12": {"status_id": 7}},
+        2: {"11": {"status_id": 7}},
+    }
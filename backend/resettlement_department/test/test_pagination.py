@@ -0,0 +1,33 @@
+import sys
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from utils.pagination import build_page_query, decode_cursor, encode_cursor, make_page  # noqa: E402
+
+
+def test_cursor_round_trip_keeps_types():
+    for value in (Decimal("45.10"), date(2024, 5, 1), "Иванов", 3, None):
+        assert decode_cursor(encode_cursor(value, 17)) == (value, 17)
+
+
+def test_page_query_continues_after_cursor():
+    query, params = build_page_query(
+        "SELECT * FROM t", "rn = 1", {"floor": 2}, "affair_id",
+        sort_by="full_living_area", sort_order="desc", cursor=encode_cursor(Decimal("50.5"), 9), page_size=10_000,
+    )
+    assert query.endswith(
+        "WHERE rn = 1 AND (full_living_area < :cursor_value OR (full_living_area = :cursor_value AND affair_id < :cursor_id)"
+        " OR full_living_area IS NULL) ORDER BY full_living_area DESC NULLS LAST, affair_id DESC LIMIT :page_limit"
+    )
+    assert params == {"floor": 2, "cursor_value": Decimal("50.5"), "cursor_id": 9, "page_limit": 501}
+
+
+def test_make_page_sets_next_cursor_only_when_more_rows():
+    rows = [{"affair_id": i, "floor": i % 3} for i in range(4)]
+    page = make_page(rows, "affair_id", "floor", 3)
+    assert page["items"] == rows[:3]
+    assert decode_cursor(page["next_cursor"]) == (2, 2)
+    assert make_page(rows, "affair_id", None, 4)["next_cursor"] is None
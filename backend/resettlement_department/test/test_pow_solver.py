@@ -0,0 +1,32 @@
+import hashlib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from RSM.pow_solver import find_suffix_pow_naive, solve_pow  # noqa: E402
+
+
+def _zeros(candidate):
+    digest = hashlib.sha1(candidate.encode("utf-8")).digest()
+    return len(digest) - len(digest.lstrip(b"\0"))
+
+
+@pytest.mark.parametrize("base", ["SDbx1/Cx", "proof-7", "кириллица"])
+def test_serial_solver_matches_previous_search(base):
+    # Без пула порядок перебора прежний: тот же суффикс, что у старого алгоритма
+    assert solve_pow(base, workers=1) == find_suffix_pow_naive(base)
+
+
+def test_parallel_solver_finds_valid_suffix():
+    for base in ("pool-1", "pool-2"):
+        candidate = solve_pow(base, workers=2)
+        assert candidate.startswith(f"{base}:") and _zeros(candidate) >= 2
+    assert _zeros(solve_pow("easy", zero_bytes=1, workers=2)) >= 1
+
+
+def test_unsolvable_difficulty_raises():
+    with pytest.raises(RuntimeError):
+        solve_pow("hard", zero_bytes=4, max_len=2, workers=1)
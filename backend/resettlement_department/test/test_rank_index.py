@@ -0,0 +1,63 @@
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.rank_index import rank_new_aparts  # noqa: E402
+
+
+def brute_force_rank(df_old_apart, df_new_apart):
+    ranks = []
+    for _, new in df_new_apart.iterrows():
+        room = df_old_apart[df_old_apart["room_count"] == new["room_count"]]
+        combined = new["living_area"] + new["full_living_area"]
+        if room.empty or combined < (room["living_area"] + room["full_living_area"]).min():
+            ranks.append(0)
+            continue
+        covered = room[
+            (room["living_area"] <= new["living_area"])
+            & (room["full_living_area"] <= new["full_living_area"])
+            & (room["total_living_area"] <= new["total_living_area"])
+            & (room["is_special_needs_marker"] == new["for_special_needs_marker"])
+        ]
+        ranks.append(int(covered["rank"].max()) if not covered.empty else 0)
+    return ranks
+
+
+def random_aparts(rng, size, marker_column):
+    rows = []
+    for _ in range(size):
+        living = round(rng.uniform(10, 40), 2)
+        full = round(living + rng.uniform(1, 10), 2)
+        rows.append((rng.randint(1, 3), living, full, round(full + rng.uniform(0, 5), 2), rng.choice([0, 0, 1])))
+    return pd.DataFrame(rows, columns=["room_count", "living_area", "full_living_area", "total_living_area", marker_column])
+
+
+def test_rank_matches_brute_force():
+    rng = random.Random(7)
+    df_old_apart = random_aparts(rng, 300, "is_special_needs_marker")
+    df_old_apart["rank"] = (
+        (df_old_apart["living_area"] + df_old_apart["full_living_area"])
+        .groupby(df_old_apart["room_count"])
+        .rank(method="dense")
+        .astype(int)
+    )
+    df_new_apart = random_aparts(rng, 200, "for_special_needs_marker")
+
+    assert rank_new_aparts(df_old_apart, df_new_apart).tolist() == brute_force_rank(df_old_apart, df_new_apart)
+
+
+def test_rank_is_zero_without_matching_room_count():
+    df_old_apart = pd.DataFrame(
+        [(1, 20, 25, 30, 0, 1)],
+        columns=["room_count", "living_area", "full_living_area", "total_living_area", "is_special_needs_marker", "rank"],
+    )
+    df_new_apart = pd.DataFrame(
+        [(2, 50, 60, 70, 0)],
+        columns=["room_count", "living_area", "full_living_area", "total_living_area", "for_special_needs_marker"],
+    )
+    assert np.array_equal(rank_new_aparts(df_old_apart, df_new_apart), [0])
@@ -0,0 +1,85 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.rank_refresh import (  # noqa: E402
+    NEW_APART_COLUMNS,
+    OLD_APART_COLUMNS,
+    AreaTable,
+    group_state,
+    plan_rank_refresh,
+    remap_ranks,
+)
+
+
+def aparts():
+    df_old_apart = pd.DataFrame(
+        [
+            (1, 7, 1, 20, 30, 35, 0, 1),
+            (2, 7, 1, 25, 30, 35, 0, 2),
+            (3, 7, 2, 30, 45, 50, 0, 1),
+        ],
+        columns=OLD_APART_COLUMNS,
+    )
+    df_new_apart = pd.DataFrame(
+        [
+            (10, 7, 1, 26, 31, 36, 0, 2),
+            (11, 7, 2, 31, 46, 51, 0, 1),
+        ],
+        columns=NEW_APART_COLUMNS,
+    )
+    return df_old_apart, df_new_apart
+
+
+def test_first_refresh_only_saves_baseline():
+    old_updates, new_updates, states = plan_rank_refresh(*aparts(), {})
+    assert old_updates == [] and new_updates == []
+    assert states[(7, 1)][0] == [5000, 5500]
+    assert set(states) == {(7, 1), (7, 2)}
+
+
+def test_only_changed_group_is_reranked():
+    df_old_apart, df_new_apart = aparts()
+    _, _, states = plan_rank_refresh(df_old_apart, df_new_apart, {})
+    stored = {key: (breakpoints, fingerprint, []) for key, (breakpoints, fingerprint) in states.items()}
+    assert plan_rank_refresh(df_old_apart, df_new_apart, stored) == ([], [], {})
+
+    # Семья 1 стала больше семьи 2: ранги в группе 1-комнатных меняются местами
+    df_old_apart.loc[df_old_apart["affair_id"] == 1, "living_area"] = 28
+    old_updates, new_updates, states = plan_rank_refresh(df_old_apart, df_new_apart, stored)
+    assert sorted(old_updates) == [(1, 2), (2, 1)]
+    assert new_updates == [(10, 1)]
+    assert set(states) == {(7, 1)}
+
+
+def test_matching_baseline_matches_refresh_state():
+    df_old_apart, df_new_apart = aparts()
+    _, _, states = plan_rank_refresh(df_old_apart, df_new_apart, {})
+
+    # При подборе history_id еще не проставлен в выборке
+    old_aparts = AreaTable(df_old_apart.drop(columns="history_id"), "affair_id", "is_special_needs_marker", history_id=7)
+    new_aparts = AreaTable(df_new_apart.drop(columns="history_id"), "new_apart_id", "for_special_needs_marker", history_id=7)
+    for key, state in states.items():
+        assert group_state(old_aparts.rows[old_aparts.group(key)], new_aparts.rows[new_aparts.group(key)]) == state
+
+
+def test_matched_ranks_are_remapped_not_recomputed():
+    df_old_apart, df_new_apart = aparts()
+    _, _, states = plan_rank_refresh(df_old_apart, df_new_apart, {})
+    # Подбор выставил квартире 10 ранг 1 (min_rank - 1), он отличается от расчетного 2
+    df_new_apart.loc[df_new_apart["new_apart_id"] == 10, "rank"] = 1
+    stored = {key: (breakpoints, fingerprint, [10]) for key, (breakpoints, fingerprint) in states.items()}
+
+    # Новая семья меньше всех: границы сдвигаются на одну, ранг квартиры 10 сдвигается вместе с ними
+    df_old_apart.loc[len(df_old_apart)] = (4, 7, 1, 10, 20, 25, 0, None)
+    old_updates, new_updates, _ = plan_rank_refresh(df_old_apart, df_new_apart, stored)
+    assert sorted(old_updates) == [(1, 2), (2, 3), (4, 1)]
+    assert new_updates == [(10, 2)]
+
+
+def test_remap_keeps_ranks_outside_breakpoints():
+    assert remap_ranks([0, 1, 2, 3], [100, 200], [50, 100, 200]).tolist() == [0, 2, 3, 3]
+    assert remap_ranks([2], [100, 200], [200]).tolist() == [1]
@@ -0,0 +1,86 @@
+import sys
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.rematch_engine import NO_APARTS_REASON, RematchFamily, RematchPool, rematch_families  # noqa: E402
+
+
+def apart(new_apart_id, room_count=2, rank=2, floor=3, area=(40, 50, 30), marker=0, address="A", status_id=1):
+    full, total, living = (Decimal(value) for value in area)
+    return {
+        "new_apart_id": new_apart_id,
+        "room_count": room_count,
+        "full_living_area": full,
+        "total_living_area": total,
+        "living_area": living,
+        "for_special_needs_marker": marker,
+        "house_address": address,
+        "rank": rank,
+        "floor": floor,
+        "status_id": status_id,
+    }
+
+
+def family(affair_id, declined, max_ranks, marker=0, is_queue=0, approved=None, offered=()):
+    return RematchFamily(
+        affair_id=affair_id,
+        rank=2,
+        full_living_area=Decimal(40),
+        total_living_area=Decimal(50),
+        living_area=Decimal(30),
+        is_special_needs_marker=marker,
+        is_queue=is_queue,
+        new_house_addresses=["A"],
+        max_rank_by_room_count=max_ranks,
+        approved=dict(approved or {}),
+        offered=set(offered),
+        declined=declined,
+    )
+
+
+def test_rematch_rules_follow_per_family_loop():
+    pool = RematchPool(
+        [
+            apart(199, area=(40, 50, 29)),  # площадь жилая меньше, чем у старой
+            apart(198, status_id=12),  # статус 12 не предлагается
+            apart(101, area=(39, 50, 30)),  # уже была в предложении семьи 1
+            apart(200, floor=4),  # в окне 3..max_floor, но окно ограничено max_rank
+            apart(201, floor=3, area=(41, 51, 31)),
+            apart(202, marker=1),
+            apart(203, address="B"),
+            apart(300, room_count=1, rank=5),
+            apart(301, room_count=1, rank=2, marker=1),
+        ]
+    )
+    families = {
+        1: family(
+            1,
+            [{"room_count": 2, "min_floor": 3, "max_floor": 5}],
+            {"2": 3},
+            approved={"100": {"status_id": 1}},
+            offered={100, 101},
+        ),
+        2: family(2, [{"room_count": 2, "min_floor": 0, "max_floor": 0}] * 2, {}),
+        # Особые потребности у очередника не учитываются, max_rank 5 дает квартиру 300
+        4: family(4, [{"room_count": 1, "min_floor": 0, "max_floor": 0}], {"1": 5}, marker=1, is_queue=1),
+    }
+
+    result = rematch_families([1, 2, 3, 4, 1], families, pool)
+
+    # Семья 1: окно этажей 3..3 (max_rank), квартира 200 на 4 этаже не подходит
+    assert result.offers[1] == {"100": {"status_id": 1}, "201": {"status_id": 7}}
+    # Семья 2: без max_rank окно не применяется; вторая отказная не нашла пары
+    assert result.offers[2] == {"200": {"status_id": 7}}
+    assert result.offers[4] == {"300": {"status_id": 7}}
+    # Семьи 3 нет в контексте - пропускается; повтор семьи 1 уже без отказных
+    assert result.matched == {1: 1, 2: 1, 4: 1}
+    assert result.unmatched == {1: NO_APARTS_REASON}
+    assert {200, 201, 300} <= pool.taken
+
+
+def test_window_falls_back_to_any_floor():
+    pool = RematchPool([apart(10, floor=9)])
+    families = {7: family(7, [{"room_count": 2, "min_floor": 1, "max_floor": 3}], {"2": 3})}
+    assert rematch_families([7], families, pool).offers == {7: {"10": {"status_id": 7}}}
@@ -0,0 +1,47 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.report_cache import cached_stamp, get_report  # noqa: E402
+
+
+def test_report_rebuilt_only_on_new_stamp(tmp_path):
+    renders = []
+
+    def render(path):
+        renders.append(path)
+        time.sleep(0.05)
+        Path(path).write_text(f"report {len(renders)}")
+
+    # Одновременные запросы одной версии собирают отчет один раз
+    threads = [
+        threading.Thread(target=get_report, args=(7, "balance", "v1", render, tmp_path)) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    path = get_report(7, "balance", "v1", render, tmp_path)
+    assert len(renders) == 1
+    assert path.read_text() == "report 1" and cached_stamp(path) == "v1"
+
+    path = get_report(7, "balance", "v2", render, tmp_path)
+    assert len(renders) == 2
+    assert path.read_text() == "report 2" and cached_stamp(path) == "v2"
+
+
+def test_failed_render_keeps_previous_report(tmp_path):
+    get_report(8, "balance", "v1", lambda path: Path(path).write_text("old"), tmp_path)
+
+    def broken(path):
+        raise ValueError("query failed")
+
+    with pytest.raises(ValueError):
+        get_report(8, "balance", "v2", broken, tmp_path)
+    path = get_report(8, "balance", "v1", broken, tmp_path)
+    assert path.read_text() == "old"
@@ -0,0 +1,61 @@
+import sys
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.report_writer import ReportWriter, add_totals, rank_balance  # noqa: E402
+
+
+def test_add_totals_merges_ranks_without_resource():
+    df = pd.DataFrame(
+        {
+            "room_count": [1, 1, 1, 1],
+            "Ранг": [1, 2, 3, 4],
+            "Пот_ть": [1, 2, 1, 1],
+            "Ресурс": [0, 1, 1, 1],
+            "Баланс": [-1, -1, 0, 0],
+        }
+    )
+    merged = add_totals(df, {1: 3})
+    assert merged["Ранг"].tolist() == ["1-2", 3, 4, "Итог"]
+    assert merged[["Пот_ть", "Ресурс", "Баланс"]].values.tolist() == [[3, 1, -2], [1, 1, 0], [1, 1, 0], [5, 3, -2]]
+    # С merge_zero_balance ранг с нулевым балансом тоже присоединяет следующий (кроме последнего ранга)
+    assert add_totals(df, {1: 3}, merge_zero_balance=True)["Ранг"].tolist() == ["1-2", 3, 4, "Итог"]
+    assert add_totals(df, {1: 4}, merge_zero_balance=True)["Ранг"].tolist() == ["1-2", "3-4", "Итог"]
+
+
+def test_report_layout(tmp_path):
+    combined = pd.DataFrame(
+        {
+            "room_count": [1, 1, 2, 2],
+            "Ранг": [1, 1, 1, 2],
+            "old_id": [10, None, 11, None],
+            "new_id": [None, 20, None, 21],
+        }
+    )
+    grouped = rank_balance(combined, "old_id", "new_id", {1: 1, 2: 2})
+    views = pd.DataFrame(
+        {"id": [1, 2], "Дата": [date(2024, 5, 1), None], "Когда": [datetime(2024, 5, 1, 12), pd.NaT], "x": [1.5, np.nan]}
+    )
+
+    path = tmp_path / "report.xlsx"
+    with ReportWriter(path) as writer:
+        writer.write_rank_sheet("Ранг", grouped)
+        writer.write_table("res_of_rec", views)
+        assert writer.has_sheet("Ранг") and not writer.has_sheet("where_not")
+
+    book = load_workbook(path)
+    assert book.sheetnames == ["Ранг", "res_of_rec"]
+    rank = [list(row) for row in book["Ранг"].iter_rows(values_only=True)]
+    assert rank[0][:6] == ["1 комната(ы)", None, None, None, None, "2 комната(ы)"]
+    assert rank[1] == ["Ранг", "Пот_ть", "Ресурс", "Баланс", None, "Ранг", "Пот_ть", "Ресурс", "Баланс"]
+    assert rank[2:] == [[1, 1, 1, 0, None, "1-2", 1, 1, 0], ["Итог", 1, 1, 0, None, "Итог", 1, 1, 0]]
+    assert book["Ранг"]["B2"].fill.fgColor.rgb.endswith("FFFF99")
+
+    table = [list(row) for row in book["res_of_rec"].iter_rows(values_only=True)]
+    assert table == [["id", "Дата", "Когда", "x"], [1, datetime(2024, 5, 1), datetime(2024, 5, 1, 12), 1.5], [2, None, None, None]]
@@ -0,0 +1,105 @@
+import sys
+import threading
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from service.snapshot import (  # noqa: E402
+    SNAPSHOT_FAMILY_COLUMNS,
+    SNAPSHOT_NEW_APART_COLUMNS,
+    Snapshot,
+    SnapshotCache,
+)
+
+OLD_LOAD = datetime(2025, 1, 1)
+NEW_LOAD = datetime(2025, 2, 1)
+
+
+def family(affair_id, address, district="ЦАО", updated_at=OLD_LOAD):
+    return (
+        affair_id, f"kpu-{affair_id}", district, "Арбат", 1, 30, 40, 20, 0, 0, 0, None,
+        [30], 1, 30, 0, None, None, address, updated_at,
+    )
+
+
+def new_apart(new_apart_id, address, apart_number, district="ЦАО", updated_at=NEW_LOAD):
+    return (
+        new_apart_id, district, "Арбат", address, apart_number, 3, 1, 31, 41, 21, 0, None, updated_at,
+    )
+
+
+def snapshot():
+    df_old = pd.DataFrame(
+        [
+            family(1, "A"),
+            family(2, "B", district="САО"),
+            family(3, "A", updated_at=datetime(2024, 1, 1)),
+            family(4, "C"),
+        ],
+        columns=SNAPSHOT_FAMILY_COLUMNS,
+    )
+    df_new = pd.DataFrame(
+        [
+            new_apart(10, "N", 1),
+            new_apart(11, "M", 5),
+            new_apart(12, "N", 7),
+            new_apart(13, "N", None),
+            new_apart(14, "N", 12, district="САО"),
+        ],
+        columns=SNAPSHOT_NEW_APART_COLUMNS,
+    )
+    return Snapshot("v1", df_old, df_new, (OLD_LOAD, NEW_LOAD))
+
+
+def test_slices_match_query_filters_and_keep_order():
+    data = snapshot()
+    assert data.families(["C", "A"])["affair_id"].tolist() == [1, 3, 4]
+    assert data.families([])["affair_id"].tolist() == [1, 2, 3, 4]
+    assert data.families(districts=["САО"])["affair_id"].tolist() == [2]
+    assert data.families(["A"], date=True)["affair_id"].tolist() == [1]
+
+    sections = [{"address": "N", "sections": [{"section": "1", "range": {"from": 5, "to": 8}}, {"range": [11, 20]}]}]
+    assert data.new_aparts([sections])["new_apart_id"].tolist() == [12, 14]
+    assert data.new_aparts(sections, districts=["ЦАО"])["new_apart_id"].tolist() == [12]
+    # Все секции некорректны - дом целиком; не словари пропускаются
+    broken = [{"address": "M", "sections": [{"range": {"from": "x"}}]}, "N"]
+    assert data.new_aparts(broken)["new_apart_id"].tolist() == [11]
+    assert data.new_aparts(None)["new_apart_id"].tolist() == [10, 11, 12, 13, 14]
+
+
+def test_waves_apply_ranks_and_offers_without_touching_cached_snapshot():
+    data = snapshot()
+    df_old, df_new = data.families(["A"]), data.new_aparts([{"address": "N"}])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        df_old["rank"], df_new["rank"] = 5, 6
+
+    ranked = data.with_ranks(df_old, df_new).without_offers([(1, 10)])
+    assert ranked.families(["A"], columns=["affair_id", "rank"]).values.tolist() == [[3, 5]]
+    assert ranked.new_aparts([{"address": "N"}])["new_apart_id"].tolist() == [12, 13, 14]
+    assert data.families(["A"])["affair_id"].tolist() == [1, 3]
+    assert data.df_old_apart["rank"].isna().all()
+
+
+def test_cache_reloads_once_per_stamp():
+    stamps, loads = ["v1"], []
+
+    def load(cursor, stamp):
+        loads.append(stamp)
+        return Snapshot(stamp, snapshot().df_old_apart, snapshot().df_new_apart)
+
+    cache = SnapshotCache(load=load, stamp=lambda cursor: stamps[0])
+    threads = [threading.Thread(target=cache.get, args=(None,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loads == ["v1"]
+
+    stamps[0] = "v2"
+    assert cache.get(None).stamp == "v2" and cache.get(None).stamp == "v2"
+    assert loads == ["v1", "v2"]
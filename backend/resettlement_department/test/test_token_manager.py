@@ -0,0 +1,123 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from RSM.token_manager import RsmTokenManager, Token  # noqa: E402
+
+
+class SharedStore:
+    """Общее хранилище двух "воркеров": токен и блокировка входа."""
+
+    def __init__(self, token=None):
+        self.token = token
+        self._lock = threading.Lock()
+
+    def load(self):
+        return self.token
+
+    def save(self, token):
+        if token.stale:
+            if self.token is not None and self.token.value == token.value:
+                self.token = token
+            return
+        self.token = token
+
+    def lock(self):
+        return self._lock
+
+
+class FakeRsm:
+    def __init__(self, lifetime):
+        self.lifetime = lifetime
+        self.now = 0.0
+        self.issued = {}
+        self.logins = 0
+        self.pings = 0
+
+    def clock(self):
+        return self.now
+
+    def login(self):
+        time.sleep(0.05)
+        self.logins += 1
+        value = f"token-{self.logins}"
+        self.issued[value] = self.now
+        return value
+
+    def validate(self, value):
+        self.pings += 1
+        return self.now - self.issued.get(value, -1e9) < self.lifetime
+
+
+def manager(store, rsm, ttl=1000):
+    return RsmTokenManager(store, rsm.validate, rsm.login, ttl=ttl, refresh_margin=100, clock=rsm.clock)
+
+
+def test_warm_token_served_without_requests():
+    rsm = FakeRsm(lifetime=1000)
+    rsm.issued["warm"] = 0.0
+    rsm.now = 10
+    assert manager(SharedStore(Token("warm", 0.0)), rsm).get() == "warm"
+    assert rsm.logins == 0 and rsm.pings == 0
+
+
+def test_concurrent_callers_of_two_workers_log_in_once():
+    rsm = FakeRsm(lifetime=1000)
+    store = SharedStore()
+    workers = [manager(store, rsm), manager(store, rsm)]
+    results = []
+    threads = [
+        threading.Thread(target=lambda worker=worker: results.append(worker.get())) for worker in workers * 4
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert rsm.logins == 1
+    assert set(results) == {"token-1"}
+
+
+def test_background_refresh_before_expiry_and_observed_lifetime():
+    rsm = FakeRsm(lifetime=600)
+    store = SharedStore()
+    worker = manager(store, rsm)
+    assert worker.get() == "token-1"
+
+    # Срок по настройке 1000, но РСМ отверг токен в 700: срок уточняется до 700
+    rsm.now = 700
+    worker.expire("token-1")
+    assert worker.get() == "token-2"
+    assert worker.ttl == 700 and rsm.logins == 2
+
+    # За refresh_margin до срока старый токен отдается сразу, новый получается в фоне
+    rsm.now = 700 + 650
+    assert worker.get() == "token-2"
+    for _ in range(100):
+        if store.token.value == "token-3":
+            break
+        time.sleep(0.01)
+    assert store.token.value == "token-3" and rsm.logins == 3
+    assert worker.get() == "token-3"
+
+
+def test_token_rejected_early_is_dropped_everywhere():
+    rsm = FakeRsm(lifetime=60)
+    store = SharedStore()
+    worker = RsmTokenManager(store, rsm.validate, rsm.login, clock=rsm.clock)
+    other = RsmTokenManager(store, rsm.validate, rsm.login, clock=rsm.clock)
+    assert worker.get() == "token-1"
+
+    # Отвергнут в 60 с: срок не короче 2 * refresh_margin, но мертвый токен больше не отдается
+    rsm.now = 60
+    worker.expire("token-1")
+    assert worker.ttl == 1800 and store.token.stale
+    assert other.get() == "token-2"
+    assert worker.get() == "token-2"
+    assert rsm.logins == 2
+
+    # Повторный отказ уже замененного токена не трогает новый
+    worker.expire("token-1")
+    assert worker.get() == "token-2" and not store.token.stale
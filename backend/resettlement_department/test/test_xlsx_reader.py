@@ -0,0 +1,37 @@
+import io
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+
+from utils.xlsx_reader import iter_sheet, open_workbook, read_sheet  # noqa: E402
+
+
+def workbook():
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer) as writer:
+        pd.DataFrame(
+            {
+                "ID": [1, 2, None, 4, 5],
+                "Площадь": [40.0, 41.5, None, 50.0, 33.3],
+                "ФИО": ["Иванов", None, None, "Петров", "Сидоров"],
+                "Дата": [datetime(2024, 1, 2), None, None, datetime(2024, 3, 4), None],
+            }
+        ).to_excel(writer, sheet_name="old_apart", index=False)
+        pd.DataFrame({"УНОМ": []}).to_excel(writer, sheet_name="cin", index=False)
+    return buffer
+
+
+def test_batches_match_read_excel():
+    expected = pd.read_excel(workbook(), sheet_name="old_apart")
+    with open_workbook(workbook()) as book:
+        batches = list(iter_sheet(book, "old_apart", batch_size=2))
+        empty = list(iter_sheet(book, "cin"))
+
+    # Пустая строка внутри листа остается, как в pd.read_excel
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    pd.testing.assert_frame_equal(read_sheet(workbook(), "old_apart"), expected)
+    assert len(empty) == 1 and empty[0].empty and list(empty[0].columns) == ["УНОМ"]